@@ -0,0 +1,127 @@
+"""Run the same cached-lookup scenario against every cache backend and compare them in one table.
+
+For every CACHE_BACKEND the web container is recreated, the cache is seeded (seed_redis.py;
+the in-process lru backend warms up from the run itself) and the k6_redis scenario posts
+lookups to /api/links/redis. With --energy, codecarbon/k6_energy.py measures the web container
+over the same run; energy per request has the idle baseline (make energy-baseline) subtracted
+when k6/results/baseline_energy.json exists.
+
+Run from the repository root:
+
+    python3 bench/cache_backends.py --backends redis,lru,shm,postgres,none --energy
+"""
+import argparse
+import csv
+import json
+import time
+from pathlib import Path
+
+from compose import compose, recreate_web, wait_for_web
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / 'k6' / 'results'
+
+
+def load_json(path):
+    if not path.exists():
+        return None
+    with path.open() as f:
+        return json.load(f)
+
+
+def wait_for_file(path, timeout=600):
+    deadline = time.time() + timeout
+    while not path.exists():
+        if time.time() > deadline:
+            raise TimeoutError(f'{path} was not written in time')
+        time.sleep(1)
+
+
+def per_request_uwh(energy, baseline):
+    """Energy per request in µWh, minus the idle power over the run when a baseline was measured."""
+    total_kwh = energy.get('total_energy_kwh')
+    requests = energy.get('total_requests')
+    if total_kwh is None or not requests:
+        return None
+    if baseline and baseline.get('baseline_energy_kwh') and baseline.get('baseline_duration_seconds'):
+        idle_kwh_per_s = baseline['baseline_energy_kwh'] / baseline['baseline_duration_seconds']
+        total_kwh = max(total_kwh - idle_kwh_per_s * (energy.get('duration_seconds') or 0), 0)
+    return round(total_kwh * 1e9 / requests, 1)
+
+
+def run_backend(backend, args, baseline):
+    summary_csv = f'cache_{backend}.csv'
+    summary_json = f'cache_{backend}.json'
+    energy_json = f'energy_result_cache_{backend}.json'
+    for name in (summary_csv, summary_json, energy_json):
+        (RESULTS_DIR / name).unlink(missing_ok=True)
+
+    recreate_web({'CACHE_BACKEND': backend})
+    wait_for_web()
+    if not args.no_seed:
+        compose('exec', '-T', '-e', f'NUM_FIXED_URLS={args.links}', 'web', 'python', 'seed_redis.py')
+    if args.energy:
+        # Started first so it measures the whole run; it stops once the k6 summary is written
+        compose('exec', '-d', '-e', 'K6_SERVICE=k6_redis', '-e', f'SUMMARY_NAME={summary_csv}',
+                '-e', f'ENERGY_RESULT={energy_json}', 'web', 'python', 'codecarbon/k6_energy.py')
+    compose(
+        'run', '--rm',
+        '-e', f'VUS={args.vus}',
+        '-e', f'ITERATIONS={args.iterations}',
+        '-e', f'NUM_FIXED_URLS={args.links}',
+        '-e', f'SUMMARY_NAME={summary_csv}',
+        '-e', f'SUMMARY_JSON={summary_json}',
+        'k6_redis',
+        check=False,  # threshold failures still produce a summary
+    )
+    result = load_json(RESULTS_DIR / summary_json) or {}
+    row = {
+        'backend': backend,
+        'requests': result.get('total_requests', 0),
+        'rps': round(result.get('achieved_rps', 0), 1),
+        'avg_ms': round(result['avg_ms'], 2) if result.get('avg_ms') is not None else None,
+        'p95_ms': round(result['p95_ms'], 2) if result.get('p95_ms') is not None else None,
+        'p99_ms': round(result['p99_ms'], 2) if result.get('p99_ms') is not None else None,
+        'hit_pct': round(result['cache_hit_ratio'] * 100, 1) if result.get('cache_hit_ratio') is not None else None,
+        'error_pct': round(result.get('error_rate', 0) * 100, 2),
+    }
+    if args.energy:
+        wait_for_file(RESULTS_DIR / energy_json)
+        energy = load_json(RESULTS_DIR / energy_json)
+        row['energy_wh'] = round(energy['total_energy_kwh'] * 1000, 3) if energy.get('total_energy_kwh') else None
+        row['uwh_per_request'] = per_request_uwh(energy, baseline)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', default='redis,lru,shm,postgres,none')
+    parser.add_argument('--links', type=int, default=5000, help='Distinct URLs looked up (and seeded)')
+    parser.add_argument('--vus', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=2000, help='Iterations per VU')
+    parser.add_argument('--no-seed', action='store_true', help='Start every backend cold')
+    parser.add_argument('--energy', action='store_true', help='Measure energy with CodeCarbon during each run')
+    parser.add_argument('--out', default=str(RESULTS_DIR / 'cache_backends.csv'))
+    args = parser.parse_args()
+
+    baseline = load_json(RESULTS_DIR / 'baseline_energy.json')
+    rows = []
+    for backend in [b for b in args.backends.split(',') if b]:
+        print(f"[cache] CACHE_BACKEND={backend}")
+        rows.append(run_backend(backend, args, baseline))
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with out.open('w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    columns = list(rows[0].keys())
+    print(' '.join(f"{c:>15}" for c in columns))
+    for row in rows:
+        print(' '.join(f"{'n/a' if row[c] is None else row[c]!s:>15}" for c in columns))
+    print(f"Wrote {out}")
+
+
+if __name__ == '__main__':
+    main()
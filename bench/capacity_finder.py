@@ -0,0 +1,182 @@
+"""Find the highest arrival rate each server configuration sustains within a latency SLO.
+
+For every combination of gunicorn workers/threads, DB pool settings and cache on/off, the
+web container is recreated with that configuration and the k6 workload scenario is run
+at increasing constant arrival rates. A step passes when p95/p99 stay under the targets,
+the error rate stays low and k6 keeps up with the requested rate. The last passing step,
+optionally refined by bisection, is the capacity of that configuration.
+
+Run from the repository root:
+
+    python3 bench/capacity_finder.py --workers 2,4 --threads 1,2 --pool-size 10,20 --cache on,off
+"""
+import argparse
+import csv
+import itertools
+import json
+import time
+from pathlib import Path
+
+from compose import compose, recreate_web, wait_for_web
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / 'k6' / 'results'
+STEP_JSON = 'capacity_step.json'
+
+
+def csv_list(cast):
+    def parse(value):
+        return [cast(v) for v in value.split(',') if v != '']
+    return parse
+
+
+def on_off(value):
+    return value.lower() in ['on', 'true', '1', 't']
+
+
+def run_step(rate, args):
+    step_json = RESULTS_DIR / STEP_JSON
+    if step_json.exists():
+        step_json.unlink()
+    compose(
+        'run', '--rm',
+        '-e', f'RATE={rate}',
+        '-e', f'DURATION={args.step_duration}',
+        '-e', f'VUS={args.vus}',
+        '-e', f'MAX_VUS={args.max_vus}',
+        '-e', f'SUMMARY_JSON={STEP_JSON}',
+        '-e', 'SUMMARY_NAME=capacity_step.csv',
+        *sum((['-e', e] for e in args.k6_env), []),
+        'k6_workload',
+        check=False,  # k6 exits non-zero when its own thresholds fail; we judge the step ourselves
+    )
+    if not step_json.exists():
+        # k6 crashed or was stopped before writing its summary
+        return {}
+    with step_json.open() as f:
+        return json.load(f)
+
+
+def step_passes(result, rate, args):
+    if not result:
+        return False, ["k6 wrote no summary"]
+    reasons = []
+    if result.get('p95_ms') is None or result['p95_ms'] > args.p95:
+        reasons.append(f"p95 {result.get('p95_ms')} > {args.p95}")
+    if args.p99 and (result.get('p99_ms') is None or result['p99_ms'] > args.p99):
+        reasons.append(f"p99 {result.get('p99_ms')} > {args.p99}")
+    if result.get('error_rate') is None or result['error_rate'] > args.max_error_rate:
+        reasons.append(f"errors {result.get('error_rate')} > {args.max_error_rate}")
+    # The generator could not keep up: requests are queueing inside k6 instead of the server
+    if result.get('dropped_iterations', 0) > args.max_dropped * rate:
+        reasons.append(f"dropped {result.get('dropped_iterations')} iterations")
+    return not reasons, reasons
+
+
+def find_capacity(args):
+    best = None
+    rate = args.start_rps
+    failed_at = None
+    while rate <= args.max_rps:
+        result = run_step(rate, args)
+        ok, reasons = step_passes(result, rate, args)
+        achieved = result.get('achieved_rps')
+        print(f"[capacity]   {rate:>6} rps: p95={result.get('p95_ms')} p99={result.get('p99_ms')} "
+              f"achieved={round(achieved, 1) if achieved is not None else None} "
+              f"{'ok' if ok else 'FAIL ' + '; '.join(reasons)}")
+        if not ok:
+            failed_at = rate
+            break
+        best = (rate, result)
+        rate = max(rate + 1, int(rate * args.step_factor))
+
+    # Bisect between the last passing and the first failing rate
+    low = best[0] if best else 0
+    high = failed_at
+    for _ in range(args.refine):
+        if high is None or high - low <= max(1, low * 0.05):
+            break
+        mid = (low + high) // 2
+        result = run_step(mid, args)
+        ok, reasons = step_passes(result, mid, args)
+        print(f"[capacity]   {mid:>6} rps (refine): p95={result.get('p95_ms')} {'ok' if ok else 'FAIL'}")
+        if ok:
+            low, best = mid, (mid, result)
+        else:
+            high = mid
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=csv_list(int), default=[4])
+    parser.add_argument('--threads', type=csv_list(int), default=[2])
+    parser.add_argument('--pool-size', type=csv_list(int), default=[20])
+    parser.add_argument('--max-overflow', type=csv_list(int), default=[0])
+    parser.add_argument('--cache', type=csv_list(on_off), default=[True])
+    parser.add_argument('--p95', type=float, default=250.0, help='p95 latency target in ms')
+    parser.add_argument('--p99', type=float, default=0, help='p99 latency target in ms (0 = not checked)')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--max-dropped', type=float, default=0.01,
+                        help='Allowed dropped iterations as a fraction of one second of traffic')
+    parser.add_argument('--start-rps', type=int, default=50)
+    parser.add_argument('--max-rps', type=int, default=20000)
+    parser.add_argument('--step-factor', type=float, default=1.5)
+    parser.add_argument('--refine', type=int, default=3, help='Bisection steps after the first failure')
+    parser.add_argument('--step-duration', default='30s')
+    parser.add_argument('--vus', type=int, default=50, help='Pre-allocated k6 VUs')
+    parser.add_argument('--max-vus', type=int, default=1000)
+    parser.add_argument('--k6-env', action='append', default=[],
+                        help='Extra NAME=value passed to the workload scenario (repeatable)')
+    parser.add_argument('--out', default=str(RESULTS_DIR / 'capacity.csv'))
+    args = parser.parse_args()
+
+    rows = []
+    matrix = itertools.product(args.workers, args.threads, args.pool_size, args.max_overflow, args.cache)
+    for workers, threads, pool_size, max_overflow, cache in matrix:
+        config = {
+            'GUNICORN_WORKERS': workers,
+            'GUNICORN_THREADS': threads,
+            'DB_POOL_SIZE': pool_size,
+            'DB_MAX_OVERFLOW': max_overflow,
+            'CACHE_ENABLED': 'true' if cache else 'false',
+        }
+        print(f"[capacity] {config}")
+        recreate_web(config)
+        wait_for_web()
+        started = time.time()
+        best = find_capacity(args)
+        rate, result = best if best else (0, {})
+        rows.append({
+            'workers': workers,
+            'threads': threads,
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'cache': 'on' if cache else 'off',
+            'capacity_rps': rate,
+            'achieved_rps': round(result['achieved_rps'], 1) if result.get('achieved_rps') is not None else None,
+            'p95_ms': round(result['p95_ms'], 2) if result.get('p95_ms') is not None else None,
+            'p99_ms': round(result['p99_ms'], 2) if result.get('p99_ms') is not None else None,
+            'error_rate': round(result['error_rate'], 4) if result.get('error_rate') is not None else None,
+            'search_seconds': round(time.time() - started),
+        })
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with out.open('w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    # Console table
+    headers = list(rows[0].keys())
+    widths = [max(len(h), *(len(str(r[h])) for r in rows)) for h in headers]
+    print()
+    print('  '.join(h.ljust(w) for h, w in zip(headers, widths)))
+    for row in sorted(rows, key=lambda r: -r['capacity_rps']):
+        print('  '.join(str(row[h]).ljust(w) for h, w in zip(headers, widths)))
+    print(f"\n[capacity] SLO p95<{args.p95}ms" + (f" p99<{args.p99}ms" if args.p99 else "") + f"; written {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Helpers for driving the compose stack from benchmark scripts (mirrors the Makefile's runner detection)."""
+import os
+import shutil
+import subprocess
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+COMPOSE_FILE = ROOT / 'docker-compose.yml'
+
+
+def compose_cmd():
+    if shutil.which('podman-compose'):
+        return ['podman-compose']
+    return ['docker', 'compose']
+
+
+def compose(*args, check=True, env=None, capture=False):
+    run_env = dict(os.environ)
+    if env:
+        run_env.update({k: str(v) for k, v in env.items()})
+    return subprocess.run(
+        compose_cmd() + ['-f', str(COMPOSE_FILE), *args],
+        cwd=ROOT,
+        env=run_env,
+        check=check,
+        text=True,
+        capture_output=capture,
+    )
+
+
+def recreate_web(config):
+    """Restart the web service with the given environment overrides (see `environment:` in docker-compose.yml)."""
+    compose('up', '-d', '--force-recreate', '--no-deps', 'web', env=config)
+
+
+def wait_for_web(timeout=120):
+    probe = "import urllib.request; urllib.request.urlopen('http://localhost:8080/api/test', timeout=2)"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        # Any HTTP answer (even 401 from the API key check) means gunicorn is serving
+        result = compose('exec', '-T', 'web', 'python', '-c',
+                         f"import urllib.error\ntry:\n    {probe}\nexcept urllib.error.HTTPError:\n    pass",
+                         check=False, capture=True)
+        if result.returncode == 0:
+            return
+        time.sleep(1)
+    raise TimeoutError('web did not come up in time')
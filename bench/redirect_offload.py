@@ -0,0 +1,98 @@
+"""Measure how many redirects the origin stops serving under each redirect policy.
+
+For every REDIRECT_POLICY the web container is recreated and the k6 workload runs with
+CLIENT_CACHE=true, so each virtual user reuses redirects the way a browser would when
+Cache-Control allows it. Redirects go to CACHEABLE_LINKS unlimited links created by the
+scenario. Origin hits are taken from both sides: the redirects k6 actually sent, and the
+main.redirect_to_short_url counter of the in-app request metrics (REQUEST_METRICS).
+
+Run from the repository root:
+
+    python3 bench/redirect_offload.py --policies tracked,cacheable --max-age 86400
+"""
+import argparse
+import csv
+import json
+import time
+from pathlib import Path
+
+from compose import compose, recreate_web, wait_for_web
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / 'k6' / 'results'
+ENDPOINT_FIELD = 'main.redirect_to_short_url:count'
+
+
+def server_redirects():
+    result = compose('exec', '-T', 'redis', 'redis-cli', 'HGET', 'metrics:requests', ENDPOINT_FIELD,
+                     check=False, capture=True)
+    value = result.stdout.strip()
+    return int(value) if value.isdigit() else 0
+
+
+def run_policy(policy, args):
+    summary_json = f'offload_{policy}.json'
+    recreate_web({'REDIRECT_POLICY': policy, 'REDIRECT_MAX_AGE': args.max_age, 'REQUEST_METRICS': 'true'})
+    wait_for_web()
+    before = server_redirects()
+    compose(
+        'run', '--rm',
+        '-e', 'CLIENT_CACHE=true',
+        '-e', f'CACHEABLE_LINKS={args.links}',
+        '-e', 'WRITE_RATIO=0',
+        '-e', f'VUS={args.vus}',
+        '-e', f'ITERATIONS={args.iterations}',
+        '-e', f'SUMMARY_NAME=offload_{policy}.csv',
+        '-e', f'SUMMARY_JSON={summary_json}',
+        *sum((['-e', e] for e in args.k6_env), []),
+        'k6_workload',
+        check=False,  # threshold failures still produce a summary
+    )
+    # The in-app counters reach Redis on the next flush (REQUEST_METRICS_FLUSH_SECONDS, 1s by default)
+    time.sleep(3)
+    after = server_redirects()
+    with (RESULTS_DIR / summary_json).open() as f:
+        result = json.load(f)
+    clicks = result.get('redirect_requests', 0) + result.get('client_cached_redirects', 0)
+    return {
+        'policy': policy,
+        'max_age': args.max_age,
+        'clicks': clicks,
+        'origin_redirects': result.get('redirect_requests', 0),
+        'server_counted_redirects': after - before,
+        'client_cached_redirects': result.get('client_cached_redirects', 0),
+        'offload_pct': round(result.get('redirect_offload', 0) * 100, 1) if result.get('redirect_offload') is not None else None,
+        'redirect_p95_ms': round(result['redirect_p95_ms'], 2) if result.get('redirect_p95_ms') is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--policies', default='tracked,cacheable')
+    parser.add_argument('--max-age', type=int, default=86400, help='REDIRECT_MAX_AGE for the web container')
+    parser.add_argument('--links', type=int, default=1000, help='Unlimited links the scenario redirects to')
+    parser.add_argument('--vus', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=2000, help='Iterations per VU')
+    parser.add_argument('--k6-env', action='append', default=[],
+                        help='Extra NAME=value passed to the workload scenario (repeatable)')
+    parser.add_argument('--out', default=str(RESULTS_DIR / 'redirect_offload.csv'))
+    args = parser.parse_args()
+
+    rows = []
+    for policy in [p for p in args.policies.split(',') if p]:
+        print(f"[offload] REDIRECT_POLICY={policy}")
+        rows.append(run_policy(policy, args))
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with out.open('w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    for row in rows:
+        print(row)
+    print(f"Wrote {out}")
+
+
+if __name__ == '__main__':
+    main()
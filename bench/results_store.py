@@ -0,0 +1,380 @@
+"""History of load-test and energy results with regression gating.
+
+The files in k6/results are overwritten by every run, so `record` copies their metrics into a
+SQLite database together with the git commit, the server/workload configuration and an
+environment fingerprint. The other commands read the history back:
+
+    python3 bench/results_store.py record --label "pool 20"
+    python3 bench/results_store.py list
+    python3 bench/results_store.py diff 3 5
+    python3 bench/results_store.py trend 'workload.db.p95_ms'
+    python3 bench/results_store.py check            # latest vs previous run on the same machine
+
+`check` exits with status 1 when a metric regresses past its budget in bench/budgets.json.
+"""
+import argparse
+import csv
+import fnmatch
+import hashlib
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / 'k6' / 'results'
+DEFAULT_DB = RESULTS_DIR / 'history.sqlite'
+DEFAULT_BUDGETS = Path(__file__).resolve().parent / 'budgets.json'
+
+# Server and workload knobs worth keeping next to the numbers
+CONFIG_KEYS = [
+    'GUNICORN_WORKERS', 'GUNICORN_THREADS', 'GUNICORN_PRELOAD', 'DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT',
+    'CACHE_ENABLED', 'CACHE_BACKEND', 'REQUEST_METRICS', 'NUM_FIXED_URLS', 'ZIPF_S', 'REDIRECT_RATIO', 'WRITE_RATIO',
+    'WRITE_MIX', 'CACHE_HIT_RATIO', 'CLICK_LIMITED_RATIO', 'CLICK_LIMIT', 'VUS', 'ITERATIONS', 'RATE',
+    'REDIRECT_POLICY', 'REDIRECT_MAX_AGE', 'CLIENT_CACHE', 'CACHEABLE_LINKS', 'REDIS_NODES',
+]
+# Metrics where a bigger number is better; everything else (latency, energy) is lower-is-better
+HIGHER_IS_BETTER = ['*rps', '*throughput*', '*cache_hit_ratio']
+
+SUMMARY_ROWS = {
+    'Avg Latency (ms)': 'avg_ms',
+    'Median Latency (ms)': 'med_ms',
+    'p(90) Latency (ms)': 'p90_ms',
+    'p(95) Latency (ms)': 'p95_ms',
+    'Redirect p(95) Latency (ms)': 'redirect_p95_ms',
+    'Write p(95) Latency (ms)': 'write_p95_ms',
+    'Cache Hit Ratio': 'cache_hit_ratio',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    label TEXT,
+    git_commit TEXT,
+    git_dirty INTEGER,
+    config TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    env_fingerprint TEXT NOT NULL,
+    sources TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (run_id, name)
+);
+"""
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def to_float(value):
+    try:
+        return float(str(value).strip().rstrip('%'))
+    except (TypeError, ValueError):
+        return None
+
+
+# ---- Collecting metrics from k6/results ----------------------------------------------------------
+
+def parse_summary_csv(path):
+    """k6 summaries: 'Metric,DB-only,Redis Cache,...' rows -> {scenario.column.metric: value}."""
+    scenario = path.stem.replace('_summary', '').replace('_only', '')
+    metrics = {}
+    with path.open(newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            if row[0] == 'Total User Requests':
+                values = [to_float(v) or 0 for v in row[1:3]]
+                metrics[f'{scenario}.requests'] = sum(values)
+            elif row[0] in SUMMARY_ROWS:
+                name = SUMMARY_ROWS[row[0]]
+                for column, value in (('db', row[1]), ('cache', row[2])):
+                    value = to_float(value)
+                    if value is not None:
+                        metrics[f'{scenario}.{column}.{name}'] = value
+    return metrics
+
+
+def parse_energy_json(path):
+    data = json.loads(path.read_text())
+    scenario = data.get('scenario') or path.stem.replace('energy_result_', '')
+    metrics = {}
+    for key in ('total_energy_kwh', 'energy_per_request_kwh', 'duration_seconds', 'total_requests'):
+        if data.get(key) is not None:
+            metrics[f'energy.{scenario}.{key}'] = float(data[key])
+    if data.get('total_requests') and data.get('duration_seconds'):
+        metrics[f'energy.{scenario}.throughput_rps'] = data['total_requests'] / data['duration_seconds']
+    return metrics
+
+
+def parse_endpoint_energy(path):
+    data = json.loads(path.read_text())
+    metrics = {}
+    for row in data.get('endpoints', []):
+        if row.get('j_per_request') is not None:
+            metrics[f"endpoints.{row['phase']}.{row['endpoint']}.j_per_request"] = row['j_per_request']
+    return metrics
+
+
+def parse_capacity_csv(path):
+    metrics = {}
+    with path.open(newline='') as f:
+        for row in csv.DictReader(f):
+            config = f"{row['workers']}w{row['threads']}t-pool{row['pool_size']}+{row['max_overflow']}-cache_{row['cache']}"
+            metrics[f'capacity.{config}.rps'] = float(row['capacity_rps'])
+    return metrics
+
+
+PARSERS = [
+    ('*_summary.csv', parse_summary_csv),
+    ('energy_result_*.json', parse_energy_json),
+    ('endpoint_energy.json', parse_endpoint_energy),
+    ('capacity.csv', parse_capacity_csv),
+]
+
+
+def collect(results_dir, max_age_minutes):
+    metrics = {}
+    sources = []
+    now = time.time()
+    for pattern, parser in PARSERS:
+        for path in sorted(results_dir.glob(pattern)):
+            # Files left over from older runs would otherwise be attributed to this one
+            if max_age_minutes and now - path.stat().st_mtime > max_age_minutes * 60:
+                continue
+            try:
+                metrics.update(parser(path))
+                sources.append(path.name)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[results] Skipping {path.name}: {e}", file=sys.stderr)
+    return metrics, sources
+
+
+def git_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def read_dotenv():
+    values = {}
+    env_path = ROOT / '.env'
+    if env_path.exists():
+        for line in env_path.read_text().splitlines():
+            if '=' in line and not line.lstrip().startswith('#'):
+                key, _, value = line.partition('=')
+                values[key.strip()] = value.strip()
+    return values
+
+
+def run_config(overrides):
+    dotenv = read_dotenv()
+    config = {}
+    for key in CONFIG_KEYS:
+        value = os.environ.get(key, dotenv.get(key))
+        if value is not None:
+            config[key] = value
+    for item in overrides:
+        key, _, value = item.partition('=')
+        config[key] = value
+    return config
+
+
+def environment():
+    memory_kb = None
+    try:
+        with open('/proc/meminfo') as f:
+            memory_kb = int(f.readline().split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    env = {
+        'hostname': platform.node(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'memory_kb': memory_kb,
+        'python': platform.python_version(),
+    }
+    fingerprint = hashlib.sha1(json.dumps(env, sort_keys=True).encode()).hexdigest()[:12]
+    return env, fingerprint
+
+
+# ---- Commands ------------------------------------------------------------------------------------
+
+def cmd_record(conn, args):
+    metrics, sources = collect(Path(args.results_dir), args.max_age)
+    if not metrics:
+        print("[results] No result files found; nothing recorded", file=sys.stderr)
+        return 1
+    commit, dirty = git_info()
+    env, fingerprint = environment()
+    cur = conn.execute(
+        "INSERT INTO runs (created_at, label, git_commit, git_dirty, config, environment, env_fingerprint, sources) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), args.label, commit, dirty,
+         json.dumps(run_config(args.config), sort_keys=True), json.dumps(env, sort_keys=True), fingerprint,
+         json.dumps(sources)),
+    )
+    conn.executemany("INSERT INTO metrics (run_id, name, value) VALUES (?, ?, ?)",
+                     [(cur.lastrowid, name, value) for name, value in metrics.items()])
+    conn.commit()
+    print(f"[results] Recorded run {cur.lastrowid}: {len(metrics)} metrics from {', '.join(sources)}")
+    return 0
+
+
+def cmd_list(conn, args):
+    rows = conn.execute(
+        "SELECT r.*, COUNT(m.name) AS n FROM runs r LEFT JOIN metrics m ON m.run_id = r.id "
+        "GROUP BY r.id ORDER BY r.id DESC LIMIT ?", (args.limit,)).fetchall()
+    for r in rows:
+        commit = (r['git_commit'] or '-')[:8] + ('*' if r['git_dirty'] else '')
+        print(f"{r['id']:>4}  {r['created_at']}  {commit:<9}  env={r['env_fingerprint']}  {r['n']:>3} metrics  {r['label'] or ''}")
+    return 0
+
+
+def load_metrics(conn, run_id):
+    return {r['name']: r['value'] for r in conn.execute("SELECT name, value FROM metrics WHERE run_id = ?", (run_id,))}
+
+
+def higher_is_better(name):
+    return any(fnmatch.fnmatch(name, p) for p in HIGHER_IS_BETTER)
+
+
+def change_percent(name, old, new):
+    """Signed change where positive always means worse."""
+    if not old:
+        return None
+    change = (new - old) / abs(old) * 100
+    # + 0.0 folds -0.0 into 0.0 for display
+    return (-change if higher_is_better(name) else change) + 0.0
+
+
+def cmd_diff(conn, args):
+    old, new = load_metrics(conn, args.a), load_metrics(conn, args.b)
+    names = sorted(set(old) | set(new))
+    if args.match:
+        names = [n for n in names if fnmatch.fnmatch(n, args.match)]
+    width = max((len(n) for n in names), default=10)
+    print(f"{'metric'.ljust(width)}  {'run ' + str(args.a):>14}  {'run ' + str(args.b):>14}  {'worse by':>9}")
+    for name in names:
+        a, b = old.get(name), new.get(name)
+        change = change_percent(name, a, b) if a is not None and b is not None else None
+        print(f"{name.ljust(width)}  {fmt(a):>14}  {fmt(b):>14}  {(f'{change:+.1f}%' if change is not None else '-'):>9}")
+    return 0
+
+
+def cmd_trend(conn, args):
+    rows = conn.execute(
+        "SELECT r.id, r.created_at, r.git_commit, r.label, m.name, m.value FROM metrics m JOIN runs r ON r.id = m.run_id "
+        "WHERE m.name GLOB ? ORDER BY m.name, r.id DESC", (args.metric,)).fetchall()
+    current = None
+    shown = 0
+    for r in rows:
+        if r['name'] != current:
+            current, shown = r['name'], 0
+            print(f"\n{current}")
+        if shown >= args.limit:
+            continue
+        shown += 1
+        print(f"  run {r['id']:>4}  {r['created_at']}  {(r['git_commit'] or '-')[:8]}  {fmt(r['value']):>14}  {r['label'] or ''}")
+    return 0
+
+
+def cmd_check(conn, args):
+    budgets = json.loads(Path(args.budgets).read_text())
+    latest = conn.execute("SELECT * FROM runs ORDER BY id DESC LIMIT 1").fetchone() if args.run is None else \
+        conn.execute("SELECT * FROM runs WHERE id = ?", (args.run,)).fetchone()
+    if latest is None:
+        print("[results] No runs recorded", file=sys.stderr)
+        return 1
+    if args.baseline is not None:
+        baseline = conn.execute("SELECT * FROM runs WHERE id = ?", (args.baseline,)).fetchone()
+    else:
+        # Only compare like with like: same machine, earlier run
+        baseline = conn.execute(
+            "SELECT * FROM runs WHERE id < ? AND env_fingerprint = ? ORDER BY id DESC LIMIT 1",
+            (latest['id'], latest['env_fingerprint'])).fetchone()
+    if baseline is None:
+        print(f"[results] No earlier run on environment {latest['env_fingerprint']} to compare run {latest['id']} with")
+        return 0
+    old, new = load_metrics(conn, baseline['id']), load_metrics(conn, latest['id'])
+    failures = []
+    for name in sorted(set(old) & set(new)):
+        budget = next((limit for pattern, limit in budgets.items() if fnmatch.fnmatch(name, pattern)), None)
+        if budget is None:
+            continue
+        change = change_percent(name, old[name], new[name])
+        if change is not None and change > budget:
+            failures.append((name, old[name], new[name], change, budget))
+    print(f"[results] Run {latest['id']} vs run {baseline['id']}: {len(failures)} regression(s) over budget")
+    for name, a, b, change, budget in failures:
+        print(f"  {name}: {fmt(a)} -> {fmt(b)} ({change:+.1f}% worse, budget {budget}%)")
+    return 1 if failures else 0
+
+
+def fmt(value):
+    if value is None:
+        return '-'
+    if value != 0 and abs(value) < 0.001:
+        return f"{value:.3e}"
+    return f"{value:.3f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=str(DEFAULT_DB))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('record', help='Store the metrics currently in k6/results as a new run')
+    p.add_argument('--label')
+    p.add_argument('--config', action='append', default=[], help='Extra KEY=value to store with the run')
+    p.add_argument('--results-dir', default=str(RESULTS_DIR))
+    p.add_argument('--max-age', type=float, default=240, help='Ignore result files older than this many minutes (0 = none)')
+    p.set_defaults(func=cmd_record)
+
+    p = sub.add_parser('list', help='Show recorded runs')
+    p.add_argument('--limit', type=int, default=20)
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser('diff', help='Compare two runs metric by metric')
+    p.add_argument('a', type=int)
+    p.add_argument('b', type=int)
+    p.add_argument('--match', help='Only metrics matching this glob')
+    p.set_defaults(func=cmd_diff)
+
+    p = sub.add_parser('trend', help='Show a metric (glob) across runs')
+    p.add_argument('metric')
+    p.add_argument('--limit', type=int, default=20)
+    p.set_defaults(func=cmd_trend)
+
+    p = sub.add_parser('check', help='Exit non-zero if a run regresses past the budgets')
+    p.add_argument('--run', type=int, help='Run to check (default: latest)')
+    p.add_argument('--baseline', type=int, help='Run to compare with (default: previous run on the same environment)')
+    p.add_argument('--budgets', default=str(DEFAULT_BUDGETS))
+    p.set_defaults(func=cmd_check)
+
+    args = parser.parse_args()
+    Path(args.db).parent.mkdir(parents=True, exist_ok=True)
+    with connect(args.db) as conn:
+        sys.exit(args.func(conn, args))
+
+
+if __name__ == '__main__':
+    main()
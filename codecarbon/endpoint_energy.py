@@ -0,0 +1,165 @@
+import os
+import csv
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import redis
+from codecarbon import EmissionsTracker
+
+RESULTS_DIR = Path('/usr/src/app/k6/results')
+# Written by the caller (see `make energy-endpoints`): the name of the running phase, or "stop"
+PHASE_FILE = RESULTS_DIR / 'energy_phase'
+# Written by this script: baseline -> sampling -> done
+STATUS_FILE = RESULTS_DIR / 'energy_sampler.status'
+WINDOW_SECONDS = float(os.environ.get('ENERGY_WINDOW_SECONDS', '5'))
+BASELINE_SECONDS = int(os.environ.get('BASELINE_DURATION', '30'))
+MAX_SECONDS = int(os.environ.get('ENERGY_MAX_SECONDS', '3600'))
+# Same hash the app's RequestMetrics flushes into (project/metrics.py)
+METRICS_KEY = "metrics:requests"
+KWH_TO_J = 3_600_000
+
+redis_client = redis.Redis(
+    host=os.environ.get("REDIS_HOST", "redis"),
+    port=int(os.environ.get("REDIS_PORT", 6379)),
+    db=0,
+    decode_responses=True
+)
+
+
+def read_counters():
+    totals = defaultdict(lambda: {'count': 0, 'wall_ns': 0, 'cpu_ns': 0})
+    for field, value in redis_client.hgetall(METRICS_KEY).items():
+        endpoint, _, name = field.rpartition(':')
+        totals[endpoint][name] = int(value)
+    return totals
+
+
+def delta(after, before):
+    out = {}
+    for endpoint, values in after.items():
+        prev = before.get(endpoint, {})
+        d = {k: v - prev.get(k, 0) for k, v in values.items()}
+        if d['count'] > 0:
+            out[endpoint] = d
+    return out
+
+
+def current_phase():
+    try:
+        return PHASE_FILE.read_text().strip() or 'idle'
+    except FileNotFoundError:
+        return 'idle'
+
+
+def write_status(status):
+    STATUS_FILE.write_text(status)
+
+
+def measure_window(tracker, name, seconds):
+    tracker.start_task(name)
+    time.sleep(seconds)
+    data = tracker.stop_task()
+    return (data.energy_consumed or 0) * KWH_TO_J, data.duration or seconds
+
+
+def main():
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    tracker = EmissionsTracker(
+        project_name="url-shortener-endpoints",
+        output_dir=str(RESULTS_DIR),
+        measure_power_secs=1,
+        save_to_file=True,
+        gpu_ids=[],
+    )
+
+    # Idle power first, inside the same tracking session as the phases
+    write_status('baseline')
+    baseline_j, baseline_secs = measure_window(tracker, 'baseline', BASELINE_SECONDS)
+    baseline_w = baseline_j / baseline_secs if baseline_secs else 0
+    print(f"[endpoints] Baseline: {baseline_w:.2f} W over {baseline_secs:.0f}s")
+
+    # phase -> endpoint -> accumulated values
+    phases = defaultdict(lambda: defaultdict(lambda: {'requests': 0, 'cpu_ns': 0, 'wall_ns': 0, 'energy_j': 0.0}))
+    phase_totals = defaultdict(lambda: {'seconds': 0.0, 'energy_j': 0.0, 'adjusted_j': 0.0})
+    write_status('sampling')
+    before = read_counters()
+    started = time.time()
+    window = 0
+    while time.time() - started < MAX_SECONDS:
+        phase = current_phase()
+        if phase == 'stop':
+            break
+        window_j, window_secs = measure_window(tracker, f"{phase}-{window}", WINDOW_SECONDS)
+        window += 1
+        # Counters are flushed by the app every second or so; the lag evens out across windows
+        after = read_counters()
+        requests = delta(after, before)
+        before = after
+
+        adjusted_j = max(window_j - baseline_w * window_secs, 0)
+        totals = phase_totals[phase]
+        totals['seconds'] += window_secs
+        totals['energy_j'] += window_j
+        totals['adjusted_j'] += adjusted_j
+
+        # Split the window's workload energy by each endpoint's share of app CPU time
+        cpu_total = sum(v['cpu_ns'] for v in requests.values())
+        count_total = sum(v['count'] for v in requests.values())
+        for endpoint, values in requests.items():
+            if cpu_total:
+                share = values['cpu_ns'] / cpu_total
+            else:
+                share = values['count'] / count_total
+            acc = phases[phase][endpoint]
+            acc['requests'] += values['count']
+            acc['cpu_ns'] += values['cpu_ns']
+            acc['wall_ns'] += values['wall_ns']
+            acc['energy_j'] += adjusted_j * share
+        print(f"[endpoints] {phase} window {window}: {window_j:.1f} J ({adjusted_j:.1f} J above baseline), "
+              f"{count_total} requests")
+    tracker.stop()
+
+    rows = []
+    for phase, endpoints in phases.items():
+        for endpoint, acc in sorted(endpoints.items()):
+            rows.append({
+                'phase': phase,
+                'endpoint': endpoint,
+                'requests': acc['requests'],
+                'cpu_seconds': round(acc['cpu_ns'] / 1e9, 3),
+                'avg_latency_ms': round(acc['wall_ns'] / acc['requests'] / 1e6, 3) if acc['requests'] else None,
+                'energy_j': round(acc['energy_j'], 3),
+                'j_per_request': acc['energy_j'] / acc['requests'] if acc['requests'] else None,
+            })
+
+    out_csv = RESULTS_DIR / 'endpoint_energy.csv'
+    with out_csv.open('w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['phase', 'endpoint', 'requests', 'cpu_seconds',
+                                               'avg_latency_ms', 'energy_j', 'j_per_request'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    out_json = RESULTS_DIR / 'endpoint_energy.json'
+    data = {
+        "baseline_watts": baseline_w,
+        "baseline_duration_seconds": baseline_secs,
+        "window_seconds": WINDOW_SECONDS,
+        "phases": {phase: dict(totals) for phase, totals in phase_totals.items()},
+        "endpoints": rows,
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+    with out_json.open('w') as f:
+        json.dump(data, f, indent=2)
+
+    # Console summary
+    for row in rows:
+        per_req = f"{row['j_per_request'] * 1000:.3f} mJ/req" if row['j_per_request'] is not None else "n/a"
+        print(f"[endpoints] {row['phase']:<12} {row['endpoint']:<40} {row['requests']:>8} reqs  {per_req}")
+    print(f"[endpoints] Written {out_csv} and {out_json}")
+    write_status('done')
+
+
+if __name__ == '__main__':
+    main()
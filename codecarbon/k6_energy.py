@@ -14,7 +14,9 @@ def pick_summary_path() -> Path:
     if svc == "k6_db":
         return RESULTS_DIR / 'db_only_summary.csv'
     elif svc == "k6_redis":
-        return RESULTS_DIR / 'redis_only_summary.csv'
+        return RESULTS_DIR / os.environ.get('SUMMARY_NAME', 'redis_only_summary.csv')
+    elif svc == "k6_workload":
+        return RESULTS_DIR / os.environ.get('SUMMARY_NAME', 'workload_summary.csv')
     else:
         return RESULTS_DIR / 'performance_summary.csv'
 
@@ -103,7 +105,8 @@ def main():
     per_request_kwh = (total_energy_kwh / total_requests) if (total_energy_kwh and total_requests) else None
 
     svc = os.environ.get("K6_SERVICE", "k6")
-    out_json = RESULTS_DIR / f'energy_result_{svc}.json'
+    # ENERGY_RESULT names the output when one scenario is measured several times (bench/cache_backends.py)
+    out_json = RESULTS_DIR / os.environ.get('ENERGY_RESULT', f'energy_result_{svc}.json')
     data = {
         "duration_seconds": duration,
         "co2e_kg": co2e_kg,
@@ -0,0 +1,342 @@
+import http from 'k6/http';
+import { sleep, check } from 'k6';
+import { Counter, Rate, Trend } from 'k6/metrics';
+
+// Metrics
+let reqsOrigin = new Counter('origin_reqs');
+let reqsCached = new Counter('cached_reqs');
+let reqsRedirect = new Counter('redirect_reqs');
+let reqsRefused = new Counter('refused_redirects');
+let reqsClientCached = new Counter('client_cached_redirects');
+let reqsWrite = new Counter('write_reqs');
+let latOrigin = new Trend('origin_latency', true);
+let latCached = new Trend('cached_latency', true);
+let latRedirect = new Trend('redirect_latency', true);
+let latLookup = new Trend('lookup_latency', true);
+let latWrite = new Trend('write_latency', true);
+let cacheHits = new Rate('cache_hit_ratio');
+
+// Configuration (override with `-e NAME=value` or the container environment)
+function envNumber(name, fallback) {
+    const value = __ENV[name];
+    return value === undefined || value === '' ? fallback : Number(value);
+}
+
+const BASE_URL = __ENV.BASE_URL || 'http://web:8080';
+const API_KEY = __ENV.API_KEY || 'CHANGEME';
+const NUM_FIXED_URLS = envNumber('NUM_FIXED_URLS', 5000);  // Seeded links t0..t{N-1} -> https://example.com/{i}
+const ZIPF_S = envNumber('ZIPF_S', 1.0);                    // 0 = uniform, ~1 = web-like popularity skew
+const REDIRECT_RATIO = envNumber('REDIRECT_RATIO', 0.9);    // Share of reads that follow a short link
+const WRITE_RATIO = envNumber('WRITE_RATIO', 0.02);         // Share of all requests that create/edit/delete
+const WRITE_MIX = (__ENV.WRITE_MIX || '60,30,10').split(',').map(Number);  // create,edit,delete weights
+const CACHE_HIT_RATIO = envNumber('CACHE_HIT_RATIO', 0.8);  // Share of by_long lookups aimed at cached URLs
+const CLICK_LIMITED_RATIO = envNumber('CLICK_LIMITED_RATIO', 0.2);  // Share of created links with max clicks
+const CLICK_LIMIT = envNumber('CLICK_LIMIT', 50);
+// Reuse redirects the way a browser would, honouring Cache-Control, to measure origin offload
+const CLIENT_CACHE = ['true', '1', 't'].includes((__ENV.CLIENT_CACHE || 'false').toLowerCase());
+// > 0: redirects go to this many unlimited, non-expiring links created in setup() instead of the
+// seeded ones (which are click-limited and expiring, so never cacheable)
+const CACHEABLE_LINKS = envNumber('CACHEABLE_LINKS', 0);
+const VUS = envNumber('VUS', 5);
+const ITERATIONS = envNumber('ITERATIONS', 1000);
+const THINK_TIME = envNumber('THINK_TIME', 0.01);
+const RATE = envNumber('RATE', 0);                          // > 0 switches to an open model at RATE iterations/s
+const DURATION = __ENV.DURATION || '60s';
+const MAX_VUS = envNumber('MAX_VUS', 500);
+const SUMMARY_NAME = __ENV.SUMMARY_NAME || 'workload_summary.csv';
+const SUMMARY_JSON = __ENV.SUMMARY_JSON || '';              // Optional machine-readable summary for bench/ drivers
+
+const API_HEADERS = { headers: { Authorization: API_KEY, 'Content-Type': 'application/json' } };
+// A lookup for a URL that was never shortened answers 404: a miss, not a failed request
+const LOOKUP_STATUSES = http.expectedStatuses({ min: 200, max: 399 }, 404);
+
+// Zipf popularity over the seeded links. The CDF is built once per VU in the init context.
+const zipfCdf = (function () {
+    const cdf = new Float64Array(NUM_FIXED_URLS);
+    let total = 0;
+    for (let rank = 0; rank < NUM_FIXED_URLS; rank++) {
+        total += 1 / Math.pow(rank + 1, ZIPF_S);
+        cdf[rank] = total;
+    }
+    for (let rank = 0; rank < NUM_FIXED_URLS; rank++) {
+        cdf[rank] /= total;
+    }
+    return cdf;
+})();
+
+// Spread popular ranks over the id space so the hot links are not all neighbours in the table
+const RANK_STRIDE = pickStride(NUM_FIXED_URLS);
+
+function gcd(a, b) {
+    return b === 0 ? a : gcd(b, a % b);
+}
+
+function pickStride(n) {
+    let stride = Math.floor(n * 0.618) || 1;
+    while (gcd(stride, n) !== 1) {
+        stride++;
+    }
+    return stride;
+}
+
+function zipfId() {
+    const u = Math.random();
+    let lo = 0;
+    let hi = NUM_FIXED_URLS - 1;
+    while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (zipfCdf[mid] < u) lo = mid + 1;
+        else hi = mid;
+    }
+    return (lo * RANK_STRIDE) % NUM_FIXED_URLS;
+}
+
+function pickWeighted(weights) {
+    const total = weights.reduce((a, b) => a + b, 0);
+    let u = Math.random() * total;
+    for (let i = 0; i < weights.length; i++) {
+        u -= weights[i];
+        if (u < 0) return i;
+    }
+    return weights.length - 1;
+}
+
+// Links created by this VU, so edits and deletes never touch the seeded data set
+let ownLinks = [];
+
+// Closed model (fixed VUs x iterations) by default, constant arrival rate when RATE is set
+const workloadScenario = RATE > 0 ? {
+    executor: 'constant-arrival-rate',
+    rate: RATE,
+    timeUnit: '1s',
+    duration: DURATION,
+    preAllocatedVUs: VUS,
+    maxVUs: MAX_VUS,
+    exec: 'workload',
+} : {
+    executor: 'per-vu-iterations',
+    vus: VUS,
+    iterations: ITERATIONS,
+    exec: 'workload',
+};
+
+// K6 options
+export let options = {
+    scenarios: {
+        workload: workloadScenario,
+    },
+    summaryTrendStats: ['avg', 'min', 'med', 'max', 'p(90)', 'p(95)', 'p(99)'],
+    thresholds: {
+        'redirect_latency': ['p(95)<250'],
+        'cached_latency': ['p(95)<100'],
+    },
+};
+
+function recordOrigin(res) {
+    reqsOrigin.add(1);
+    latOrigin.add(res.timings.duration);
+}
+
+// Per-VU redirect cache (alias -> expiry in ms), like one browser per virtual user
+const redirectCache = {};
+
+function cacheRedirect(alias, res) {
+    const cacheControl = (res.headers['Cache-Control'] || '').toLowerCase();
+    const maxAge = /max-age=(\d+)/.exec(cacheControl);
+    if (maxAge && !cacheControl.includes('no-store') && Number(maxAge[1]) > 0) {
+        redirectCache[alias] = Date.now() + Number(maxAge[1]) * 1000;
+    }
+}
+
+function redirect(data) {
+    // Mostly popular seeded links, occasionally one of our own (possibly click-limited) links
+    let alias = `t${zipfId()}`;
+    if (data.links.length) {
+        alias = data.links[zipfId() % data.links.length].alias;
+    }
+    if (ownLinks.length && Math.random() < 0.1) {
+        alias = ownLinks[Math.floor(Math.random() * ownLinks.length)].alias;
+    }
+    if (CLIENT_CACHE && redirectCache[alias] > Date.now()) {
+        // Served from the client's cache, the origin never sees this click
+        reqsClientCached.add(1);
+        return;
+    }
+    const res = http.get(`${BASE_URL}/${alias}`, { redirects: 0, tags: { name: 'redirect' } });
+    reqsRedirect.add(1);
+    latRedirect.add(res.timings.duration);
+    recordOrigin(res);
+    // Used-up, expired and unknown links bounce back to the index page
+    const location = res.headers['Location'] || '';
+    if (location === '/' || location.endsWith(`${BASE_URL}/`)) {
+        reqsRefused.add(1);
+    } else if (CLIENT_CACHE) {
+        cacheRedirect(alias, res);
+    }
+    check(res, { 'redirect 30x': (r) => [301, 302, 307, 308].includes(r.status) });
+}
+
+function lookup() {
+    // Cached lookups use the seeded URLs; misses use a URL that is never cached
+    let url = `https://example.com/${zipfId()}`;
+    const wantHit = Math.random() < CACHE_HIT_RATIO;
+    if (!wantHit) {
+        url = `${url}?miss=${__VU}-${__ITER}`;
+    }
+    const res = http.post(`${BASE_URL}/api/links/redis`, JSON.stringify({ original_url: url }),
+        Object.assign({ tags: { name: 'lookup' }, responseCallback: LOOKUP_STATUSES }, API_HEADERS));
+    latLookup.add(res.timings.duration);
+    let cached = false;
+    if (res.status === 200) {
+        cached = res.json('cached') === true;
+    }
+    cacheHits.add(cached);
+    if (cached) {
+        reqsCached.add(1);
+        latCached.add(res.timings.duration);
+    } else {
+        recordOrigin(res);
+    }
+    check(res, { 'lookup 200/404': (r) => r.status === 200 || r.status === 404 });
+}
+
+function create() {
+    const alias = `w${__VU}-${__ITER}-${Math.floor(Math.random() * 1e6)}`;
+    const body = { url: `https://example.org/${alias}`, alias: alias };
+    if (Math.random() < CLICK_LIMITED_RATIO) {
+        body.max_click_count = CLICK_LIMIT;
+    }
+    const res = http.post(`${BASE_URL}/api/links`, JSON.stringify(body),
+        Object.assign({ tags: { name: 'create' } }, API_HEADERS));
+    if (res.status === 201) {
+        ownLinks.push({ id: res.json('link.id'), alias: alias, body: body });
+    }
+    return res;
+}
+
+function edit() {
+    if (!ownLinks.length) return create();
+    const link = ownLinks[Math.floor(Math.random() * ownLinks.length)];
+    const body = Object.assign({}, link.body, { url: `https://example.org/${link.alias}?v=${__ITER}` });
+    return http.put(`${BASE_URL}/api/links/${link.id}`, JSON.stringify(body),
+        Object.assign({ tags: { name: 'edit' } }, API_HEADERS));
+}
+
+function remove() {
+    if (!ownLinks.length) return create();
+    const link = ownLinks.splice(Math.floor(Math.random() * ownLinks.length), 1)[0];
+    return http.del(`${BASE_URL}/api/links/${link.id}`, null,
+        Object.assign({ tags: { name: 'delete' } }, API_HEADERS));
+}
+
+function write() {
+    const res = [create, edit, remove][pickWeighted(WRITE_MIX)]();
+    reqsWrite.add(1);
+    latWrite.add(res.timings.duration);
+    recordOrigin(res);
+    check(res, { 'write 2xx': (r) => r.status >= 200 && r.status < 300 });
+}
+
+export function setup() {
+    const links = [];
+    const run = Date.now().toString(36);
+    for (let start = 0; start < CACHEABLE_LINKS; start += 100) {
+        const batch = [];
+        for (let i = start; i < Math.min(start + 100, CACHEABLE_LINKS); i++) {
+            const body = { url: `https://example.net/${run}/${i}`, alias: `u${run}-${i}` };
+            batch.push(['POST', `${BASE_URL}/api/links`, JSON.stringify(body), API_HEADERS]);
+        }
+        for (const res of http.batch(batch)) {
+            if (res.status === 201) {
+                links.push({ id: res.json('link.id'), alias: res.json('link.short_url') });
+            }
+        }
+    }
+    return { links: links };
+}
+
+export function teardown(data) {
+    // Soft delete: the links have visits, which a hard delete would refuse
+    for (const link of data.links) {
+        http.del(`${BASE_URL}/api/links/${link.id}`, null, API_HEADERS);
+    }
+}
+
+// Mixed scenario
+export function workload(data) {
+    if (Math.random() < WRITE_RATIO) {
+        write();
+    } else if (Math.random() < REDIRECT_RATIO) {
+        redirect(data);
+    } else {
+        lookup();
+    }
+    // The arrival-rate executor paces iterations itself
+    if (!RATE) {
+        sleep(THINK_TIME);
+    }
+}
+
+// Custom summary, in the same shape as the other scenarios so the energy tooling can read it
+export function handleSummary(data) {
+    const origin = data.metrics['origin_latency']?.values || {};
+    const cached = data.metrics['cached_latency']?.values || {};
+    const redirects = data.metrics['redirect_latency']?.values || {};
+    const writes = data.metrics['write_latency']?.values || {};
+    const count = (name) => data.metrics[name]?.values.count || 0;
+    const fixed = (value) => (value === undefined ? 'N/A' : value.toFixed(2));
+    const hitRatio = data.metrics['cache_hit_ratio']?.values.rate;
+    const clicks = count('redirect_reqs') + count('client_cached_redirects');
+    const offload = clicks ? count('client_cached_redirects') / clicks : undefined;
+
+    function compare(originValue, cachedValue) {
+        if (!originValue || !cachedValue) return '-';
+        const percent = ((1 - cachedValue / originValue) * 100).toFixed(1);
+        if (percent > 0) return `+${percent}%`;
+        if (percent < 0) return `${percent}%`;
+        return '0%';
+    }
+
+    const params = `zipf_s=${ZIPF_S} redirect_ratio=${REDIRECT_RATIO} write_ratio=${WRITE_RATIO} cache_hit_ratio=${CACHE_HIT_RATIO}`;
+    const csvLines = [
+        'Metric,DB-only,Redis Cache,Diff (% faster),Description',
+        `Total User Requests,${count('origin_reqs')},${count('cached_reqs')},-,"Requests served by the app/database vs answered from the Redis cache (${params})"`,
+        `Avg Latency (ms),${fixed(origin.avg)},${fixed(cached.avg)},${compare(origin.avg, cached.avg)},Average time per request`,
+        `Median Latency (ms),${fixed(origin.med)},${fixed(cached.med)},${compare(origin.med, cached.med)},Median time per request`,
+        `p(90) Latency (ms),${fixed(origin['p(90)'])},${fixed(cached['p(90)'])},${compare(origin['p(90)'], cached['p(90)'])},90th percentile latency`,
+        `p(95) Latency (ms),${fixed(origin['p(95)'])},${fixed(cached['p(95)'])},${compare(origin['p(95)'], cached['p(95)'])},95th percentile latency`,
+        `Redirect Requests,${count('redirect_reqs')},-,-,"Short link redirects, ${count('refused_redirects')} refused (used up, expired or unknown)"`,
+        `Redirect p(95) Latency (ms),${fixed(redirects['p(95)'])},-,-,95th percentile latency of redirects`,
+        `Client-cached Redirects,${count('client_cached_redirects')},-,-,"Clicks answered from the client's redirect cache, ${offload === undefined ? 'N/A' : (offload * 100).toFixed(1)}% of all clicks (client_cache=${CLIENT_CACHE})"`,
+        `Write Requests,${count('write_reqs')},-,-,"Creates, edits and deletes (mix ${WRITE_MIX.join('/')})"`,
+        `Write p(95) Latency (ms),${fixed(writes['p(95)'])},-,-,95th percentile latency of writes`,
+        `Cache Hit Ratio,-,${hitRatio === undefined ? 'N/A' : hitRatio.toFixed(3)},-,Observed share of by_long lookups answered from cache`,
+    ];
+
+    const csvContent = csvLines.join('\n');
+
+    console.log('\n===== WORKLOAD SUMMARY (CSV) =====\n');
+    console.log(csvContent);
+
+    const out = {};
+    out[`/results/${SUMMARY_NAME}`] = csvContent;
+    if (SUMMARY_JSON) {
+        const all = data.metrics['http_req_duration']?.values || {};
+        out[`/results/${SUMMARY_JSON}`] = JSON.stringify({
+            target_rps: RATE,
+            achieved_rps: data.metrics['http_reqs']?.values.rate || 0,
+            total_requests: count('http_reqs'),
+            dropped_iterations: count('dropped_iterations'),
+            error_rate: data.metrics['http_req_failed']?.values.rate || 0,
+            p95_ms: all['p(95)'],
+            p99_ms: all['p(99)'],
+            avg_ms: all.avg,
+            redirect_p95_ms: redirects['p(95)'],
+            cache_hit_ratio: hitRatio,
+            redirect_requests: count('redirect_reqs'),
+            client_cached_redirects: count('client_cached_redirects'),
+            redirect_offload: offload,
+        }, null, 2);
+    }
+    return out;
+}
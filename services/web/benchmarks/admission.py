@@ -0,0 +1,179 @@
+"""Goodput under overload with and without admission control (project/admission.py).
+
+    python -m benchmarks.admission [--overload 2] [--duration 20] [--bulk-share 0.05]
+                                   [--workers 2] [--threads 16] [--pool-size 4] [--out k6/results/admission.csv]
+
+Runs inside the web container against DATABASE_URL, on the generated links (t0, t1, ...).
+For each setting (ADMISSION off, then on) a gunicorn is started on a free local port with the
+API enabled and a small DB pool. Then:
+
+    calibrate  closed loop: 16 keep-alive clients for 5 s give the capacity in requests/s
+    overload   open loop: requests are sent on a fixed schedule at --overload x capacity for
+               --duration s, whether or not earlier ones came back, like independent users
+
+--bulk-share of the requests list the expired links (/api/links/expired, class 'bulk'); the
+rest are redirects (class 'redirect'). Latency is measured from each request's scheduled send
+time. Per setting and class the output has: requests sent, successes, 503s shed, other errors
+and timeouts, goodput (successes within --slo-ms per second), and p50/p99 of the successes.
+"""
+import argparse
+import csv
+import http.client
+import os
+import random
+import signal
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.hot_row import start_gunicorn, USER_AGENT
+from project.datagen import zipf_cum_weights
+
+API_KEY = 'admission-benchmark'
+BULK_PATH = '/api/links/expired'
+CLIENT_TIMEOUT = 10
+
+
+class Clients:
+    """One keep-alive connection per sending thread; returns (status or None, ms) per request."""
+
+    def __init__(self, port):
+        self.port = port
+        self._local = threading.local()
+
+    def send(self, path, scheduled):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=CLIENT_TIMEOUT)
+        try:
+            conn.request('GET', path, headers={'User-Agent': USER_AGENT, 'Authorization': API_KEY})
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            status = None
+        return status, (time.monotonic() - scheduled) * 1000
+
+
+def request_paths(rng, args, cum_weights):
+    while True:
+        if rng.random() < args.bulk_share:
+            yield 'bulk', BULK_PATH
+        else:
+            yield 'redirect', f'/t{rng.choices(range(args.links), cum_weights=cum_weights)[0]}'
+
+
+def calibrate(clients, paths, seconds=5, concurrency=16):
+    done = []
+    stop = time.monotonic() + seconds
+    lock = threading.Lock()
+
+    def loop():
+        while time.monotonic() < stop:
+            with lock:
+                _, path = next(paths)
+            status, _ = clients.send(path, time.monotonic())
+            if status is not None and status < 500:
+                with lock:
+                    done.append(1)
+
+    threads = [threading.Thread(target=loop) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(done) / seconds
+
+
+def overload(clients, paths, rate, seconds, senders):
+    """Send `rate` requests/s for `seconds`; returns [(class, status, ms)]."""
+    results = []
+    lock = threading.Lock()
+
+    def send(cls, path, scheduled):
+        status, ms = clients.send(path, scheduled)
+        with lock:
+            results.append((cls, status, ms))
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(senders) as pool:
+        for n in range(int(rate * seconds)):
+            scheduled = started + n / rate
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            cls, path = next(paths)
+            pool.submit(send, cls, path, scheduled)
+    return results
+
+
+def summarize(setting, rate, seconds, slo_ms, results):
+    rows = []
+    for cls in ('redirect', 'bulk'):
+        mine = [(status, ms) for c, status, ms in results if c == cls]
+        ok = [ms for status, ms in mine if status is not None and status < 500]
+        percentiles = statistics.quantiles(ok, n=100) if len(ok) > 1 else [0] * 99
+        rows.append({
+            'admission': setting,
+            'class': cls,
+            'offered_rps': round(rate, 1),
+            'sent': len(mine),
+            'ok': len(ok),
+            'shed_503': sum(1 for status, _ in mine if status == 503),
+            'errors': sum(1 for status, _ in mine if status is None or (status >= 500 and status != 503)),
+            'goodput_rps': round(sum(1 for ms in ok if ms <= slo_ms) / seconds, 1),
+            'p50_ms': round(percentiles[49], 1),
+            'p99_ms': round(percentiles[98], 1),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--overload', type=float, default=2.0, help='Offered load as a multiple of capacity')
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--bulk-share', type=float, default=0.05, help='Share of requests listing links')
+    parser.add_argument('--links', type=int, default=5000, help='Redirects go to t0..t{N-1}, Zipf-skewed')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--pool-size', type=int, default=4, help='DB_POOL_SIZE of each worker')
+    parser.add_argument('--slo-ms', type=float, default=1000, help='Successes slower than this are not goodput')
+    parser.add_argument('--senders', type=int, default=256, help='Client threads sending the open-loop load')
+    parser.add_argument('--out', default=os.path.join('k6', 'results', 'admission.csv'))
+    args = parser.parse_args()
+
+    os.environ.update(ENABLE_API='true', API_KEY=API_KEY, DB_POOL_SIZE=str(args.pool_size), REDIRECT_SNAPSHOT='')
+    cum_weights = zipf_cum_weights(args.links, 1.1)
+    rows = []
+    for setting in ('off', 'on'):
+        os.environ['ADMISSION'] = 'true' if setting == 'on' else 'false'
+        print(f"[admission] {setting}: {args.workers} workers x {args.threads} threads, pool {args.pool_size}")
+        server, port = start_gunicorn(args.workers, args.threads)
+        try:
+            clients = Clients(port)
+            paths = request_paths(random.Random(0), args, cum_weights)
+            capacity = calibrate(clients, paths)
+            rate = capacity * args.overload
+            print(f"[admission] capacity {capacity:.0f} requests/s, offering {rate:.0f}/s")
+            results = overload(clients, paths, rate, args.duration, args.senders)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(60)
+        rows.extend(summarize(setting, rate, args.duration, args.slo_ms, results))
+
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(' '.join(f"{c:>12}" for c in rows[0]))
+    for row in rows:
+        print(' '.join(f"{row[c]!s:>12}" for c in row))
+    print(f"Wrote {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Redis memory per cached link: `longurl:{url}` string keys (before) vs bucketed binary records (after).
+
+    python -m benchmarks.cache_memory [links]
+
+Runs inside the web container against the first cache node. The same synthetic tracking URLs
+(~130 bytes) are written in both layouts, one after the other, with the TTL the app uses;
+memory is the growth of used_memory. Buckets are sized like CACHE_BUCKETS should be for that
+many links (about 80 per bucket). Everything written is deleted again. 10M links need about
+2 GB of Redis memory for the "before" layout.
+"""
+import sys
+import time
+
+from project.cache_codec import LinkCache, TTL
+from project.clients import get_cache
+from project.sharding import ShardedRedis
+
+BATCH = 10000
+
+
+def urls(count):
+    for i in range(count):
+        yield (f"https://shop.example.com/products/{i % 5000}/item-{i}?utm_source=newsletter&utm_medium=email"
+               f"&utm_campaign=autumn-{i % 97}&ref={i:x}"), f"b{i:x}"
+
+
+def used_memory(client):
+    return client.info('memory')['used_memory']
+
+
+def batched(client, count, queue):
+    pipe = client.pipeline(transaction=False)
+    for url, alias in urls(count):
+        queue(pipe, url, alias)
+        if len(pipe) >= BATCH:
+            pipe.execute()
+    pipe.execute()
+
+
+def measure(client, count, write, clean, probe):
+    """(bytes per link, writes/s, keys added, encoding of the `probe` key)"""
+    before, keys_before = used_memory(client), client.dbsize()
+    started = time.perf_counter()
+    batched(client, count, write)
+    elapsed = time.perf_counter() - started
+    grown, keys = used_memory(client) - before, client.dbsize() - keys_before
+    encoding = client.object('encoding', probe)
+    batched(client, count, clean)
+    return grown / count, count / elapsed, keys, encoding.decode() if encoding else None
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    cache = get_cache()
+    client = next(iter(cache.clients.values())) if isinstance(cache, ShardedRedis) else cache
+    compact = LinkCache(client, buckets=max(1, count // 80), prefix='bench:lc:')
+
+    def write_before(pipe, url, alias):
+        pipe.set(f"bench:longurl:{url}", alias, ex=TTL)
+
+    def clean_before(pipe, url, alias):
+        pipe.delete(f"bench:longurl:{url}")
+
+    def write_after(pipe, url, alias):
+        compact.set(url, alias, pipe=pipe)
+
+    def clean_after(pipe, url, alias):
+        compact.delete(url, pipe=pipe)
+
+    url = next(urls(1))[0]
+    rows = [
+        ('before: string keys',) + measure(client, count, write_before, clean_before, f"bench:longurl:{url}"),
+        (f'after: {compact.buckets} buckets',) + measure(client, count, write_after, clean_after, compact.locate(url)[0]),
+    ]
+    print(f"{count} links, average URL {sum(len(u) for u, _ in urls(1000)) / 1000:.0f} bytes")
+    print(f"{'layout':<26} {'bytes/link':>10} {'writes/s':>10} {'keys':>10} {'encoding':>10}")
+    for name, per_link, rate, keys, encoding in rows:
+        print(f"{name:<26} {per_link:>10.1f} {rate:>10.0f} {keys:>10} {encoding:>10}")
+    print(f"saved {1 - rows[1][1] / rows[0][1]:.0%}")
+
+
+if __name__ == '__main__':
+    main()
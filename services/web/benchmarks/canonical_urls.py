@@ -0,0 +1,90 @@
+"""by_long lookups of differently spelled URLs: byte-for-byte matching vs canonical URLs.
+
+    python -m benchmarks.canonical_urls [lookups] [links]
+
+Runs inside the web container against DATABASE_URL, on the generated links
+(https://example.com/{i}, make generate-data). Every lookup takes one of `links` URLs,
+chosen with a Zipf skew as in the k6 workload, and spells it one of the ways clients do:
+as stored, uppercase host, explicit :443, trailing slash, campaign tags or click ids. It then
+reports:
+
+    found       lookups that reach the link: original_url = URL vs canonical_url = canonical(URL)
+    cache hits  share of hits for a cache warmed by the same lookups, keyed by URL vs canonical URL
+    lookup      µs per lookup: the old query (original_url, no index) vs queries.short_url_for;
+                the old query only runs the first 500 lookups, and its found share is over those
+    canonical   µs per canonicalization, first time and repeated (LRU)
+"""
+import random
+import statistics
+import sys
+import time
+
+from sqlalchemy import select, bindparam
+
+from project.wsgi import app
+from project import queries
+from project.canonical import Canonicalizer
+from project.datagen import zipf_cum_weights
+from project.models import db
+from project.queries import shortlinks
+
+SPELLINGS = (
+    lambda url: url,
+    lambda url: url.replace('example.com', 'EXAMPLE.com'),
+    lambda url: url.replace('example.com', 'example.com:443'),
+    lambda url: url + '/',
+    lambda url: url + '?utm_source=newsletter&utm_medium=email',
+    lambda url: url + '?fbclid=IwAR0abc',
+    lambda url: url.replace('https://example.com', 'HTTPS://Example.com.') + '/?gclid=xyz',
+)
+by_original_stmt = (
+    select(shortlinks.c.short_url)
+    .where(shortlinks.c.original_url == bindparam('original_url'), shortlinks.c.deleted.is_(False))
+    .limit(1)
+)
+
+
+def timed(fn, values):
+    wall = []
+    results = []
+    for value in values:
+        started = time.perf_counter()
+        results.append(fn(value))
+        wall.append(time.perf_counter() - started)
+    return results, statistics.mean(wall) * 1e6
+
+
+def main():
+    lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    links = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rng = random.Random(0)
+    ids = rng.choices(range(links), cum_weights=zipf_cum_weights(links, 1.1), k=lookups)
+    urls = [rng.choice(SPELLINGS)(f"https://example.com/{i}") for i in ids]
+
+    with app.app_context():
+        timed_urls = urls[:min(lookups, 500)]
+        old, old_us = timed(lambda url: db.session.execute(by_original_stmt, {'original_url': url}).scalar(), timed_urls)
+        new, new_us = timed(queries.short_url_for, urls)
+        db.session.remove()
+
+    def hit_ratio(keys):
+        seen = set()
+        hits = 0
+        for key in keys:
+            hits += key in seen
+            seen.add(key)
+        return hits / len(keys)
+
+    canonicalizer = Canonicalizer()
+    canonical, cold_us = timed(canonicalizer._canonicalize, urls)
+    _, warm_us = timed(canonicalizer.canonicalize, urls)
+    print(f"{lookups} lookups over {links} links, {len(SPELLINGS)} spellings")
+    print(f"{'':<14}{'byte-for-byte':>16}{'canonical':>12}")
+    print(f"{'found':<14}{sum(map(bool, old)) / len(old):>16.1%}{sum(map(bool, new)) / len(new):>12.1%}")
+    print(f"{'cache hits':<14}{hit_ratio(urls):>16.1%}{hit_ratio(canonical):>12.1%}")
+    print(f"{'lookup µs':<14}{old_us:>16.0f}{new_us:>12.0f}")
+    print(f"canonicalize: {cold_us:.1f} µs, {warm_us:.2f} µs when cached")
+
+
+if __name__ == '__main__':
+    main()
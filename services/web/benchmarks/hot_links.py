@@ -0,0 +1,39 @@
+"""Per-click cost of hot-link tracking.
+
+    python -m benchmarks.hot_links [clicks]
+
+Pure Python: HotLinks.record() is timed over `clicks` Zipf-distributed aliases. Pinned links
+are no longer redirected differently (see redirect_sql.py), so there is no redirect part.
+"""
+import random
+import sys
+import time
+
+from project.hotlinks import HotLinks
+
+
+def zipf_aliases(n, distinct=50000, s=1.1, seed=3):
+    rng = random.Random(seed)
+    weights = [1 / (rank ** s) for rank in range(1, distinct + 1)]
+    return [f"t{i}" for i in rng.choices(range(distinct), weights=weights, k=n)]
+
+
+def time_record(aliases):
+    tracker = HotLinks(redis_client=None)
+    tracker.enabled = True
+    # No flusher thread: only the request-thread cost is measured
+    tracker._start_flusher = lambda: None
+    started = time.perf_counter_ns()
+    for alias in aliases:
+        tracker.record(alias)
+    return (time.perf_counter_ns() - started) / len(aliases)
+
+
+def main():
+    clicks = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    aliases = zipf_aliases(clicks)
+    print(f"record(): {time_record(aliases):.0f} ns/click over {len(aliases)} Zipf clicks")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""Concurrent redirects to one (or a few) click-limited links: throughput, latency, lock waits, correctness.
+
+    python -m benchmarks.hot_row [--links 1] [--limit N] [--requests 4000] [--concurrency 32]
+                                 [--settings 1x4,2x2,4x2,4x8] [--out k6/results/hot_row.csv]
+
+Runs inside the web container against DATABASE_URL. For every WORKERSxTHREADS setting a
+gunicorn is started on a free local port (as in benchmarks.worker_boot), fresh links are
+created, and `concurrency` clients with keep-alive connections send `requests` redirects spread
+round-robin over the links. Meanwhile another connection samples pg_stat_activity every
+--sample-ms: backends waiting on a heavyweight lock (wait_event_type 'Lock', i.e. on another
+transaction's row) add up to the lock-wait seconds. Afterwards the links are checked:
+
+    served     redirects that reached the link's URL
+    overshoot  served beyond max_clicks, summed over the links (should be 0)
+    drift      current_clicks - served (clicks counted but not served, or the other way round)
+    visits     visit rows logged for the links
+
+--limit defaults to half the requests per link, so half of them must be refused; --limit 0
+makes the links unlimited. Links and visits are deleted afterwards.
+"""
+import argparse
+import contextlib
+import csv
+import http.client
+import itertools
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from sqlalchemy import text
+
+from project.wsgi import app
+from project.models import db, ShortLink, Visit
+from benchmarks.worker_boot import READY, free_port
+
+USER_AGENT = 'Mozilla/5.0 (hot-row benchmark)'
+_LOCK_WAITS = text("""
+SELECT count(*) FROM pg_stat_activity
+WHERE datname = current_database() AND wait_event_type = 'Lock' AND pid <> pg_backend_pid()
+""")
+_DEADLOCKS = text("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")
+
+
+class LockSampler:
+    """Samples lock waiters on Postgres until stopped; lock_wait_s is waiters x sample interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = 0
+        self.waiting = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        with app.app_context(), db.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            while not self._stop.wait(self.interval):
+                waiting = conn.execute(_LOCK_WAITS).scalar()
+                self.samples += 1
+                self.waiting += waiting
+                self.peak = max(self.peak, waiting)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def lock_wait_s(self):
+        return self.waiting * self.interval
+
+
+def start_gunicorn(workers, threads):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers), '--threads', str(threads), 'project.wsgi:app'],
+        stderr=subprocess.PIPE, text=True)
+    ready = set()
+    all_ready = threading.Event()
+
+    def read_log():
+        for line in server.stderr:
+            match = READY.search(line)
+            if match:
+                ready.add(match.group(1))
+                if len(ready) == workers:
+                    all_ready.set()
+
+    threading.Thread(target=read_log, daemon=True).start()
+    if not all_ready.wait(120):
+        server.kill()
+        sys.exit(f"gunicorn did not boot {workers} workers (exit code {server.poll()})")
+    return server, port
+
+
+def fire(port, aliases, targets, requests, concurrency):
+    """Send the redirects; returns (seconds, latencies in ms, served per alias, refused, errors)."""
+    sequence = itertools.count()
+    lock = threading.Lock()
+    latencies = []
+    served = dict.fromkeys(aliases, 0)
+    outcome = {'refused': 0, 'errors': 0}
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        mine = []
+        while True:
+            with lock:
+                n = next(sequence)
+            if n >= requests:
+                break
+            alias = aliases[n % len(aliases)]
+            started = time.perf_counter()
+            try:
+                conn.request('GET', f'/{alias}', headers={'User-Agent': USER_AGENT})
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                with lock:
+                    outcome['errors'] += 1
+                continue
+            mine.append((time.perf_counter() - started) * 1000)
+            with lock:
+                if response.status >= 500:
+                    outcome['errors'] += 1
+                elif response.getheader('Location') == targets[alias]:
+                    served[alias] += 1
+                else:
+                    outcome['refused'] += 1
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return time.perf_counter() - started, latencies, served, outcome['refused'], outcome['errors']
+
+
+def run(workers, threads, args):
+    limit = args.limit if args.limit is not None else max(1, args.requests // args.links // 2)
+    with app.app_context():
+        links = [ShortLink(f'https://example.com/hot-row/{i}', f'hot-row-{workers}x{threads}-{i}',
+                           max_clicks=limit or -1, created_by=1) for i in range(args.links)]
+        db.session.add_all(links)
+        db.session.commit()
+        ids = {link.short_url: link.id for link in links}
+        targets = {link.short_url: link.original_url for link in links}
+        postgres = db.engine.dialect.name == 'postgresql'
+        deadlocks = db.session.execute(_DEADLOCKS).scalar() if postgres else None
+        db.session.remove()
+    server, port = start_gunicorn(workers, threads)
+    try:
+        aliases = list(ids)
+        sampler = LockSampler(args.sample_ms / 1000) if postgres else None
+        with sampler or contextlib.nullcontext():
+            elapsed, latencies, served, refused, errors = fire(port, aliases, targets, args.requests, args.concurrency)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(30)
+    with app.app_context():
+        try:
+            clicks = dict(db.session.query(ShortLink.short_url, ShortLink.current_clicks)
+                          .filter(ShortLink.id.in_(ids.values())))
+            visits = Visit.query.filter(Visit.short_url_id.in_(ids.values())).count()
+            if postgres:
+                deadlocks = db.session.execute(_DEADLOCKS).scalar() - deadlocks
+        finally:
+            Visit.query.filter(Visit.short_url_id.in_(ids.values())).delete()
+            ShortLink.query.filter(ShortLink.id.in_(ids.values())).delete()
+            db.session.commit()
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+    return {
+        'workers': workers,
+        'threads': threads,
+        'links': args.links,
+        'max_clicks': limit or -1,
+        'requests': args.requests,
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentiles[49], 2),
+        'p95_ms': round(percentiles[94], 2),
+        'p99_ms': round(percentiles[98], 2),
+        'max_ms': round(max(latencies, default=0), 2),
+        'lock_wait_s': round(sampler.lock_wait_s, 3) if sampler else None,
+        'peak_waiters': sampler.peak if sampler else None,
+        'deadlocks': deadlocks,
+        'served': sum(served.values()),
+        'refused': refused,
+        'errors': errors,
+        'overshoot': sum(max(0, served[alias] - limit) for alias in aliases) if limit else 0,
+        'drift': sum(clicks[alias] - served[alias] for alias in aliases),
+        'visits': visits,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--links', type=int, default=1, help='Hot links the requests are spread over')
+    parser.add_argument('--limit', type=int, default=None, help='max_clicks per link (0: unlimited)')
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--concurrency', type=int, default=32, help='Clients sending at the same time')
+    parser.add_argument('--settings', default='1x4,2x2,4x2,4x8', help='WORKERSxTHREADS gunicorn settings')
+    parser.add_argument('--sample-ms', type=float, default=10, help='pg_stat_activity sampling interval')
+    parser.add_argument('--out', default=os.path.join('k6', 'results', 'hot_row.csv'))
+    args = parser.parse_args()
+
+    rows = []
+    for setting in args.settings.split(','):
+        workers, threads = (int(n) for n in setting.split('x'))
+        print(f"[hot-row] {workers} workers x {threads} threads")
+        rows.append(run(workers, threads, args))
+
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    columns = [c for c in rows[0] if c not in ('links', 'requests')]
+    print(' '.join(f"{c:>12}" for c in columns))
+    for row in rows:
+        print(' '.join(f"{'n/a' if row[c] is None else row[c]!s:>12}" for c in columns))
+    print(f"Wrote {args.out}")
+
+
+if __name__ == '__main__':
+    main()
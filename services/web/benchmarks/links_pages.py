@@ -0,0 +1,67 @@
+"""Cost of the /links pages: every row in one response (before) vs server-side pages (after).
+
+    python -m benchmarks.links_pages [repeats]
+
+Runs inside the web container against the configured database. "before" loads all active links
+through the ORM and serializes them, which is what rendering the old links.html amounted to;
+"after" fetches pages of /links/data through the full Flask stack as a logged-in user.
+"""
+import statistics
+import sys
+import time
+
+from project.wsgi import app
+from project.models import db, ShortLink, User
+
+
+def timed(fn, repeats):
+    wall = []
+    size = 0
+    for _ in range(repeats):
+        started = time.perf_counter()
+        size = fn()
+        wall.append(time.perf_counter() - started)
+    return statistics.median(wall) * 1000, size
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    client = app.test_client()
+    with app.app_context():
+        user = db.session.execute(db.select(User.id).limit(1)).scalar()
+        links = ShortLink.query.count()
+    if user is None:
+        sys.exit("links_pages needs at least one user")
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user)
+        session['_fresh'] = True
+
+    def all_rows():
+        with app.app_context():
+            rows = [link.to_dict() for link in ShortLink.query.filter_by(deleted=False, expired=False).all()]
+            return len(app.json.dumps(rows))
+
+    def page(query):
+        def fetch():
+            res = client.get(f'/links/data?{query}')
+            assert res.status_code == 200, res.status_code
+            return len(res.data)
+        return fetch
+
+    cases = [
+        ('before: all active rows', all_rows),
+        ('after: first page', page('status=active&start=0&length=10')),
+        ('after: page 100', page('status=active&start=1000&length=10')),
+        ('after: by created_at', page('status=active&start=0&length=50&order[0][column]=5&columns[5][data]=created_at')),
+        ('after: alias search', page('status=active&start=0&length=10&search[value]=t1')),
+        ('after: deleted', page('status=deleted&start=0&length=10')),
+    ]
+    print(f"{links} links")
+    print(f"{'case':<26} {'median ms':>10} {'bytes':>12}")
+    for name, fn in cases:
+        ms, size = timed(fn, repeats)
+        print(f"{name:<26} {ms:>10.1f} {size:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Cost of a log call on the request thread, old synchronous setup vs the queue/JSON pipeline.
+
+    python -m benchmarks.logging_overhead [iterations]
+
+Output goes to /dev/null so only the logging work itself is measured. "caller" is the time
+spent on the calling thread; "drain" is how long the background listener needs afterwards.
+"""
+import logging
+import os
+import sys
+import time
+from logging.config import dictConfig
+
+from flask import g
+
+from project.wsgi import app
+from project.logconfig import configure_logging, sampled_logger, BackgroundQueueHandler
+
+
+class SlowStream:
+    """A log sink that takes 100 µs per write, like a congested stderr pipe or log shipper."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, data):
+        time.sleep(0.0001)
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def legacy_config(stream):
+    # The dictConfig the app used before project/logconfig.py
+    dictConfig({
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {'default': {
+            'format': '[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
+        }},
+        'handlers': {'wsgi': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'default',
+            'stream': stream,
+        }},
+        'root': {
+            'level': 'DEBUG',
+            'handlers': ['wsgi']
+        }
+    })
+
+
+def run(name, logger, iterations, in_request=False, level=logging.INFO):
+    def calls():
+        for i in range(iterations):
+            if in_request and i % 10 == 0:
+                # Sampling decisions are per request; pretend every 10 log calls are one request
+                g.pop('_log_sampling', None)
+            logger.log(level, "redirect %s", "t42", extra={'alias': 't42', 'link_id': 42})
+
+    ctx = app.test_request_context('/t42')
+    ctx.push()
+    started = time.perf_counter()
+    calls()
+    caller = time.perf_counter() - started
+    ctx.pop()
+
+    drained = time.perf_counter()
+    dropped = 0
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, BackgroundQueueHandler):
+            handler.queue.join()
+            dropped = handler.dropped
+    drain = time.perf_counter() - drained
+    print(f"{name:<44} caller {caller / iterations * 1e6:8.2f} µs/call   drain {drain * 1000:8.1f} ms total"
+          f"   dropped {dropped}")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    devnull = open(os.devnull, 'w')
+    logger = logging.getLogger('project.redirects')
+    # Measure the pipeline, not the overflow path
+    os.environ.setdefault('LOG_QUEUE_SIZE', str(iterations + 1))
+
+    legacy_config(devnull)
+    run("sync StreamHandler, text (old setup)", logger, iterations)
+
+    os.environ['LOG_SAMPLE_RATES'] = 'project.redirects=1.0'
+    configure_logging(devnull)
+    run("queue + JSON, unsampled", logger, iterations)
+
+    os.environ['LOG_SAMPLE_RATES'] = 'project.redirects=0.01'
+    configure_logging(devnull)
+    run("queue + JSON, 1% sampling in the filter", logger, iterations, in_request=True)
+    run("queue + JSON, 1% sampling, SampledLogger", sampled_logger('project.redirects'), iterations, in_request=True)
+
+    run("below level (DEBUG call at INFO)", logger, iterations, level=logging.DEBUG)
+
+    sqlalchemy_logger = logging.getLogger('sqlalchemy.engine.Engine')
+    run("sqlalchemy.engine at WARNING", sqlalchemy_logger, iterations)
+
+    # With a slow sink the synchronous handler stalls the request thread on every write
+    slow = SlowStream(devnull)
+    legacy_config(slow)
+    run("slow sink: sync StreamHandler", logger, iterations // 10)
+    os.environ['LOG_SAMPLE_RATES'] = 'project.redirects=1.0'
+    configure_logging(slow)
+    run("slow sink: queue + JSON, unsampled", logger, iterations // 10)
+
+
+if __name__ == '__main__':
+    main()
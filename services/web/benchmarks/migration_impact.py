@@ -0,0 +1,248 @@
+"""Latency of live redirects while schema changes run, plain vs online (project/online_migrations.py).
+
+    python -m benchmarks.migration_impact [--concurrency 16] [--workers 2] [--threads 4]
+                                          [--hold 3] [--batch-size 1000] [--out k6/results/migration_impact.csv]
+
+Runs inside the web container against DATABASE_URL (Postgres), on whatever shortlinks the
+database holds; generate a large dataset first (make generate-data). A gunicorn is started on a
+free local port, and `concurrency` clients keep redirecting to random aliases for the whole run.
+Every redirect updates its shortlinks row, so it waits on any lock a migration holds. Each step runs
+twice; the numbers cover the requests in flight at any time during the step, and
+requests/s the ones that completed during it:
+
+    add column   ALTER TABLE behind a transaction holding a read lock for --hold seconds:
+                 plain waits in the lock queue, guarded() retries with a short lock_timeout
+    backfill     one UPDATE of every row vs backfill() in committed, throttled key ranges
+    index        CREATE INDEX vs create_index_concurrently()
+
+A scratch column, bench_scratch, is added to shortlinks and dropped again at the end.
+"""
+import argparse
+import csv
+import http.client
+import os
+import random
+import signal
+import statistics
+import threading
+import time
+
+from sqlalchemy import text
+
+from project.wsgi import app
+from project.models import db
+from project.online_migrations import guarded, backfill, create_index_concurrently, drop_index_concurrently
+from benchmarks.hot_row import start_gunicorn, USER_AGENT
+
+COLUMN = 'bench_scratch'
+INDEX = 'ix_shortlinks_bench_scratch'
+ADD_COLUMN = text(f"ALTER TABLE shortlinks ADD COLUMN {COLUMN} integer")
+DROP_COLUMN = text(f"ALTER TABLE shortlinks DROP COLUMN IF EXISTS {COLUMN}")
+# Requests slower than this count as errors, like a client giving up
+CLIENT_TIMEOUT = 10
+
+
+class Load:
+    """Clients redirecting to random aliases until stopped; keeps (sent at, ms, ok) per request."""
+
+    def __init__(self, port, aliases, concurrency):
+        self.port = port
+        self.aliases = aliases
+        self.samples = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._clients = [threading.Thread(target=self._client, args=(seed,), daemon=True)
+                         for seed in range(concurrency)]
+
+    def _client(self, seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=CLIENT_TIMEOUT)
+        while not self._stop.is_set():
+            sent = time.monotonic()
+            try:
+                conn.request('GET', f'/{rng.choice(self.aliases)}', headers={'User-Agent': USER_AGENT})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 500
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=CLIENT_TIMEOUT)
+                ok = False
+            with self._lock:
+                self.samples.append((sent, (time.monotonic() - sent) * 1000, ok))
+        conn.close()
+
+    def start(self):
+        for client in self._clients:
+            client.start()
+
+    def stop(self):
+        self._stop.set()
+        for client in self._clients:
+            client.join()
+
+    def window(self, start, end):
+        """Requests in flight at any point between start and end, with whether each finished in between."""
+        with self._lock:
+            return [(ms, ok, start <= sent + ms / 1000 <= end) for sent, ms, ok in self.samples
+                    if sent <= end and sent + ms / 1000 >= start]
+
+
+def hold_read_lock(seconds):
+    """A transaction that reads shortlinks and stays open, like a long report query."""
+    ready = threading.Event()
+
+    def hold():
+        with app.app_context(), db.engine.connect() as conn:
+            with conn.begin():
+                conn.execute(text("SELECT 1 FROM shortlinks LIMIT 1"))
+                ready.set()
+                time.sleep(seconds)
+
+    thread = threading.Thread(target=hold, daemon=True)
+    thread.start()
+    ready.wait()
+    return thread
+
+
+def autocommit():
+    return db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+
+
+def drop_column():
+    with autocommit() as conn:
+        conn.execute(DROP_COLUMN)
+
+
+def steps(args):
+    """(step, variant, run, reset) in the order they run; reset puts the table back for the next one."""
+
+    def add_plain():
+        holder = hold_read_lock(args.hold)
+        with autocommit() as conn:
+            conn.execute(ADD_COLUMN)
+        holder.join()
+
+    def add_guarded():
+        holder = hold_read_lock(args.hold)
+        with db.engine.connect() as conn, conn.begin():
+            guarded(conn, conn.execute, ADD_COLUMN, lock_timeout='100ms', attempts=100, backoff=0.05)
+        holder.join()
+
+    def fresh_column():
+        # Dropping and adding a nullable column only touches the catalog, so this is instant
+        with autocommit() as conn:
+            conn.execute(DROP_COLUMN)
+            conn.execute(ADD_COLUMN)
+
+    def backfill_plain():
+        with db.engine.begin() as conn:
+            conn.execute(text(f"UPDATE shortlinks SET {COLUMN} = length(original_url)"))
+
+    def backfill_online():
+        with autocommit() as conn:
+            backfill(conn, 'bench_scratch', 'shortlinks', f"{COLUMN} = length(original_url)", f"{COLUMN} IS NULL",
+                     batch_size=args.batch_size, duty_cycle=args.duty_cycle, progress=lambda message: None)
+
+    def index_plain():
+        with autocommit() as conn:
+            conn.execute(text(f"CREATE INDEX {INDEX} ON shortlinks ({COLUMN})"))
+
+    def index_online():
+        with autocommit() as conn:
+            create_index_concurrently(conn, INDEX, 'shortlinks', [COLUMN])
+
+    def drop_index():
+        with autocommit() as conn:
+            drop_index_concurrently(conn, INDEX)
+
+    return [
+        ('baseline', '-', lambda: time.sleep(args.hold), None),
+        ('add column', 'plain', add_plain, drop_column),
+        ('add column', 'online', add_guarded, fresh_column),
+        ('backfill', 'plain', backfill_plain, fresh_column),
+        ('backfill', 'online', backfill_online, None),
+        ('index', 'plain', index_plain, drop_index),
+        ('index', 'online', index_online, drop_index),
+    ]
+
+
+def summarize(step, variant, seconds, window):
+    latencies = [ms for ms, ok, _ in window if ok]
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+    completed = sum(1 for _, _, finished in window if finished)
+    return {
+        'step': step,
+        'variant': variant,
+        'op_s': round(seconds, 2),
+        'requests': len(window),
+        'rps': round(completed / seconds, 1) if seconds else None,
+        'p50_ms': round(percentiles[49], 1),
+        'p99_ms': round(percentiles[98], 1),
+        'max_ms': round(max(latencies, default=0), 1),
+        'errors': sum(1 for _, ok, _ in window if not ok),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--hold', type=float, default=3, help='Seconds the long transaction holds its lock')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Key range per backfill batch')
+    parser.add_argument('--duty-cycle', type=float, default=0.5, help='Share of the time the backfill runs')
+    parser.add_argument('--aliases', type=int, default=10000, help='Distinct aliases the load picks from')
+    parser.add_argument('--out', default=os.path.join('k6', 'results', 'migration_impact.csv'))
+    args = parser.parse_args()
+
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            raise SystemExit("This benchmark needs Postgres (DATABASE_URL)")
+        links = db.session.execute(text("SELECT count(*) FROM shortlinks")).scalar()
+        aliases = list(db.session.execute(
+            text("SELECT short_url FROM shortlinks ORDER BY id LIMIT :n"), {'n': args.aliases}).scalars())
+        db.session.remove()
+        drop_column()
+    # Redirects must reach the database to feel its locks
+    os.environ['REDIRECT_SNAPSHOT'] = ''
+    server, port = start_gunicorn(args.workers, args.threads)
+    load = Load(port, aliases, args.concurrency)
+    spans = []
+    try:
+        load.start()
+        time.sleep(2)
+        with app.app_context():
+            for step, variant, run, reset in steps(args):
+                print(f"[migration-impact] {step} ({variant})")
+                started = time.monotonic()
+                run()
+                ended = time.monotonic()
+                spans.append((step, variant, started, ended))
+                if reset:
+                    reset()
+                time.sleep(1)
+    finally:
+        load.stop()
+        server.send_signal(signal.SIGTERM)
+        server.wait(30)
+        with app.app_context():
+            drop_column()
+
+    # Requests stalled by a step are only recorded once they finish, so the windows are cut afterwards
+    rows = [summarize(step, variant, ended - started, load.window(started, ended))
+            for step, variant, started, ended in spans]
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"{links} shortlinks, {args.concurrency} clients, {args.workers} workers x {args.threads} threads")
+    print(' '.join(f"{c:>10}" for c in rows[0]))
+    for row in rows:
+        print(' '.join(f"{'n/a' if row[c] is None else row[c]!s:>10}" for c in row))
+    print(f"Wrote {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Per-request CPU time of the hot API reads: ORM + jsonify (before) vs Core columns + fast JSON (after).
+
+    python -m benchmarks.read_path [requests]
+
+Runs inside the web container against the configured database and its seeded t{i} links.
+Each request goes through the full Flask stack via the test client; CPU time is measured on
+the calling thread, so database server time is excluded while driver and ORM work are not.
+"""
+import os
+import statistics
+import sys
+import time
+
+from flask import Blueprint, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+from project.wsgi import app
+from project.jsonprovider import json_provider_class
+from project.models import ShortLink
+
+NUM_FIXED_URLS = int(os.environ.get('NUM_FIXED_URLS', 5000))
+
+# The endpoints as they were written before project/queries.py
+legacy = Blueprint('legacy', __name__)
+
+
+@legacy.route('/by_long', methods=['POST'])
+def legacy_by_long():
+    link = ShortLink.query.filter_by(original_url=request.get_json()['original_url'], deleted=False).first()
+    return jsonify({'short_url': link.short_url, 'cached': False})
+
+
+@legacy.route('/<int:link_id>')
+def legacy_get_link(link_id):
+    return jsonify({'link': ShortLink.query.filter_by(id=link_id).first().to_dict()})
+
+
+@legacy.route('/expired')
+def legacy_expired():
+    return jsonify({'links': [link.to_dict() for link in ShortLink.query.filter_by(expired=True).all()]})
+
+
+app.register_blueprint(legacy, url_prefix='/legacy')
+
+
+def measure(client, method, path, n, **kwargs):
+    cpu = []
+    for i in range(n):
+        url = path(i) if callable(path) else path
+        body = kwargs['json'](i) if callable(kwargs.get('json')) else kwargs.get('json')
+        started = time.thread_time()
+        res = client.open(url, method=method, json=body, headers={'Authorization': os.environ.get('API_KEY', '')})
+        cpu.append(time.thread_time() - started)
+        assert res.status_code == 200, (url, res.status_code, res.get_data()[:200])
+    return statistics.mean(cpu) * 1e6, statistics.quantiles(cpu, n=100)[98] * 1e6
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    client = app.test_client()
+    cases = [
+        ('by_long', 'POST', lambda i: '/legacy/by_long', lambda i: '/api/links/by_long',
+         {'json': lambda i: {'original_url': f'https://example.com/{i % NUM_FIXED_URLS}'}}),
+        ('get_link', 'GET', lambda i: f'/legacy/{i % NUM_FIXED_URLS + 1}', lambda i: f'/api/links/{i % NUM_FIXED_URLS + 1}', {}),
+        ('list expired', 'GET', '/legacy/expired', '/api/links/expired', {}),
+    ]
+    print(f"{'endpoint':<14} {'before µs':>10} {'p99':>8} {'after µs':>10} {'p99':>8} {'saved':>7}")
+    for name, method, before_path, after_path, kwargs in cases:
+        runs = n if 'list' not in name else max(n // 100, 5)
+        app.json = DefaultJSONProvider(app)
+        before, before_p99 = measure(client, method, before_path, runs, **kwargs)
+        app.json = json_provider_class(app)
+        after, after_p99 = measure(client, method, after_path, runs, **kwargs)
+        print(f"{name:<14} {before:>10.1f} {before_p99:>8.1f} {after:>10.1f} {after_p99:>8.1f} {(1 - after / before) * 100:>6.1f}%")
+
+
+if __name__ == '__main__':
+    main()
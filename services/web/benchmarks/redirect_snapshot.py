@@ -0,0 +1,94 @@
+"""Redirects from the mapped snapshot vs the database path (redirect_sql.follow).
+
+    python -m benchmarks.redirect_snapshot [redirects] [path]
+
+Runs inside the web container against DATABASE_URL. Builds a snapshot of the current links
+into `path` (a temporary file by default), then times, for the same unlimited links:
+
+    lookup    Snapshot.get() alone vs redirect_sql.follow() without a visit
+    request   GET /<alias> through the test client, REDIRECT_SNAPSHOT on and off
+
+Round trips per redirect are counted from engine events as in benchmarks.redirect_sql; the
+snapshot side includes its share of the batched click and visit writes, flushed at the end.
+The visits logged are deleted and the click counters put back afterwards.
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import select, bindparam
+
+from project.wsgi import app
+from project import redirect_sql, main as main_module
+from project.models import db, Visit
+from project.queries import shortlinks
+from project.snapshot import Snapshot, RedirectSnapshot, build, _servable
+from benchmarks.redirect_sql import RoundTrips
+
+
+def timed(fn, aliases, trips):
+    wall = []
+    start_count = trips.count
+    for alias in aliases:
+        started = time.perf_counter()
+        fn(alias)
+        wall.append(time.perf_counter() - started)
+    return (trips.count - start_count) / len(aliases), statistics.mean(wall) * 1e6, \
+        statistics.quantiles(wall, n=100)[98] * 1e6
+
+
+def main():
+    redirects = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(tempfile.mkdtemp(), 'redirects.snap')
+    client = app.test_client()
+    with app.app_context():
+        started = time.perf_counter()
+        links, _ = build(db.engine, path)
+        build_s = time.perf_counter() - started
+        snapshot = Snapshot(path)
+        picked = db.session.execute(
+            select(shortlinks.c.id, shortlinks.c.short_url, shortlinks.c.current_clicks).where(*_servable).limit(1000)
+        ).all()
+        aliases = [alias for _, alias, _ in picked]
+        aliases = random.Random(0).choices(aliases, k=redirects)
+        first_visit = db.session.execute(select(db.func.coalesce(db.func.max(Visit.id), 0))).scalar()
+        db.session.remove()
+        trips = RoundTrips(db.engine)
+
+        rows = [
+            ('lookup', 'snapshot', timed(snapshot.get, aliases, trips)),
+            ('lookup', 'database', timed(redirect_sql.follow, aliases, trips)),
+        ]
+        # The route reads the module-level instance; swap in one per run, whatever REDIRECT_SNAPSHOT says
+        original = main_module.redirect_snapshot
+        try:
+            for source, snapshot_path in (('snapshot', path), ('database', None)):
+                main_module.redirect_snapshot = RedirectSnapshot(snapshot_path, sync_interval=3600)
+                main_module.redirect_snapshot.init_app(app)
+                client.get('/' + aliases[0])
+                count = trips.count
+                result = timed(lambda alias: client.get('/' + alias), aliases, trips)
+                main_module.redirect_snapshot.flush()
+                rows.append(('request', source, ((trips.count - count) / redirects,) + result[1:]))
+        finally:
+            main_module.redirect_snapshot = original
+
+        # Undo the clicks and visits logged above
+        db.session.execute(Visit.__table__.delete().where(Visit.id > first_visit))
+        db.session.execute(shortlinks.update().where(shortlinks.c.id == bindparam('link_id'))
+                           .values(current_clicks=bindparam('clicks')),
+                           [{'link_id': link_id, 'clicks': clicks} for link_id, _, clicks in picked])
+        db.session.commit()
+        dialect = db.engine.dialect.name
+    print(f"Snapshot of {links} links, {os.path.getsize(path) / 1e6:.1f} MB, built in {build_s:.2f}s on {dialect}")
+    print(f"{redirects} redirects over {len(set(aliases))} aliases")
+    print(f"{'':<8} {'source':<9} {'round trips':>11} {'mean µs':>9} {'p99':>9}")
+    for kind, source, (per_redirect, mean, p99) in rows:
+        print(f"{kind:<8} {source:<9} {per_redirect:>11.2f} {mean:>9.1f} {p99:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Round trips, latency and click accuracy of a redirect: ORM steps (before) vs redirect_sql.follow() (after).
+
+    python -m benchmarks.redirect_sql [clicks] [threads]
+
+Runs inside the web container against DATABASE_URL. The "before" side replays what the route
+used to do: load the link, bump current_clicks on the instance and commit, then add the Visit
+and commit. Round trips are counted from engine events: every statement, plus BEGIN and COMMIT
+for transactions outside autocommit mode (the counts match the server's statement log). The
+race part clicks a link limited to `clicks` / 4 clicks from `threads` threads at once with both
+versions and compares the counter with the visits logged. Links and visits created here are
+deleted afterwards.
+"""
+import statistics
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+
+from project.wsgi import app
+from project import redirect_sql
+from project.dimensions import user_agents, ip_addresses
+from project.models import db, ShortLink, Visit
+
+
+class RoundTrips:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.statement)
+        event.listen(engine, 'begin', self.transaction)
+        event.listen(engine, 'commit', self.transaction)
+
+    def statement(self, *args):
+        self.count += 1
+
+    def transaction(self, conn):
+        # psycopg2 only sends BEGIN and COMMIT outside autocommit mode
+        if not getattr(conn.connection.dbapi_connection, 'autocommit', False):
+            self.count += 1
+
+
+def before(alias, visit):
+    link = ShortLink.query.filter_by(short_url=alias).first()
+    if link.max_clicks == -1 or link.max_clicks > link.current_clicks:
+        link.current_clicks += 1
+        db.session.commit()
+        ip_address, user_agent, country = visit
+        db.session.add(Visit(link.id, ip_addresses.id_for(ip_address), user_agents.id_for(user_agent), country))
+        db.session.commit()
+
+
+def after(alias, visit):
+    redirect_sql.follow(alias, visit)
+
+
+def timed(follow, alias, visit, clicks, trips):
+    wall = []
+    start_count = trips.count
+    for _ in range(clicks):
+        started = time.perf_counter()
+        follow(alias, visit)
+        wall.append(time.perf_counter() - started)
+        db.session.remove()
+    return (trips.count - start_count) / clicks, statistics.mean(wall) * 1e6, statistics.quantiles(wall, n=100)[98] * 1e6
+
+
+def race(follow, alias, visit, threads, per_thread):
+    def clicker():
+        with app.app_context():
+            for _ in range(per_thread):
+                follow(alias, visit)
+                db.session.remove()
+    workers = [threading.Thread(target=clicker) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    link = ShortLink.query.filter_by(short_url=alias).first()
+    db.session.refresh(link)
+    return link.current_clicks, Visit.query.filter_by(short_url_id=link.id).count()
+
+
+def main():
+    clicks = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    limit = max(1, clicks // 4)
+    aliases = ['fused-bench', 'fused-race-before', 'fused-race-after']
+    with app.app_context():
+        links = [ShortLink(f'https://example.com/{alias}', alias, created_by=1) for alias in aliases]
+        links[1].max_clicks = links[2].max_clicks = limit
+        db.session.add_all(links)
+        db.session.commit()
+        ids = [link.id for link in links]
+        visit = ('192.0.2.41', 'fused-bench', 'XX')
+        # Cached up front, as a worker would have them after its first visits
+        ip_addresses.id_for(visit[0])
+        user_agents.id_for(visit[1])
+        trips = RoundTrips(db.engine)
+        try:
+            rows = [(name,) + timed(follow, aliases[0], visit, clicks, trips)
+                    for name, follow in (('before', before), ('after', after))]
+            per_thread = clicks // threads
+            raced = [(name,) + race(follow, alias, visit, threads, per_thread)
+                     for name, follow, alias in (('before', before, aliases[1]), ('after', after, aliases[2]))]
+        finally:
+            db.session.rollback()
+            Visit.query.filter(Visit.short_url_id.in_(ids)).delete()
+            ShortLink.query.filter(ShortLink.id.in_(ids)).delete()
+            db.session.commit()
+        dialect = db.engine.dialect.name
+    print(f"{clicks} redirects on {dialect}")
+    print(f"{'redirect':<8} {'round trips':>11} {'mean µs':>9} {'p99':>9}")
+    for name, per_click, mean, p99 in rows:
+        print(f"{name:<8} {per_click:>11.1f} {mean:>9.1f} {p99:>9.1f}")
+    print(f"after is {(1 - rows[1][2] / rows[0][2]) * 100:.1f}% faster")
+    print(f"{threads} threads x {per_thread} clicks on a link limited to {limit}")
+    print(f"{'redirect':<8} {'counted':>8} {'visits':>8}")
+    for name, counted, logged in raced:
+        print(f"{name:<8} {counted:>8} {logged:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Balance and remapping of the consistent-hash ring, and batch writes against the shards.
+
+    python -m benchmarks.sharding [keys]
+
+The ring part is pure Python: `keys` cache keys are placed on 3 nodes for several virtual node
+counts, then a 4th node is added and one removed. Ideally a node holds 1/N of the keys and a
+membership change moves 1/N of them, all to (or from) the changed node.
+
+With REDIS_NODES set, the same keys are also written through ShardedRedis pipelines (batches of
+1000) and through a plain pipeline to the first node alone; the keys are deleted afterwards.
+"""
+import statistics
+import sys
+import time
+from collections import Counter
+
+from project.clients import get_cache
+from project.sharding import HashRing, ShardedRedis
+
+NODES = ['redis-a:6379', 'redis-b:6379', 'redis-c:6379']
+BATCH = 1000
+
+
+def balance(ring, keys):
+    counts = Counter(ring.node_for(key) for key in keys)
+    mean = len(keys) / len(ring.nodes)
+    return max(counts.values()) / mean, statistics.pstdev(counts.values()) / mean
+
+
+def moved(before, after, keys, changed):
+    """(share of keys that changed node, share of those that involve the changed node)."""
+    moves = [(before.node_for(key), after.node_for(key)) for key in keys]
+    moves = [move for move in moves if move[0] != move[1]]
+    return len(moves) / len(keys), sum(changed in move for move in moves) / max(len(moves), 1)
+
+
+def ring_report(keys):
+    print(f"{'vnodes':>7} {'max/mean':>9} {'stdev':>7} {'+1 moved':>9} {'to new':>7} {'-1 moved':>9} {'from old':>9}")
+    for vnodes in (1, 10, 40, 160, 500):
+        ring = HashRing(NODES, vnodes)
+        peak, spread = balance(ring, keys)
+        grown = HashRing(NODES + ['redis-d:6379'], vnodes)
+        added, to_new = moved(ring, grown, keys, 'redis-d:6379')
+        shrunk = HashRing(NODES[1:], vnodes)
+        removed, from_old = moved(ring, shrunk, keys, NODES[0])
+        print(f"{vnodes:>7} {peak:>9.2f} {spread:>6.1%} {added:>9.1%} {to_new:>7.0%} {removed:>9.1%} {from_old:>9.0%}")
+    print(f"ideal: max/mean 1.00, +1 moves {1 / 4:.1%}, -1 moves {1 / 3:.1%}")
+
+
+def write_all(client, keys):
+    started = time.perf_counter()
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.set(key, 't0')
+        if len(pipe) >= BATCH:
+            pipe.execute()
+    pipe.execute()
+    return len(keys) / (time.perf_counter() - started)
+
+
+def delete_all(client, keys):
+    for start in range(0, len(keys), BATCH):
+        client.delete(*keys[start:start + BATCH])
+
+
+def live_report(keys):
+    sharded = get_cache()
+    if not isinstance(sharded, ShardedRedis):
+        print("REDIS_NODES is not set; skipping the live shards")
+        return
+    first = next(iter(sharded.clients.values()))
+    try:
+        single = write_all(first, keys)
+        delete_all(first, keys)
+        spread = write_all(sharded, keys)
+        print(f"pipelined SET: {single:,.0f} keys/s on one node, {spread:,.0f} keys/s over {len(sharded.clients)} shards")
+        for node, client in sharded.clients.items():
+            info = client.info('memory')
+            print(f"  {node}: {client.dbsize()} keys, used_memory {info['used_memory'] / 2 ** 20:.1f} MB")
+    finally:
+        delete_all(sharded, keys)
+        delete_all(first, keys)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    keys = [f"bench:shard:https://example.com/{i}?utm_source=bench" for i in range(count)]
+    ring_report(keys)
+    live_report(keys)
+
+
+if __name__ == '__main__':
+    main()
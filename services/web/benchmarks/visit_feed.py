@@ -0,0 +1,185 @@
+"""Dashboards watching visits during a redirect load: polling /visits/data vs the /visits/stream feed.
+
+    python -m benchmarks.visit_feed [--dashboards 5] [--poll-seconds 2] [--duration 20]
+                                    [--workers 2] [--threads 8] [--clients 4] [--out k6/results/visit_feed.csv]
+
+Runs inside the web container against DATABASE_URL. Fresh unlimited links are created, and for
+each mode a gunicorn is started on a free local port (as in benchmarks.hot_row). For
+--duration seconds, --clients keep-alive clients follow the links while --dashboards
+logged-in dashboards watch the visits:
+
+    poll    each dashboard reloads the first page of the visits table (/visits/data) every
+            --poll-seconds, as an operator refreshing it does
+    stream  each dashboard holds /visits/stream open and reads the visits as they come
+
+Per mode the output has: redirects/s and their p99, the dashboards' requests and what a
+dashboard waits for, i.e. the /visits/data response time when polling and the delay from
+visit to event when streaming, and the rows Postgres read per second (pg_stat_database
+tup_returned + tup_fetched). Links and visits are deleted afterwards.
+"""
+import argparse
+import csv
+import http.client
+import json
+import os
+import signal
+import statistics
+import threading
+import time
+from datetime import datetime as dt
+
+from sqlalchemy import text, delete
+
+from project.wsgi import app
+from project.models import db, ShortLink, User, Visit
+from benchmarks.hot_row import start_gunicorn, USER_AGENT
+
+_ROWS_READ = text("SELECT tup_returned + tup_fetched FROM pg_stat_database WHERE datname = current_database()")
+
+
+def session_cookie(user_id):
+    """A signed Flask session for `user_id`, as a login would set it."""
+    with app.app_context():
+        serializer = app.session_interface.get_signing_serializer(app)
+        return f"{app.config['SESSION_COOKIE_NAME']}={serializer.dumps({'_user_id': str(user_id), '_fresh': True})}"
+
+
+def percentile(values, p):
+    return statistics.quantiles(values, n=100)[p - 1] if len(values) > 1 else (values[0] if values else 0)
+
+
+def follow_links(port, aliases, stop, latencies):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    n = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        conn.request('GET', f'/{aliases[n % len(aliases)]}', headers={'User-Agent': USER_AGENT})
+        conn.getresponse().read()
+        latencies.append((time.perf_counter() - started) * 1000)
+        n += 1
+
+
+def poll(port, cookie, interval, stop, waits):
+    while not stop.is_set():
+        # A new connection each time: the server closes idle keep-alive connections after a couple of seconds
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        started = time.perf_counter()
+        conn.request('GET', '/visits/data?draw=1&start=0&length=10', headers={'Cookie': cookie})
+        conn.getresponse().read()
+        waits.append((time.perf_counter() - started) * 1000)
+        conn.close()
+        stop.wait(interval)
+
+
+def stream(port, cookie, stop, waits):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.request('GET', '/visits/stream', headers={'Cookie': cookie})
+    response = conn.getresponse()
+    # Only events of this run: the backlog sent on connect is left out
+    opened = dt.now()
+    while not stop.is_set():
+        try:
+            line = response.fp.readline()
+        except OSError:
+            # The server went away at the end of the run
+            break
+        if not line:
+            break
+        if line.startswith(b'data: '):
+            created_at = dt.fromisoformat(json.loads(line[6:])['created_at'])
+            if created_at >= opened:
+                waits.append((dt.now() - created_at).total_seconds() * 1000)
+    conn.close()
+
+
+def run(mode, aliases, cookie, args):
+    server, port = start_gunicorn(args.workers, args.threads)
+    stop = threading.Event()
+    latencies = []
+    waits = []
+    try:
+        with app.app_context():
+            rows_before = db.session.execute(_ROWS_READ).scalar()
+            db.session.remove()
+        dashboards = [threading.Thread(target=poll, args=(port, cookie, args.poll_seconds, stop, waits))
+                      if mode == 'poll' else threading.Thread(target=stream, args=(port, cookie, stop, waits), daemon=True)
+                      for _ in range(args.dashboards)]
+        clients = [threading.Thread(target=follow_links, args=(port, aliases[i::args.clients], stop, latencies))
+                   for i in range(args.clients)]
+        for thread in dashboards + clients:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in clients + [thread for thread in dashboards if not thread.daemon]:
+            thread.join()
+        with app.app_context():
+            rows_read = db.session.execute(_ROWS_READ).scalar() - rows_before
+            db.session.remove()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(60)
+    return {
+        'mode': mode,
+        'dashboards': args.dashboards,
+        'redirects_per_s': round(len(latencies) / args.duration, 1),
+        'redirect_p99_ms': round(percentile(latencies, 99), 1),
+        'dashboard_requests': len(waits) if mode == 'poll' else args.dashboards,
+        'dashboard_wait_p50_ms': round(percentile(waits, 50), 1),
+        'dashboard_wait_p99_ms': round(percentile(waits, 99), 1),
+        'db_rows_read_per_s': round(rows_read / args.duration),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dashboards', type=int, default=5)
+    parser.add_argument('--poll-seconds', type=float, default=2)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='Each open stream holds one')
+    parser.add_argument('--clients', type=int, default=4, help='Clients following the links')
+    parser.add_argument('--links', type=int, default=100)
+    parser.add_argument('--out', default=os.path.join('k6', 'results', 'visit_feed.csv'))
+    args = parser.parse_args()
+
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            raise SystemExit("Needs Postgres (DATABASE_URL)")
+        user = User.query.first()
+        if user is None:
+            raise SystemExit("Needs a user: register one first")
+        links = [ShortLink(f'https://example.com/visit-feed/{i}', f'visit-feed-{i}', created_by=user.id)
+                 for i in range(args.links)]
+        db.session.add_all(links)
+        db.session.commit()
+        ids = [link.id for link in links]
+        aliases = [link.short_url for link in links]
+        user_id = user.id
+        db.session.remove()
+    cookie = session_cookie(user_id)
+    # Published in both modes, so the redirects cost the same
+    os.environ.update(VISIT_FEED='true', GUNICORN_THREADS=str(args.threads))
+    rows = []
+    try:
+        for mode in ('poll', 'stream'):
+            print(f"[visit_feed] {mode}: {args.dashboards} dashboards, {args.clients} clients for {args.duration:.0f} s")
+            rows.append(run(mode, aliases, cookie, args))
+    finally:
+        with app.app_context():
+            db.session.execute(delete(Visit).where(Visit.short_url_id.in_(ids)))
+            db.session.execute(delete(ShortLink).where(ShortLink.id.in_(ids)))
+            db.session.commit()
+
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(' '.join(f"{c:>22}" for c in rows[0]))
+    for row in rows:
+        print(' '.join(f"{row[c]!s:>22}" for c in row))
+    print(f"Wrote {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""Visit row width, table/index size and insert throughput: inline strings (before) vs lookup ids (after).
+
+    python -m benchmarks.visit_storage [rows] [inserts]
+
+Runs inside the web container against Postgres. Both layouts are built as scratch tables
+(bench_visits_*), filled with the same synthetic visits and dropped afterwards. Inserts are
+timed one visit per transaction, the way log_visit wrote them; the "after" side resolves the
+user agent and IP through the same cached Dimension lookups the app uses.
+"""
+import random
+import sys
+import time
+
+import sqlalchemy as sa
+
+from project.wsgi import app
+from project.dimensions import Dimension
+from project.models import db, country_names
+
+metadata = sa.MetaData()
+bench_user_agents = sa.Table(
+    'bench_user_agents', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('value', sa.String(255), nullable=False, unique=True),
+)
+bench_ip_addresses = sa.Table(
+    'bench_ip_addresses', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('value', sa.String(45), nullable=False, unique=True),
+)
+# The visits layout before and after migration 856c6e5252af
+wide = sa.Table(
+    'bench_visits_wide', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('short_url_id', sa.Integer, nullable=False),
+    sa.Column('ip_address', sa.String(255), nullable=False),
+    sa.Column('user_agent', sa.String(255), nullable=False),
+    sa.Column('country', sa.String(255), nullable=False),
+    sa.Column('country_name', sa.String(255), nullable=False),
+    sa.Column('created_at', sa.DateTime, nullable=False, server_default=sa.func.now()),
+    sa.Column('updated_at', sa.DateTime, nullable=False, server_default=sa.func.now()),
+    sa.Index('ix_bench_visits_wide_link', 'short_url_id', 'created_at'),
+)
+narrow = sa.Table(
+    'bench_visits_narrow', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('short_url_id', sa.Integer, nullable=False),
+    sa.Column('ip_address_id', sa.Integer, nullable=False),
+    sa.Column('user_agent_id', sa.Integer, nullable=False),
+    sa.Column('country', sa.String(2), nullable=False),
+    sa.Column('created_at', sa.DateTime, nullable=False, server_default=sa.func.now()),
+    sa.Column('updated_at', sa.DateTime, nullable=False, server_default=sa.func.now()),
+    sa.Index('ix_bench_visits_narrow_link', 'short_url_id', 'created_at'),
+)
+
+USER_AGENTS = [
+    f"Mozilla/5.0 ({platform}) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{major}.0.0.0 Safari/537.36"
+    for platform in ("Windows NT 10.0; Win64; x64", "Macintosh; Intel Mac OS X 10_15_7", "X11; Linux x86_64",
+                     "Linux; Android 14; Pixel 8", "iPhone; CPU iPhone OS 17_5 like Mac OS X")
+    for major in range(110, 130)
+] + ["k6/0.52.0 (https://k6.io/)", "curl/8.5.0", "Googlebot/2.1 (+http://www.google.com/bot.html)"]
+
+
+def synthetic_visits(n, seed=7):
+    rng = random.Random(seed)
+    codes = [code for code in country_names() if code != "XX"]
+    for _ in range(n):
+        country = rng.choice(codes)
+        yield {
+            'short_url_id': rng.randint(1, 5000),
+            # ~20k distinct clients, a few heavy hitters
+            'ip_address': f"10.{rng.randint(0, 3)}.{int(rng.paretovariate(1.2)) % 256}.{rng.randint(1, 20)}",
+            'user_agent': USER_AGENTS[min(int(rng.expovariate(0.15)), len(USER_AGENTS) - 1)],
+            'country': country,
+            'country_name': country_names()[country],
+        }
+
+
+def narrow_row(visit, user_agents, ip_addresses):
+    return {
+        'short_url_id': visit['short_url_id'],
+        'ip_address_id': ip_addresses.id_for(visit['ip_address']),
+        'user_agent_id': user_agents.id_for(visit['user_agent']),
+        'country': visit['country'],
+    }
+
+
+def insert_one(table, row):
+    started = time.perf_counter()
+    with db.engine.begin() as conn:
+        conn.execute(table.insert(), row() if callable(row) else row)
+    return time.perf_counter() - started
+
+
+def time_inserts(visits, user_agents, ip_addresses):
+    """Inserts/s for both layouts; the two are interleaved visit by visit so drift hits both equally."""
+    wide_time = narrow_time = 0.0
+    for visit in visits:
+        wide_time += insert_one(wide, visit)
+        # Resolving ids is part of the insert path, so it is timed too
+        narrow_time += insert_one(narrow, lambda: narrow_row(visit, user_agents, ip_addresses))
+    return len(visits) / wide_time, len(visits) / narrow_time
+
+
+def sizes(conn, table):
+    return conn.execute(sa.text(
+        f"SELECT pg_relation_size('{table.name}'), pg_indexes_size('{table.name}'), "
+        f"(SELECT avg(pg_column_size(t.*)) FROM {table.name} t)"
+    )).first()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    inserts = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            sys.exit("visit_storage needs Postgres (DATABASE_URL)")
+        metadata.drop_all(db.engine)
+        metadata.create_all(db.engine)
+        try:
+            user_agents = Dimension(bench_user_agents, 10000)
+            ip_addresses = Dimension(bench_ip_addresses, 100000)
+            sample = list(synthetic_visits(inserts, seed=11))
+            # First with every value new to the process (a miss upserts into the lookup table),
+            # then again with the cache warm
+            wide_rate, cold_rate = time_inserts(sample, user_agents, ip_addresses)
+            wide_rate_again, warm_rate = time_inserts(sample, user_agents, ip_addresses)
+
+            # Bulk load in 5000-row batches, which is where row width shows. Ids are resolved up
+            # front here so only the database side is timed.
+            wide_bulk = narrow_bulk = 0.0
+            visits = list(synthetic_visits(rows))
+            narrow_rows = [narrow_row(visit, user_agents, ip_addresses) for visit in visits]
+            for start in range(0, rows, 5000):
+                started = time.perf_counter()
+                with db.engine.begin() as conn:
+                    conn.execute(wide.insert(), visits[start:start + 5000])
+                wide_bulk += time.perf_counter() - started
+                started = time.perf_counter()
+                with db.engine.begin() as conn:
+                    conn.execute(narrow.insert(), narrow_rows[start:start + 5000])
+                narrow_bulk += time.perf_counter() - started
+            with db.engine.connect() as conn:
+                wide_heap, wide_index, wide_row = sizes(conn, wide)
+                narrow_heap, narrow_index, narrow_row_width = sizes(conn, narrow)
+                dims = conn.execute(sa.text(
+                    "SELECT pg_total_relation_size('bench_user_agents') + pg_total_relation_size('bench_ip_addresses')"
+                )).scalar()
+        finally:
+            metadata.drop_all(db.engine)
+
+    def change(before, after):
+        return f"{(after / before - 1) * 100:+.1f}%"
+
+    print(f"{rows} visits, {inserts} single-row inserts")
+    print(f"{'':<22} {'before':>12} {'after':>12} {'change':>8}")
+    print(f"{'avg row bytes':<22} {float(wide_row):>12.1f} {float(narrow_row_width):>12.1f} {change(wide_row, narrow_row_width):>8}")
+    print(f"{'heap MB':<22} {wide_heap / 2**20:>12.2f} {narrow_heap / 2**20:>12.2f} {change(wide_heap, narrow_heap):>8}")
+    print(f"{'index MB':<22} {wide_index / 2**20:>12.2f} {narrow_index / 2**20:>12.2f} {change(wide_index, narrow_index):>8}")
+    print(f"{'lookup tables MB':<22} {'':>12} {dims / 2**20:>12.2f}")
+    print(f"{'inserts/s, cold cache':<22} {wide_rate:>12.0f} {cold_rate:>12.0f} {change(wide_rate, cold_rate):>8}")
+    print(f"{'inserts/s, warm cache':<22} {wide_rate_again:>12.0f} {warm_rate:>12.0f} {change(wide_rate_again, warm_rate):>8}")
+    print(f"{'bulk rows/s':<22} {rows / wide_bulk:>12.0f} {rows / narrow_bulk:>12.0f} {change(narrow_bulk, wide_bulk):>8}")
+
+
+if __name__ == '__main__':
+    main()
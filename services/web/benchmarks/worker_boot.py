@@ -0,0 +1,112 @@
+"""Worker boot time, first-request latency and per-worker memory, with and without --preload.
+
+    python -m benchmarks.worker_boot [workers] [requests]
+
+Runs inside the web container. For each mode a separate gunicorn is started on a free local
+port with gunicorn.conf.py and GUNICORN_PRELOAD set accordingly. Boot times come from the
+"Worker ... ready" lines gunicorn.conf.py logs (fork until the worker can serve). The first request
+goes to an unknown alias, so it opens a database connection in the worker that serves it.
+Memory is read from /proc/<pid>/smaps_rollup once the requests are done: PSS splits shared pages
+between the processes sharing them, USS is what each worker holds on its own.
+"""
+import http.client
+import os
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+READY = re.compile(r"Worker (\d+) ready in ([\d.]+) ms")
+PROBE = '/__worker_boot_probe__'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def memory_kb(pid):
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if rest.strip().endswith('kB'):
+                fields[name] = int(rest.split()[0])
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'uss': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def get(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    started = time.perf_counter()
+    conn.request('GET', path)
+    conn.getresponse().read()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return elapsed * 1000
+
+
+def run(preload, workers, requests):
+    port = free_port()
+    env = dict(os.environ, GUNICORN_PRELOAD=str(preload))
+    started = time.monotonic()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers), '--threads', os.environ.get('GUNICORN_THREADS', '2'), 'project.wsgi:app'],
+        env=env, stderr=subprocess.PIPE, text=True)
+    booted = {}
+    all_ready = threading.Event()
+
+    def read_log():
+        for line in server.stderr:
+            match = READY.search(line)
+            if match:
+                booted[int(match.group(1))] = float(match.group(2))
+                if len(booted) == workers:
+                    all_ready.set()
+
+    threading.Thread(target=read_log, daemon=True).start()
+    try:
+        if not all_ready.wait(120):
+            sys.exit(f"gunicorn did not boot {workers} workers (exit code {server.poll()})")
+        ready_ms = (time.monotonic() - started) * 1000
+        first_ms = get(port, PROBE)
+        warm_ms = statistics.median(get(port, PROBE) for _ in range(requests))
+        memory = [memory_kb(pid) for pid in booted]
+        master = memory_kb(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(30)
+    return {
+        'mode': 'preload' if preload else 'no preload',
+        'all ready ms': ready_ms,
+        'worker boot ms': statistics.mean(booted.values()),
+        'first req ms': first_ms,
+        'warm req ms': warm_ms,
+        'worker rss MB': statistics.mean(m['rss'] for m in memory) / 1024,
+        'worker pss MB': statistics.mean(m['pss'] for m in memory) / 1024,
+        'worker uss MB': statistics.mean(m['uss'] for m in memory) / 1024,
+        'total pss MB': (master['pss'] + sum(m['pss'] for m in memory)) / 1024,
+    }
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rows = [run(False, workers, requests), run(True, workers, requests)]
+    print(f"{workers} workers")
+    print(' '.join(f"{name:>14}" for name in rows[0]))
+    for row in rows:
+        print(' '.join(f"{value:>14.1f}" if isinstance(value, float) else f"{value:>14}" for value in row.values()))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,5 +4,5 @@ if [ ! -z "$@" ]; then
   exec "$@"
 else
   # Use Gunicorn to serve the app
-  exec gunicorn --bind 0.0.0.0:8080 project.wsgi:app --workers 4 --threads 2
+  exec gunicorn --config gunicorn.conf.py --bind 0.0.0.0:8080 project.wsgi:app --workers "${GUNICORN_WORKERS:-4}" --threads "${GUNICORN_THREADS:-2}"
 fi
\ No newline at end of file
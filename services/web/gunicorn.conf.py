@@ -0,0 +1,38 @@
+"""Gunicorn settings (entrypoint.sh passes this file with --config).
+
+GUNICORN_PRELOAD (default true) imports the app once in the master and forks it into the
+workers: code, compiled templates and read-only data are then shared copy-on-write instead
+of being loaded again by every worker.
+"""
+import gc
+import os
+import time
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "True").lower() in ["true", "1", "t"]
+
+
+def when_ready(server):
+    # Runs in the master before the first worker is forked
+    if not server.cfg.preload_app:
+        return
+    from project.models import country_names
+    app = server.app.wsgi()
+    country_names()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    # Keep the collector from writing to (and so copying) every page of objects loaded so far
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    worker.fork_started = time.monotonic()
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from project.clients import reset_after_fork
+        reset_after_fork(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s ready in %.1f ms", worker.pid, (time.monotonic() - worker.fork_started) * 1000)
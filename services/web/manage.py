@@ -1,8 +1,18 @@
+import os
+import time
+from datetime import datetime
+
+import click
 from flask.cli import FlaskGroup
 
-from project import app, db, ShortLink
+from project import create_app, db, ShortLink
+from project.partitions import ensure_partitions, apply_retention
+from project.datagen import generate_links, generate_visits
+from project.snapshot import build as build_redirect_snapshot
+from project import trace_collector
+from project.canonical import canonicalizer, backfill_canonical_urls
 
-cli = FlaskGroup(app)
+cli = FlaskGroup(create_app=create_app)
 
 
 @cli.command("create_db")
@@ -19,5 +29,93 @@ def seed_db():
     db.session.commit()
 
 
+@cli.command("visits_partitions")
+@click.option("--months-ahead", default=3, show_default=True, help="Create partitions this many months ahead.")
+def visits_partitions(months_ahead):
+    created = ensure_partitions(db.engine, months_ahead)
+    print(f"Created {created} visit partition(s)")
+
+
+@cli.command("visits_retention")
+@click.option("--keep-months", default=12, show_default=True, help="Months of visits to keep online.")
+@click.option("--archive-dir", default="archive/visits", show_default=True, help="Where exported partitions go.")
+def visits_retention(keep_months, archive_dir):
+    for path in apply_retention(db.engine, keep_months, archive_dir):
+        print(f"Archived and dropped {path.name[:-len('.csv.gz')]} -> {path}")
+
+
+@cli.command("generate_data")
+@click.option("--links", default=int(os.environ.get("NUM_FIXED_URLS", 50000)), show_default=True,
+              help="Links t0..t{N-1} -> https://example.com/{i} (NUM_FIXED_URLS).")
+@click.option("--visits", default=500000, show_default=True, help="Visits spread over those links.")
+@click.option("--skip-links", is_flag=True, help="The links exist already; only add visits.")
+@click.option("--seed", default=0, show_default=True, help="Same seed, same data.")
+@click.option("--days", default=90, show_default=True, help="Visits and link creation dates span this many days.")
+@click.option("--end", type=click.DateTime(), default=None, help="End of the time window (default: now).")
+@click.option("--zipf-s", default=1.1, show_default=True, help="Skew of link popularity.")
+@click.option("--user-agents", default=2000, show_default=True, help="Distinct user agents.")
+@click.option("--ips", default=100000, show_default=True, help="Distinct visitor IPs.")
+@click.option("--owner", default=1, show_default=True, help="User id the links belong to.")
+@click.option("--chunk-size", default=10000, show_default=True, help="Rows per COPY / INSERT.")
+def generate_data(links, visits, skip_links, seed, days, end, zipf_s, user_agents, ips, owner, chunk_size):
+    """Stream synthetic links and visits into the database in constant memory."""
+    end = end or datetime.now()
+
+    def progress(kind, written, total):
+        if written == total or written % (chunk_size * 10) == 0:
+            print(f"{kind}: {written}/{total}")
+
+    if not skip_links and links:
+        if ShortLink.query.filter_by(short_url="t0").first():
+            raise click.ClickException("Link t0 already exists; pass --skip-links to only add visits")
+        generate_links(db.engine, links, seed, days, owner, chunk_size, end, progress)
+    if visits and links:
+        generate_visits(db.engine, visits, links, seed, days, zipf_s, user_agents, ips, chunk_size, end, progress)
+
+
+@cli.command("build_snapshot")
+@click.option("--out", default=os.environ.get("REDIRECT_SNAPSHOT", "snapshots/redirects.snap"), show_default=True,
+              help="Snapshot file the workers map (REDIRECT_SNAPSHOT).")
+@click.option("--every", default=0, show_default=True, help="Rebuild every N seconds instead of once.")
+def build_snapshot(out, every):
+    """Compile the servable links into the memory-mapped redirect snapshot."""
+    while True:
+        started = time.monotonic()
+        links, watermark = build_redirect_snapshot(db.engine, out)
+        print(f"Wrote {links} links to {out} (changes up to {watermark}) in {time.monotonic() - started:.1f}s")
+        if not every:
+            return
+        time.sleep(max(0, every - (time.monotonic() - started)))
+
+
+@cli.command("canonicalize_urls")
+@click.option("--all", "all_rows", is_flag=True, help="Recompute every link, not only those without one (after CANONICAL_* changes).")
+@click.option("--batch-size", default=1000, show_default=True, help="Links per committed batch.")
+@click.option("--duty-cycle", default=0.5, show_default=True, help="Share of the time spent updating.")
+def canonicalize_urls(all_rows, batch_size, duty_cycle):
+    """Fill shortlinks.canonical_url in throttled, resumable batches."""
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        updated = backfill_canonical_urls(conn, canonicalizer, not all_rows, batch_size, duty_cycle)
+    print(f"Updated {updated} link(s)")
+
+
+@cli.command("trace_collector")
+@click.option("--port", default=4318, show_default=True, help="Port to accept spans on (TRACE_EXPORT=http://host:port/).")
+@click.option("--out", default="traces/collected.jsonl", show_default=True, help="JSON lines file the spans go to.")
+def run_trace_collector(port, out):
+    """Stand-in collector for TRACE_EXPORT=http://...: appends the spans it receives to a file."""
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    trace_collector.serve(port, out)
+
+
+@cli.command("trace_report")
+@click.argument("path", default=os.environ.get("TRACE_EXPORT", "traces/spans.jsonl"))
+@click.option("--top", default=10, show_default=True, help="Slowest traces to list.")
+def trace_report(path, top):
+    """Where the kept traces spent their time: pool wait, SQL, Redis, JSON, templates, app code."""
+    trace_collector.report(path, top)
+
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,72 @@
+"""Log link changes for the redirect snapshot
+
+Revision ID: 279cfff15b6e
+Revises: 3d05bbf7fe31
+Create Date: 2026-10-19 23:12:40.518021
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '279cfff15b6e'
+down_revision = '3d05bbf7fe31'
+branch_labels = None
+depends_on = None
+
+# Only columns that decide whether and where a redirect goes; the click counter is
+# updated on every redirect and must not fire it
+WATCHED = 'short_url, original_url, redirect_policy, max_clicks, expiration_date, expired, deleted'
+
+PG_FUNCTION = """
+CREATE FUNCTION log_link_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        INSERT INTO link_changes (short_url) VALUES (OLD.short_url);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.short_url IS DISTINCT FROM OLD.short_url) THEN
+        INSERT INTO link_changes (short_url) VALUES (NEW.short_url);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+SQLITE_TRIGGERS = {
+    'link_change_insert': "AFTER INSERT ON shortlinks BEGIN "
+                          "INSERT INTO link_changes (short_url) VALUES (NEW.short_url); END",
+    'link_change_delete': "AFTER DELETE ON shortlinks BEGIN "
+                          "INSERT INTO link_changes (short_url) VALUES (OLD.short_url); END",
+    'link_change_update': f"AFTER UPDATE OF {WATCHED} ON shortlinks BEGIN "
+                          "INSERT INTO link_changes (short_url) VALUES (OLD.short_url); "
+                          "INSERT INTO link_changes (short_url) SELECT NEW.short_url "
+                          "WHERE NEW.short_url IS NOT OLD.short_url; END",
+}
+
+
+def upgrade():
+    op.create_table(
+        'link_changes',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('short_url', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(PG_FUNCTION)
+        op.execute(f"CREATE TRIGGER log_link_change AFTER INSERT OR DELETE OR UPDATE OF {WATCHED} "
+                   "ON shortlinks FOR EACH ROW EXECUTE FUNCTION log_link_change()")
+    else:
+        for name, body in SQLITE_TRIGGERS.items():
+            op.execute(f"CREATE TRIGGER {name} {body}")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP TRIGGER log_link_change ON shortlinks")
+        op.execute("DROP FUNCTION log_link_change()")
+    else:
+        for name in SQLITE_TRIGGERS:
+            op.execute(f"DROP TRIGGER {name}")
+    op.drop_table('link_changes')
@@ -0,0 +1,34 @@
+"""Add the link_cache table
+
+Revision ID: 3d05bbf7fe31
+Revises: 99de00d15d89
+Create Date: 2026-10-19 21:05:17.284416
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d05bbf7fe31'
+down_revision = '99de00d15d89'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    # Cache rows aren't worth WAL writes or replication; the table comes back empty after a crash
+    prefixes = ['UNLOGGED'] if conn.dialect.name == 'postgresql' else []
+    op.create_table(
+        'link_cache',
+        sa.Column('key', sa.LargeBinary(length=16), nullable=False),
+        sa.Column('short_url', sa.Text(), nullable=False),
+        sa.Column('expires_at', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('key'),
+        prefixes=prefixes,
+    )
+
+
+def downgrade():
+    op.drop_table('link_cache')
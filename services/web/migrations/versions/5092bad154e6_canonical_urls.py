@@ -0,0 +1,248 @@
+"""Canonical URLs for by_long lookups
+
+Revision ID: 5092bad154e6
+Revises: 8cdd46386048
+Create Date: 2026-10-21 10:12:47.208351
+
+"""
+import fnmatch
+import os
+import re
+import string
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, quote
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5092bad154e6'
+down_revision = '8cdd46386048'
+branch_labels = None
+depends_on = None
+
+
+# Frozen copies of project/canonical.py and project/online_migrations.py as of this revision:
+# the app's package isn't importable when Flask loads the migrations, and later changes to it
+# must not change what this revision does. `manage.py canonicalize_urls --all` applies newer rules.
+
+DEFAULT_IGNORE_PARAMS = 'utm_*,fbclid,gclid,dclid,gbraid,wbraid,msclkid,yclid,igshid,mc_cid,mc_eid,_ga,_gl'
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+UNRESERVED = frozenset(string.ascii_letters + string.digits + '-._~')
+_SAFE = "%:/?#[]@!$&'()*+,;=~"
+_ESCAPE = re.compile(r'%[0-9A-Fa-f]{2}')
+# Postgres' SQLSTATE for "could not obtain lock" when lock_timeout expires
+LOCK_NOT_AVAILABLE = '55P03'
+BATCH_SIZE = 1000
+DUTY_CYCLE = 0.5
+
+
+def _normalize_escapes(value):
+    def fix(match):
+        char = chr(int(match.group(0)[1:], 16))
+        return char if char in UNRESERVED else match.group(0).upper()
+    return _ESCAPE.sub(fix, quote(value, safe=_SAFE))
+
+
+def _remove_dot_segments(path):
+    segments = []
+    for segment in path.split('/'):
+        if segment == '..':
+            if len(segments) > 1:
+                segments.pop()
+        elif segment != '.':
+            segments.append(segment)
+    if path.endswith(('/.', '/..')):
+        segments.append('')
+    return '/'.join(segments)
+
+
+def canonicalizer():
+    """canonicalize(url) with the rules the app used when this revision was written."""
+    patterns = [p.strip() for p in os.environ.get('CANONICAL_IGNORE_PARAMS', DEFAULT_IGNORE_PARAMS).split(',')
+                if p.strip()]
+    ignored = re.compile('|'.join(fnmatch.translate(p) for p in patterns), re.IGNORECASE) if patterns else None
+    strip_trailing_slash = os.environ.get('CANONICAL_STRIP_TRAILING_SLASH', 'True').lower() in ['true', '1', 't']
+
+    def canonicalize(url):
+        url = url.strip()
+        try:
+            parts = urlsplit(url)
+            port = parts.port
+        except ValueError:
+            return url
+        scheme = parts.scheme.lower()
+        if scheme not in DEFAULT_PORTS:
+            return urlunsplit((scheme,) + tuple(parts[1:])) if scheme else url
+
+        host = (parts.hostname or '').rstrip('.')
+        try:
+            host = host.encode('idna').decode('ascii')
+        except UnicodeError:
+            pass
+        if ':' in host:
+            host = f'[{host}]'
+        userinfo = parts.netloc.rpartition('@')[0]
+        netloc = f'{userinfo}@{host}' if userinfo else host
+        if port is not None and port != DEFAULT_PORTS[scheme]:
+            netloc = f'{netloc}:{port}'
+
+        path = _remove_dot_segments(_normalize_escapes(parts.path)) or '/'
+        if strip_trailing_slash and len(path) > 1:
+            path = path.rstrip('/') or '/'
+
+        params = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                  if ignored is None or ignored.match(name) is None]
+        params.sort(key=lambda param: param[0])
+        query = urlencode(params, quote_via=quote)
+        return urlunsplit((scheme, netloc, path, query, _normalize_escapes(parts.fragment)))
+
+    return canonicalize
+
+
+def _postgres(conn):
+    return conn.dialect.name == 'postgresql'
+
+
+def _lock_not_available(error):
+    return getattr(getattr(error, 'orig', None), 'pgcode', None) == LOCK_NOT_AVAILABLE
+
+
+@contextmanager
+def timeouts(conn, lock_timeout='2s', statement_timeout=None):
+    if not _postgres(conn):
+        yield
+        return
+    settings = {'lock_timeout': lock_timeout, 'statement_timeout': statement_timeout}
+    previous = {}
+    for name, value in settings.items():
+        if value is not None:
+            previous[name] = conn.execute(sa.text(f"SHOW {name}")).scalar()
+            conn.execute(sa.text("SELECT set_config(:name, :value, false)"), {'name': name, 'value': str(value)})
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            conn.execute(sa.text("SELECT set_config(:name, :value, false)"), {'name': name, 'value': value})
+
+
+def guarded(conn, operation, *args, lock_timeout='2s', attempts=10, backoff=1.0, **kwargs):
+    """Run the DDL `operation`, retrying in a savepoint when its lock isn't granted within `lock_timeout`."""
+    if not _postgres(conn):
+        return operation(*args, **kwargs)
+    for attempt in range(1, attempts + 1):
+        try:
+            with timeouts(conn, lock_timeout), conn.begin_nested():
+                return operation(*args, **kwargs)
+        except sa.exc.OperationalError as e:
+            if not _lock_not_available(e) or attempt == attempts:
+                raise
+            print(f"Lock not available after {lock_timeout} (attempt {attempt}/{attempts}), retrying")
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+
+def create_hash_index_concurrently(conn, name, table, column, lock_timeout='2s'):
+    """Rebuilds an INVALID index left by a failed concurrent build; needs an autocommit connection."""
+    if not _postgres(conn):
+        conn.execute(sa.text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})"))
+        return
+    invalid = conn.execute(sa.text(
+        "SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"), {'name': name}).scalar()
+    if invalid is False:
+        return
+    with timeouts(conn, lock_timeout):
+        if invalid:
+            conn.execute(sa.text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(sa.text(f"CREATE INDEX CONCURRENTLY {name} ON {table} USING hash ({column})"))
+
+
+def drop_index_concurrently(conn, name, lock_timeout='2s'):
+    if not _postgres(conn):
+        conn.execute(sa.text(f"DROP INDEX IF EXISTS {name}"))
+        return
+    with timeouts(conn, lock_timeout):
+        conn.execute(sa.text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def backfill_canonical_urls(conn, name='shortlinks_canonical_url'):
+    """Fill canonical_url in committed, throttled id ranges; resumes from online_migration_progress.
+
+    Needs an autocommit connection. Rows inserted meanwhile get canonical_url from the app.
+    """
+    canonicalize = canonicalizer()
+    rows = sa.text("SELECT id, original_url FROM shortlinks "
+                   "WHERE id > :low AND id <= :high AND canonical_url IS NULL")
+    if _postgres(conn):
+        # One statement per batch; an executemany would be a round trip per row
+        update = sa.text("UPDATE shortlinks SET canonical_url = v.canonical "
+                         "FROM unnest(CAST(:ids AS integer[]), CAST(:canonicals AS text[])) AS v(id, canonical) "
+                         "WHERE shortlinks.id = v.id")
+    else:
+        update = sa.text("UPDATE shortlinks SET canonical_url = :canonical WHERE id = :id")
+
+    def batch(low, high):
+        changed = [(row.id, canonicalize(row.original_url)) for row in conn.execute(rows, {'low': low, 'high': high})]
+        if changed and _postgres(conn):
+            ids, canonicals = zip(*changed)
+            conn.execute(update, {'ids': list(ids), 'canonicals': list(canonicals)})
+        elif changed:
+            conn.execute(update, [{'id': id, 'canonical': canonical} for id, canonical in changed])
+        return len(changed)
+
+    conn.execute(sa.text("CREATE TABLE IF NOT EXISTS online_migration_progress "
+                         "(name VARCHAR(255) PRIMARY KEY, last_key BIGINT NOT NULL)"))
+    start = conn.execute(sa.text("SELECT last_key FROM online_migration_progress WHERE name = :name"),
+                         {'name': name}).scalar()
+    low, high = conn.execute(sa.text("SELECT min(id), max(id) FROM shortlinks")).first()
+    if high is None:
+        return 0
+    if start is None:
+        start = low - 1
+        conn.execute(sa.text("INSERT INTO online_migration_progress (name, last_key) VALUES (:name, :key)"),
+                     {'name': name, 'key': start})
+    else:
+        print(f"{name}: resuming after id {start}")
+    save = sa.text("UPDATE online_migration_progress SET last_key = :key WHERE name = :name")
+    updated = 0
+    batches = 0
+    started = time.monotonic()
+    with timeouts(conn, '2s', '30s'):
+        while start < high:
+            batch_started = time.monotonic()
+            end = min(start + BATCH_SIZE, high)
+            try:
+                updated += batch(start, end)
+            except sa.exc.OperationalError as e:
+                if not _lock_not_available(e):
+                    raise
+                # Rows held by a long transaction; try the same range again shortly
+                time.sleep(1)
+                continue
+            conn.execute(save, {'name': name, 'key': end})
+            start = end
+            batches += 1
+            elapsed = time.monotonic() - batch_started
+            if batches % 100 == 0 or start >= high:
+                done = (start - low + 1) / (high - low + 1)
+                print(f"{name}: {done:.0%} ({updated} rows, {updated / (time.monotonic() - started):.0f} rows/s)")
+            time.sleep(elapsed * (1 / DUTY_CYCLE - 1))
+    conn.execute(sa.text("DELETE FROM online_migration_progress WHERE name = :name"), {'name': name})
+    return updated
+
+
+def upgrade():
+    guarded(op.get_bind(), op.add_column, 'shortlinks', sa.Column('canonical_url', sa.Text(), nullable=True))
+    # Commits what came before; the backfill commits batch by batch and the index builds concurrently
+    with op.get_context().autocommit_block():
+        backfill_canonical_urls(op.get_bind())
+        # Hash: equality is all the lookup needs, and URLs can exceed a btree entry's size limit
+        create_hash_index_concurrently(op.get_bind(), 'ix_shortlinks_canonical_url', 'shortlinks', 'canonical_url')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        drop_index_concurrently(op.get_bind(), 'ix_shortlinks_canonical_url')
+    guarded(op.get_bind(), op.drop_column, 'shortlinks', 'canonical_url')
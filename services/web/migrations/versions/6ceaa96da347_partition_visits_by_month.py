@@ -0,0 +1,114 @@
+"""Partition visits by month
+
+Revision ID: 6ceaa96da347
+Revises: 90ecba9a74e8
+Create Date: 2026-10-19 09:12:41.503118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6ceaa96da347'
+down_revision = '90ecba9a74e8'
+branch_labels = None
+depends_on = None
+
+
+# Creates the monthly partitions covering [first month, current month + months_ahead].
+# Rows that already landed in visits_default for one of those months are moved into
+# the new partition before it is attached. Callers serialise on an advisory lock so
+# several workers can run it at once.
+ENSURE_PARTITIONS_FUNCTION = """
+CREATE OR REPLACE FUNCTION visits_ensure_partitions(months_ahead integer, first_month date DEFAULT NULL)
+RETURNS integer AS $$
+DECLARE
+    month_start date := date_trunc('month', coalesce(first_month, now()::date));
+    last_month date := date_trunc('month', now()::date) + make_interval(months => months_ahead);
+    partition_name text;
+    created integer := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('visits_ensure_partitions'));
+    WHILE month_start <= last_month LOOP
+        partition_name := format('visits_p%s', to_char(month_start, 'YYYY_MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE visits INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM visits_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM moved',
+                month_start, month_start + interval '1 month', partition_name);
+            EXECUTE format('ALTER TABLE visits ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, month_start, month_start + interval '1 month');
+            created := created + 1;
+        END IF;
+        month_start := month_start + interval '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade():
+    conn = op.get_bind()
+    if conn.dialect.name != 'postgresql':
+        # Declarative partitioning is Postgres-only; other backends keep the plain table
+        return
+
+    op.execute("ALTER TABLE visits RENAME TO visits_legacy")
+    op.execute("ALTER TABLE visits_legacy RENAME CONSTRAINT visits_pkey TO visits_legacy_pkey")
+    # The partition key has to be part of the primary key
+    op.execute("""
+        CREATE TABLE visits (
+            id integer NOT NULL DEFAULT nextval('visits_id_seq'),
+            short_url_id integer NOT NULL REFERENCES shortlinks (id),
+            ip_address varchar(255) NOT NULL,
+            user_agent varchar(255) NOT NULL,
+            country varchar(255) NOT NULL,
+            country_name varchar(255) NOT NULL DEFAULT 'Unknown',
+            created_at timestamp NOT NULL DEFAULT now(),
+            updated_at timestamp NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("CREATE TABLE visits_default PARTITION OF visits DEFAULT")
+    op.execute("CREATE INDEX ix_visits_created_at ON visits (created_at)")
+    op.execute("CREATE INDEX ix_visits_short_url_id_created_at ON visits (short_url_id, created_at)")
+    op.execute(ENSURE_PARTITIONS_FUNCTION)
+
+    first_month = conn.execute(sa.text("SELECT min(created_at)::date FROM visits_legacy")).scalar()
+    conn.execute(sa.text("SELECT visits_ensure_partitions(3, :first_month)"), {"first_month": first_month})
+    op.execute("""
+        INSERT INTO visits (id, short_url_id, ip_address, user_agent, country, country_name, created_at, updated_at)
+        SELECT id, short_url_id, ip_address, user_agent, country, country_name, created_at, updated_at
+        FROM visits_legacy
+    """)
+    op.execute("ALTER SEQUENCE visits_id_seq OWNED BY visits.id")
+    op.execute("DROP TABLE visits_legacy")
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name != 'postgresql':
+        return
+
+    op.execute("""
+        CREATE TABLE visits_legacy (
+            id integer NOT NULL DEFAULT nextval('visits_id_seq'),
+            short_url_id integer NOT NULL REFERENCES shortlinks (id),
+            ip_address varchar(255) NOT NULL,
+            user_agent varchar(255) NOT NULL,
+            country varchar(255) NOT NULL,
+            country_name varchar(255) NOT NULL DEFAULT 'Unknown',
+            created_at timestamp NOT NULL,
+            updated_at timestamp NOT NULL,
+            CONSTRAINT visits_legacy_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute("INSERT INTO visits_legacy SELECT id, short_url_id, ip_address, user_agent, country, country_name, created_at, updated_at FROM visits")
+    op.execute("ALTER SEQUENCE visits_id_seq OWNED BY visits_legacy.id")
+    op.execute("DROP TABLE visits CASCADE")
+    op.execute("DROP FUNCTION IF EXISTS visits_ensure_partitions(integer, date)")
+    op.execute("ALTER TABLE visits_legacy RENAME TO visits")
+    op.execute("ALTER TABLE visits RENAME CONSTRAINT visits_legacy_pkey TO visits_pkey")
@@ -0,0 +1,25 @@
+"""Add redirect policy
+
+Revision ID: 769ff0294cd5
+Revises: 856c6e5252af
+Create Date: 2026-10-19 15:21:08.334590
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '769ff0294cd5'
+down_revision = '856c6e5252af'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NULL means the link follows REDIRECT_POLICY
+    op.add_column('shortlinks', sa.Column('redirect_policy', sa.String(length=16), nullable=True))
+
+
+def downgrade():
+    op.drop_column('shortlinks', 'redirect_policy')
@@ -0,0 +1,112 @@
+"""Dictionary-encode visit user agents and IPs
+
+Revision ID: 856c6e5252af
+Revises: 6ceaa96da347
+Create Date: 2026-10-19 14:03:27.912664
+
+"""
+import json
+import os
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '856c6e5252af'
+down_revision = '6ceaa96da347'
+branch_labels = None
+depends_on = None
+
+
+def id_batches(conn):
+    batch_size = int(os.environ.get('VISITS_BACKFILL_BATCH', 50000))
+    low, high = conn.execute(sa.text("SELECT min(id), max(id) FROM visits")).first()
+    if low is None:
+        return
+    for start in range(low, high + 1, batch_size):
+        yield {"start": start, "end": start + batch_size}
+
+
+def country_names():
+    path = os.path.join(os.path.dirname(__file__), '..', '..', 'project', 'names.json')
+    with open(path) as f:
+        names = json.load(f)
+    names["XX"] = "Unknown"
+    return names
+
+
+def upgrade():
+    conn = op.get_bind()
+    op.create_table(
+        'user_agents',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('value', sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('value')
+    )
+    op.create_table(
+        'ip_addresses',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('value', sa.String(length=45), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('value')
+    )
+    op.execute("INSERT INTO user_agents (value) SELECT DISTINCT user_agent FROM visits")
+    # visits.ip_address was varchar(255): longer values (forwarded-for lists, junk) are cut to the new column
+    op.execute("INSERT INTO ip_addresses (value) SELECT DISTINCT substr(ip_address, 1, 45) FROM visits")
+
+    op.add_column('visits', sa.Column('user_agent_id', sa.Integer(), nullable=True))
+    op.add_column('visits', sa.Column('ip_address_id', sa.Integer(), nullable=True))
+    # Id ranges keep every statement's memory bounded on large tables. They all run in the
+    # one transaction env.py runs the upgrade in, so a failure rolls back the whole upgrade,
+    # which can then be run again from the start.
+    for batch in id_batches(conn):
+        conn.execute(sa.text("""
+            UPDATE visits SET
+                user_agent_id = (SELECT id FROM user_agents WHERE value = visits.user_agent),
+                ip_address_id = (SELECT id FROM ip_addresses WHERE value = substr(visits.ip_address, 1, 45)),
+                -- country becomes varchar(2) below; anything longer was never a country code
+                country = CASE WHEN length(country) > 2 THEN 'XX' ELSE country END
+            WHERE id >= :start AND id < :end
+        """), batch)
+
+    with op.batch_alter_table('visits') as batch_op:
+        batch_op.alter_column('user_agent_id', nullable=False)
+        batch_op.alter_column('ip_address_id', nullable=False)
+        # No foreign keys to the lookup tables, see the Visit model
+        batch_op.drop_column('user_agent')
+        batch_op.drop_column('ip_address')
+        batch_op.drop_column('country_name')
+        # On Postgres shortening the type rewrites the table, which also frees the space of the dropped columns
+        batch_op.alter_column('country', type_=sa.String(length=2), existing_nullable=False)
+
+
+def downgrade():
+    conn = op.get_bind()
+    with op.batch_alter_table('visits') as batch_op:
+        batch_op.alter_column('country', type_=sa.String(length=255), existing_nullable=False)
+        batch_op.add_column(sa.Column('user_agent', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('ip_address', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('country_name', sa.String(length=255), nullable=False, server_default='Unknown'))
+
+    for batch in id_batches(conn):
+        conn.execute(sa.text("""
+            UPDATE visits SET
+                user_agent = (SELECT value FROM user_agents WHERE id = visits.user_agent_id),
+                ip_address = (SELECT value FROM ip_addresses WHERE id = visits.ip_address_id)
+            WHERE id >= :start AND id < :end
+        """), batch)
+    # country_name used to be copied from names.json on insert
+    names = country_names()
+    codes = conn.execute(sa.text("SELECT DISTINCT country FROM visits")).scalars()
+    countries = [{"code": code, "name": names.get(code, "Unknown")} for code in codes]
+    if countries:
+        conn.execute(sa.text("UPDATE visits SET country_name = :name WHERE country = :code"), countries)
+
+    with op.batch_alter_table('visits') as batch_op:
+        batch_op.alter_column('user_agent', nullable=False)
+        batch_op.alter_column('ip_address', nullable=False)
+        batch_op.drop_column('user_agent_id')
+        batch_op.drop_column('ip_address_id')
+    op.drop_table('ip_addresses')
+    op.drop_table('user_agents')
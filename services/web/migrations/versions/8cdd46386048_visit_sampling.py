@@ -0,0 +1,46 @@
+"""Per-link visit sample rates and weighted visits
+
+Revision ID: 8cdd46386048
+Revises: 279cfff15b6e
+Create Date: 2026-10-20 09:41:03.774512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8cdd46386048'
+down_revision = '279cfff15b6e'
+branch_labels = None
+depends_on = None
+
+# The redirect snapshot serves the sample rate, so changing it has to reach link_changes too
+OLD_WATCHED = 'short_url, original_url, redirect_policy, max_clicks, expiration_date, expired, deleted'
+NEW_WATCHED = OLD_WATCHED + ', visit_sample_rate'
+
+
+def watch(columns):
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP TRIGGER log_link_change ON shortlinks")
+        op.execute(f"CREATE TRIGGER log_link_change AFTER INSERT OR DELETE OR UPDATE OF {columns} "
+                   "ON shortlinks FOR EACH ROW EXECUTE FUNCTION log_link_change()")
+    else:
+        op.execute("DROP TRIGGER link_change_update")
+        op.execute(f"CREATE TRIGGER link_change_update AFTER UPDATE OF {columns} ON shortlinks BEGIN "
+                   "INSERT INTO link_changes (short_url) VALUES (OLD.short_url); "
+                   "INSERT INTO link_changes (short_url) SELECT NEW.short_url "
+                   "WHERE NEW.short_url IS NOT OLD.short_url; END")
+
+
+def upgrade():
+    op.add_column('shortlinks', sa.Column('visit_sample_rate', sa.Float(), nullable=True))
+    # A constant default: existing rows (and partitions) get it without a table rewrite on Postgres 11+
+    op.add_column('visits', sa.Column('sample_weight', sa.Float(), nullable=False, server_default='1'))
+    watch(NEW_WATCHED)
+
+
+def downgrade():
+    watch(OLD_WATCHED)
+    op.drop_column('visits', 'sample_weight')
+    op.drop_column('shortlinks', 'visit_sample_rate')
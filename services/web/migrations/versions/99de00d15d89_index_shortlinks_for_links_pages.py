@@ -0,0 +1,34 @@
+"""Index shortlinks for the links pages
+
+Revision ID: 99de00d15d89
+Revises: 769ff0294cd5
+Create Date: 2026-10-19 16:40:52.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '99de00d15d89'
+down_revision = '769ff0294cd5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Also used by every redirect, which looked the alias up with a sequential scan until now
+    op.create_index('ix_shortlinks_short_url', 'shortlinks', ['short_url'],
+                    postgresql_ops={'short_url': 'text_pattern_ops'})
+    op.create_index('ix_shortlinks_created_at_id', 'shortlinks', ['created_at', 'id'])
+    op.create_index('ix_shortlinks_deleted_id', 'shortlinks', ['id'],
+                    postgresql_where=sa.text('deleted'), sqlite_where=sa.text('deleted'))
+    op.create_index('ix_shortlinks_expired_id', 'shortlinks', ['id'],
+                    postgresql_where=sa.text('expired'), sqlite_where=sa.text('expired'))
+
+
+def downgrade():
+    op.drop_index('ix_shortlinks_expired_id', table_name='shortlinks')
+    op.drop_index('ix_shortlinks_deleted_id', table_name='shortlinks')
+    op.drop_index('ix_shortlinks_created_at_id', table_name='shortlinks')
+    op.drop_index('ix_shortlinks_short_url', table_name='shortlinks')
@@ -0,0 +1,236 @@
+"""Admission control: a bounded, prioritized number of requests in flight per worker.
+
+Without it, every request a worker thread picks up goes straight for a database connection,
+and under overload they all wait for the pool (up to DB_POOL_TIMEOUT) until everything times
+out together. With ADMISSION=true, at most `limit` requests per worker run at once. The
+rest wait in a priority queue; once a request has waited ADMISSION_QUEUE_TIMEOUT_MS, or the
+queue is full, it is answered 503 with Retry-After straight away. A client (or a load
+balancer) can then go elsewhere or come back, and the requests that were admitted keep their
+normal latency.
+
+The limit adapts (AIMDLimit). Threads above the limit only wait, so the worker needs more
+threads (GUNICORN_THREADS) than the limit is expected to reach.
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.wsgi import ClosingIterator
+
+from .logconfig import parse_mapping
+
+log = logging.getLogger('project.admission')
+
+# Highest priority first; 'exempt' requests bypass admission (static files, long-lived streams)
+CLASSES = ('redirect', 'api', 'bulk')
+EXEMPT = 'exempt'
+
+# Endpoint (or endpoint prefix, as in 'api') -> class; the longest match wins, unmatched paths are 'bulk'
+DEFAULT_CLASSES = {
+    'main.redirect_to_short_url': 'redirect',
+    'static': EXEMPT,
+    # Open as long as a dashboard is; it would hold its slot all that time
+    'main.visits_stream': EXEMPT,
+    'api': 'api',
+    # Whole-table lists
+    'api.get_active_links': 'bulk',
+    'api.get_expired_links': 'bulk',
+    'api.get_deleted_links': 'bulk',
+    # Admin pages and their data
+    'main': 'bulk',
+    'auth': 'bulk',
+}
+
+_WAITING, _ADMITTED, _SHED = range(3)
+
+
+class AIMDLimit:
+    """Concurrency limit from observed latency: additive increase, multiplicative decrease.
+
+    Completions are judged in windows of `limit` requests (at least `min_window`), about one
+    round of the requests in flight. Each completion's latency is compared with the baseline
+    of its class: 2 ms is slow for a redirect, but not for an admin page. A window whose mean
+    ratio exceeds `tolerance` multiplies the limit by `backoff`; a window that was fast and
+    used the whole limit raises it by one. The baselines follow latency down
+    quickly and up slowly, so a lasting change of pace is learned without mistaking a queue
+    building up for it.
+    """
+
+    def __init__(self, initial=8, min_limit=1, max_limit=20, tolerance=2.0, backoff=0.9, min_window=10):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.min_window = min_window
+        self.baselines = {}
+        self._reset_window()
+
+    def _reset_window(self):
+        self._count = 0
+        self._ratios = 0.0
+        self._saturated = False
+
+    def update(self, cls, seconds, inflight):
+        """Record a completion with `inflight` requests running alongside it; returns the new limit."""
+        baseline = self.baselines.get(cls)
+        if baseline is None:
+            baseline = self.baselines[cls] = seconds
+        self.baselines[cls] = baseline + (0.2 if seconds < baseline else 0.01) * (seconds - baseline)
+        self._count += 1
+        self._ratios += seconds / baseline if baseline > 0 else 1.0
+        self._saturated = self._saturated or inflight >= int(self.limit)
+        if self._count < max(self.limit, self.min_window):
+            return self.limit
+        if self._ratios / self._count > self.tolerance:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif self._saturated:
+            self.limit = min(self.max_limit, self.limit + 1)
+        self._reset_window()
+        return self.limit
+
+
+class _Waiter:
+    __slots__ = ('event', 'state')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.state = _WAITING
+
+
+class AdmissionController:
+    """WSGI middleware admitting at most `limit.limit` requests at once, by priority class."""
+
+    def __init__(self, limit, classes=None, queue_timeout=0.5, max_queue=64, retry_after=1):
+        self.limit = limit
+        # Longest prefix first so 'api.get_active_links' beats 'api'
+        self.classes = sorted((classes or DEFAULT_CLASSES).items(), key=lambda item: -len(item[0]))
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.inflight = 0
+        self.queued = 0
+        self.admitted = dict.fromkeys(CLASSES, 0)
+        self.shed = dict.fromkeys(CLASSES, 0)
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self.wsgi_app = None
+        self.url_map = None
+
+    def init_app(self, app):
+        self.wsgi_app = app.wsgi_app
+        self.url_map = app.url_map
+        app.wsgi_app = self
+
+    def classify(self, environ):
+        try:
+            endpoint, _ = self.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return 'bulk'
+        for prefix, cls in self.classes:
+            if endpoint == prefix or endpoint.startswith(prefix + '.'):
+                return cls
+        return 'bulk'
+
+    def __call__(self, environ, start_response):
+        cls = self.classify(environ)
+        if cls == EXEMPT:
+            return self.wsgi_app(environ, start_response)
+        if not self._acquire(CLASSES.index(cls)):
+            with self._lock:
+                self.shed[cls] += 1
+            return self._reject(environ, start_response)
+        started = time.perf_counter()
+        try:
+            app_iter = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._release(cls, started)
+            raise
+        # Released once the body is sent, so a streamed response holds its slot until it ends
+        return ClosingIterator(app_iter, lambda: self._release(cls, started))
+
+    def _acquire(self, priority):
+        with self._lock:
+            if self.inflight < int(self.limit.limit) and not self.queued:
+                self.inflight += 1
+                return True
+            if self.queued >= self.max_queue and not self._displace(priority):
+                return False
+            waiter = _Waiter()
+            heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+            self.queued += 1
+        waiter.event.wait(self.queue_timeout)
+        with self._lock:
+            if waiter.state == _WAITING:
+                # Timed out; the entry stays in the heap and is skipped when it comes up
+                waiter.state = _SHED
+                self.queued -= 1
+                if len(self._waiters) > 2 * self.max_queue:
+                    self._waiters = [entry for entry in self._waiters if entry[2].state == _WAITING]
+                    heapq.heapify(self._waiters)
+            return waiter.state == _ADMITTED
+
+    def _displace(self, priority):
+        """Full queue: shed its lowest-priority, newest waiter if that ranks below `priority`."""
+        waiting = [entry for entry in self._waiters if entry[2].state == _WAITING]
+        if not waiting:
+            return False
+        lowest, _, waiter = max(waiting, key=lambda entry: (entry[0], entry[1]))
+        if lowest <= priority:
+            return False
+        waiter.state = _SHED
+        self.queued -= 1
+        waiter.event.set()
+        return True
+
+    def _release(self, cls, started):
+        seconds = time.perf_counter() - started
+        with self._lock:
+            self.inflight -= 1
+            self.admitted[cls] += 1
+            before = int(self.limit.limit)
+            after = int(self.limit.update(cls, seconds, self.inflight + 1))
+            while self._waiters and self.inflight < after:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if waiter.state != _WAITING:
+                    continue
+                waiter.state = _ADMITTED
+                self.queued -= 1
+                self.inflight += 1
+                waiter.event.set()
+        if after < before:
+            log.info("Admission limit lowered", extra={'limit': after, 'inflight': self.inflight,
+                                                       'queued': self.queued, 'shed': dict(self.shed)})
+
+    def _reject(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith('/api/'):
+            body, content_type = b'{"error": "Server busy, retry shortly"}\n', 'application/json'
+        else:
+            body, content_type = b'Server busy, retry shortly\n', 'text/plain; charset=utf-8'
+        start_response('503 Service Unavailable', [('Content-Type', content_type),
+                                                   ('Content-Length', str(len(body))),
+                                                   ('Retry-After', str(self.retry_after))])
+        return [body]
+
+
+# More than the pool holds would only wait for a connection
+_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 20)) + int(os.environ.get('DB_MAX_OVERFLOW', 0))
+
+admission = AdmissionController(
+    AIMDLimit(
+        initial=int(os.environ.get('ADMISSION_INITIAL_LIMIT', 8)),
+        min_limit=int(os.environ.get('ADMISSION_MIN_LIMIT', 1)),
+        max_limit=int(os.environ.get('ADMISSION_MAX_LIMIT', _POOL_SIZE)),
+        tolerance=float(os.environ.get('ADMISSION_TOLERANCE', 2.0)),
+        backoff=float(os.environ.get('ADMISSION_BACKOFF', 0.9)),
+    ),
+    {**DEFAULT_CLASSES, **parse_mapping(os.environ.get('ADMISSION_CLASSES'), str)},
+    queue_timeout=float(os.environ.get('ADMISSION_QUEUE_TIMEOUT_MS', 500)) / 1000,
+    max_queue=int(os.environ.get('ADMISSION_MAX_QUEUE', 64)),
+    retry_after=int(os.environ.get('ADMISSION_RETRY_AFTER', 1)),
+)
@@ -1,22 +1,21 @@
 import os
 import sqlalchemy.exc
-import redis
 import json
 from urllib.parse import quote
 from datetime import datetime as dt
 from flask import Blueprint, request, jsonify
 
 from .models import db, ShortLink
+from .clients import redis_client
+from .cache_backends import link_cache, forget
+from . import queries
+from .hotlinks import top
+from .redirect_policy import POLICIES
+from .visit_policy import check_rate
+from .canonical import canonicalizer
 
 api = Blueprint('api', __name__)
 
-redis_client = redis.Redis(
-    host=os.environ.get("REDIS_HOST", "redis"),
-    port=int(os.environ.get("REDIS_PORT", 6379)),
-    db=0,
-    decode_responses=True
-)
-
 # Ensure all API routes are authenticated
 @api.before_request
 def before_request():
@@ -40,31 +39,45 @@ def test():
 @api.route('/links/active', methods=['GET'])
 def get_active_links():
     # Get all links where expired is False and deleted is False
-    links = ShortLink.query.filter_by(expired=False, deleted=False).all()
-    return jsonify({'links': [link.to_dict() for link in links]})
+    return jsonify({'links': queries.link_dicts(expired=False, deleted=False)})
 
 
 @api.route('/links/expired', methods=['GET'])
 def get_expired_links():
     # Get all links where expired is True
-    links = ShortLink.query.filter_by(expired=True).all()
-    return jsonify({'links': [link.to_dict() for link in links]})
+    return jsonify({'links': queries.link_dicts(expired=True)})
 
 
 @api.route('/links/deleted', methods=['GET'])
 def get_deleted_links():
     # Get all links where deleted is True
-    links = ShortLink.query.filter_by(deleted=True).all()
-    return jsonify({'links': [link.to_dict() for link in links]})
+    return jsonify({'links': queries.link_dicts(deleted=True)})
+
+
+@api.route('/links/top', methods=['GET'])
+def get_top_links():
+    # Hottest aliases by decayed redirect count
+    limit = min(request.args.get('limit', 10, type=int), 1000)
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+    return jsonify({'links': [{'short_url': alias, 'score': score} for alias, score in top(redis_client, limit)]})
 
 
 @api.route('/links/<int:link_id>', methods=['GET'])
 def get_link(link_id):
     # Get the link
-    link = ShortLink.query.filter_by(id=link_id).first()
+    link = queries.link_dict(link_id)
     if not link:
         return jsonify({'error': 'Link not found'}), 404
-    return jsonify({'link': link.to_dict()})
+    return jsonify({'link': link})
+
+
+@api.route('/links/<int:link_id>/visits', methods=['GET'])
+def get_link_visits(link_id):
+    # Logged rows, plus totals estimated from their sample weights
+    if not queries.link_dict(link_id):
+        return jsonify({'error': 'Link not found'}), 404
+    return jsonify({'visits': queries.visit_totals(link_id)})
 
 
 @api.route('/links', methods=['POST'])
@@ -87,6 +100,13 @@ def create_link():
             expiration_date = dt.fromtimestamp(int(expiration_date))
         except ValueError:
             return jsonify({'error': 'Invalid expiration date. Must be unix timestamp.'}), 400
+    redirect_policy = body.get('redirect_policy', None)  # Global REDIRECT_POLICY by default
+    if redirect_policy not in (None,) + POLICIES:
+        return jsonify({'error': f'Invalid redirect policy. Must be one of: {", ".join(POLICIES)}.'}), 400
+    try:
+        visit_sample_rate = check_rate(body.get('visit_sample_rate', None))  # Global VISIT_SAMPLE_RATE by default
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # Ensure the needed info is present
     if not url or not alias or not created_by:
@@ -98,7 +118,8 @@ def create_link():
 
     # Create the link
     try:
-        link = ShortLink(original_url=url, short_url=alias, max_clicks=max_click_count, expiration_date=expiration_date, created_by=created_by)
+        link = ShortLink(original_url=url, short_url=alias, max_clicks=max_click_count, expiration_date=expiration_date, created_by=created_by,
+                         redirect_policy=redirect_policy, visit_sample_rate=visit_sample_rate)
         db.session.add(link)
         db.session.commit()
     except sqlalchemy.exc.DataError as e:
@@ -131,6 +152,13 @@ def update_link(link_id):
             expiration_date = dt.fromtimestamp(int(expiration_date))
         except ValueError:
             return jsonify({'error': 'Invalid expiration date. Must be unix timestamp.'}), 400
+    redirect_policy = body.get('redirect_policy', link.redirect_policy)
+    if redirect_policy not in (None,) + POLICIES:
+        return jsonify({'error': f'Invalid redirect policy. Must be one of: {", ".join(POLICIES)}.'}), 400
+    try:
+        visit_sample_rate = check_rate(body.get('visit_sample_rate', link.visit_sample_rate))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # Ensure the needed info is present
     if not url or not alias:
@@ -141,12 +169,17 @@ def update_link(link_id):
         return jsonify({'error': 'Alias is taken'}), 400
 
     # Update the link
+    cached = link.canonical_url
     try:
         link.original_url = url
         link.short_url = alias
         link.max_clicks = max_click_count
         link.expiration_date = expiration_date
+        link.redirect_policy = redirect_policy
+        link.visit_sample_rate = visit_sample_rate
         db.session.commit()
+        # The cached alias for the old URL may be gone or limited now
+        forget(cached)
     except sqlalchemy.exc.DataError as e:
         return jsonify({'error': str(e)}), 400
 
@@ -164,6 +197,7 @@ def delete_link(link_id):
     link.deleted = True
     link.expired = True
     db.session.commit()
+    forget(link.canonical_url)
 
     return jsonify({'link': link.to_dict()}), 200
 
@@ -191,8 +225,10 @@ def hard_delete_link(link_id):
         return jsonify({'error': 'Link not found'}), 404
 
     # Delete the link
+    cached = link.canonical_url
     db.session.delete(link)
     db.session.commit()
+    forget(cached)
 
     return jsonify({'message': 'Link deleted'}), 200
 
@@ -204,11 +240,13 @@ def get_link_by_longurl():
         return jsonify({'error': 'Missing original_url'}), 400
 
     original_url = body['original_url']
-    link = ShortLink.query.filter_by(original_url=original_url, deleted=False).first()
-    if not link:
+    if not isinstance(original_url, str):
+        return jsonify({'error': 'original_url must be a string'}), 400
+    short_url = queries.short_url_for(original_url)
+    if not short_url:
         return jsonify({'error': 'Link not found'}), 404
 
-    return jsonify({'short_url': link.short_url, 'cached': False})
+    return jsonify({'short_url': short_url, 'cached': False})
 
 
 @api.route('/links/redis', methods=['POST'])
@@ -218,15 +256,19 @@ def search_link_by_longurl_redis():
         return jsonify({'error': 'Missing original_url'}), 400
 
     original_url = body['original_url']
-    cache_key = f"longurl:{original_url}"
+    if not isinstance(original_url, str):
+        return jsonify({'error': 'original_url must be a string'}), 400
+    # Cached under the canonical form, so every spelling of the URL shares one entry
+    canonical_url = canonicalizer.canonicalize(original_url)
 
-    cached_short = redis_client.get(cache_key)
+    # Whichever CACHE_BACKEND is configured; 'none' (or CACHE_ENABLED=false) always misses
+    cached_short = link_cache.get(canonical_url)
     if cached_short:
         return jsonify({'short_url': cached_short, 'cached': True})
 
-    link = ShortLink.query.filter_by(original_url=original_url, deleted=False).first()
-    if not link:
+    short_url = queries.short_url_for(original_url)
+    if not short_url:
         return jsonify({'error': 'Link not found'}), 404
 
-    redis_client.setex(cache_key, 3600, link.short_url)
-    return jsonify({'short_url': link.short_url, 'cached': False})
\ No newline at end of file
+    link_cache.set(canonical_url, short_url)
+    return jsonify({'short_url': short_url, 'cached': False})
\ No newline at end of file
@@ -36,7 +36,7 @@ def login():
         login_user(user, remember=True)
 
         flash('You are now logged in.', "success")
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     else:
         return render_template('login.html')
 
@@ -46,13 +46,13 @@ def login():
 def logout():
     logout_user()
     flash('You are now logged out.', "success")
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
 @auth.route('/register', methods=['GET', 'POST'])
 def register():
     if os.environ.get("DISABLE_REGISTRATION", "False").lower() in ["true", "1", "t"]:
-        redirect(url_for('index'))
+        redirect(url_for('main.index'))
     if request.method == 'POST':
         # Get form data
         username = request.form.get('username', None)
@@ -0,0 +1,295 @@
+import mmap
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import sqlalchemy.exc
+from sqlalchemy import select, insert, delete, or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .cache_codec import LinkCache, TTL, SWEEP_EVERY, address, encode, decode, expired, url_digest
+from .clients import cache_client
+from .models import db, CachedLink
+
+# Every backend maps original_url -> short_url with the same methods as cache_codec.LinkCache:
+# get(url), set(url, short_url, ttl=None), set_many(items, ttl=None) and delete(url), where
+# ttl=None is the backend's default (CACHE_TTL) and 0 keeps the entry until it is replaced.
+
+
+class NullCache:
+    """No cache: every read is a miss, so each request goes to the database."""
+
+    name = 'none'
+
+    def get(self, url):
+        return None
+
+    def set(self, url, short_url, ttl=None):
+        pass
+
+    def set_many(self, items, ttl=None):
+        pass
+
+    def delete(self, url):
+        pass
+
+
+class LruCache:
+    """In-process LRU of at most `max_entries` links.
+
+    No network hop at all, but every worker process has its own copy: each one warms up
+    separately and the hit ratio drops as workers are added.
+    """
+
+    name = 'lru'
+
+    def __init__(self, max_entries, ttl=TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # url -> (short_url, expires at or 0)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            if entry[1] and entry[1] <= time.time():
+                del self._entries[url]
+                return None
+            self._entries.move_to_end(url)
+            return entry[0]
+
+    def set(self, url, short_url, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        entry = (short_url, time.time() + ttl if ttl else 0)
+        with self._lock:
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_many(self, items, ttl=None):
+        for url, short_url in items:
+            self.set(url, short_url, ttl)
+
+    def delete(self, url):
+        with self._lock:
+            self._entries.pop(url, None)
+
+
+# crc32 of the rest of the slot, field, record length; the record (cache_codec.encode) follows
+SLOT_HEADER = struct.Struct('>I6sB')
+SLOT_SIZE = 64
+MAX_RECORD = SLOT_SIZE - SLOT_HEADER.size
+WAYS = 4
+
+
+class SharedMemoryCache:
+    """Fixed-size hash table in a memory-mapped file that every worker on the host maps.
+
+    Slots of SLOT_SIZE bytes hold the same records as the Redis layout; a URL can live in any
+    of the WAYS slots of its set, and a full set evicts a slot picked by the URL's fingerprint.
+    There are no locks: every slot carries a CRC32 of its contents, so a slot torn by two
+    writers (or read while being written) fails the check and reads as a miss. Aliases longer
+    than MAX_RECORD allows are not cached. Put the file on tmpfs (/dev/shm) so it never hits disk.
+    """
+
+    name = 'shm'
+
+    def __init__(self, path, slots, ttl=TTL):
+        self.path = path
+        self.sets = max(1, slots // WAYS)
+        self.ttl = ttl
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _slots(self):
+        # Mapped on first use; a mapping inherited over fork() is still the same shared memory
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    size = self.sets * WAYS * SLOT_SIZE
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                    try:
+                        # Only ever grown: shrinking it under another worker's mapping would crash that worker
+                        if os.fstat(fd).st_size < size:
+                            os.ftruncate(fd, size)
+                        self._map = mmap.mmap(fd, size)
+                    finally:
+                        os.close(fd)
+        return self._map
+
+    def _find(self, url):
+        """(slots, offset of the URL's set, field, fingerprint)"""
+        bucket, field, fingerprint = address(url, self.sets)
+        return self._slots(), bucket * WAYS * SLOT_SIZE, field, fingerprint
+
+    @staticmethod
+    def _read(slot):
+        """(field, record) of a slot, or None if it is empty or torn."""
+        crc, field, length = SLOT_HEADER.unpack_from(slot)
+        if length > MAX_RECORD or crc != zlib.crc32(slot[4:]):
+            return None
+        return field, slot[SLOT_HEADER.size:SLOT_HEADER.size + length]
+
+    def get(self, url):
+        slots, offset, field, fingerprint = self._find(url)
+        chunk = slots[offset:offset + WAYS * SLOT_SIZE]
+        for way in range(WAYS):
+            slot = chunk[way * SLOT_SIZE:(way + 1) * SLOT_SIZE]
+            if slot[4:10] == field:
+                entry = self._read(slot)
+                if entry is not None:
+                    return decode(entry[1], fingerprint)
+        return None
+
+    def set(self, url, short_url, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        slots, offset, field, fingerprint = self._find(url)
+        record = encode(short_url, fingerprint, int(time.time()) + ttl if ttl else 0)
+        if len(record) > MAX_RECORD:
+            return
+        body = SLOT_HEADER.pack(0, field, len(record))[4:] + record
+        body += bytes(SLOT_SIZE - 4 - len(body))
+        start = offset + self._way(slots, offset, field, fingerprint) * SLOT_SIZE
+        slots[start:start + SLOT_SIZE] = struct.pack('>I', zlib.crc32(body)) + body
+
+    def _way(self, slots, offset, field, fingerprint):
+        """The slot to write: the URL's own, else an empty or expired one, else the fingerprint's pick."""
+        chunk = slots[offset:offset + WAYS * SLOT_SIZE]
+        now = time.time()
+        free = None
+        for way in range(WAYS):
+            entry = self._read(chunk[way * SLOT_SIZE:(way + 1) * SLOT_SIZE])
+            if entry is not None and entry[0] == field:
+                return way
+            if free is None and (entry is None or expired(entry[1], now)):
+                free = way
+        return free if free is not None else fingerprint[0] % WAYS
+
+    def set_many(self, items, ttl=None):
+        for url, short_url in items:
+            self.set(url, short_url, ttl)
+
+    def delete(self, url):
+        slots, offset, field, _ = self._find(url)
+        for way in range(WAYS):
+            start = offset + way * SLOT_SIZE
+            if slots[start + 4:start + 10] == field:
+                slots[start:start + SLOT_SIZE] = bytes(SLOT_SIZE)
+
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE; others replace the rows
+_UPSERT = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+cached_links = CachedLink.__table__
+
+
+class PostgresCache:
+    """The link_cache table (UNLOGGED on Postgres), keyed by the URL's 16-byte digest.
+
+    A hit is one primary-key lookup in the database the app already talks to, which is
+    what this backend measures against a separate cache server. Expired rows are skipped on
+    read and deleted in small batches by one write in SWEEP_EVERY. Every call uses a
+    connection of its own, so it never flushes or commits the request's session.
+    """
+
+    name = 'postgres'
+
+    def __init__(self, ttl=TTL, sweep_batch=1000):
+        self.ttl = ttl
+        self.sweep_batch = sweep_batch
+
+    def get(self, url):
+        with db.engine.connect() as conn:
+            return conn.execute(
+                select(cached_links.c.short_url)
+                .where(cached_links.c.key == url_digest(url),
+                       or_(cached_links.c.expires_at == 0, cached_links.c.expires_at > int(time.time())))
+            ).scalar()
+
+    def set(self, url, short_url, ttl=None):
+        self.set_many([(url, short_url)], ttl)
+        if random.randrange(SWEEP_EVERY) == 0:
+            self.sweep()
+
+    def set_many(self, items, ttl=None, batch=1000):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = int(time.time()) + ttl if ttl else 0
+        rows = [{'key': url_digest(url), 'short_url': short_url, 'expires_at': expires_at} for url, short_url in items]
+        for start in range(0, len(rows), batch):
+            chunk = rows[start:start + batch]
+            try:
+                with db.engine.begin() as conn:
+                    upsert = _UPSERT.get(conn.dialect.name)
+                    if upsert is not None:
+                        stmt = upsert(cached_links)
+                        conn.execute(stmt.on_conflict_do_update(
+                            index_elements=['key'],
+                            set_={'short_url': stmt.excluded.short_url, 'expires_at': stmt.excluded.expires_at},
+                        ), chunk)
+                    else:
+                        # No upsert in this dialect: replace the rows
+                        conn.execute(delete(cached_links).where(cached_links.c.key.in_([row['key'] for row in chunk])))
+                        conn.execute(insert(cached_links), chunk)
+            except sqlalchemy.exc.IntegrityError:
+                # Replacing raced another worker caching the same URLs; the entries are there either way
+                continue
+
+    def delete(self, url):
+        with db.engine.begin() as conn:
+            conn.execute(delete(cached_links).where(cached_links.c.key == url_digest(url)))
+
+    def sweep(self):
+        expired = (
+            select(cached_links.c.key)
+            .where(cached_links.c.expires_at > 0, cached_links.c.expires_at <= int(time.time()))
+            .limit(self.sweep_batch)
+        )
+        with db.engine.begin() as conn:
+            return conn.execute(delete(cached_links).where(cached_links.c.key.in_(expired))).rowcount
+
+
+def _default_shm_path():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'shortener-link-cache')
+
+
+BACKENDS = {
+    'redis': lambda: LinkCache(cache_client),
+    'lru': lambda: LruCache(int(os.environ.get('CACHE_LRU_SIZE', 100000))),
+    'shm': lambda: SharedMemoryCache(os.environ.get('CACHE_SHM_PATH') or _default_shm_path(),
+                                     int(os.environ.get('CACHE_SHM_SLOTS', 262144))),
+    'postgres': lambda: PostgresCache(),
+    'none': lambda: NullCache(),
+}
+
+
+def create_link_cache(backend=None):
+    """The link cache named by CACHE_BACKEND (redis by default); CACHE_ENABLED=false means 'none'."""
+    if os.environ.get("CACHE_ENABLED", "True").lower() not in ["true", "1", "t"]:
+        backend = 'none'
+    backend = backend or os.environ.get('CACHE_BACKEND', 'redis')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown CACHE_BACKEND {backend!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[backend]()
+
+
+# Created at import; none of the backends connects or maps anything before its first use
+link_cache = create_link_cache()
+
+
+def forget(*canonical_urls):
+    """Drop the cache entries of links that were edited or deleted; entries don't expire while pinned."""
+    for canonical_url in canonical_urls:
+        if canonical_url:
+            link_cache.delete(canonical_url)
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import random
+import struct
+import time
+
+# version, expires at (unix seconds, 0 = never), fingerprint; the alias follows as UTF-8
+RECORD = struct.Struct('>BI4s')
+VERSION = 1
+
+# Enough buckets to keep each under Redis' small-hash limit (hash-max-listpack-entries, 128)
+# up to about 10M cached links
+BUCKETS = int(os.environ.get('CACHE_BUCKETS', 131072))
+TTL = int(os.environ.get('CACHE_TTL', 3600))
+# One write in SWEEP_EVERY also drops the expired entries of its bucket
+SWEEP_EVERY = 64
+
+
+def url_digest(url):
+    return hashlib.blake2b(url.encode(), digest_size=16).digest()
+
+
+def address(url, buckets=BUCKETS):
+    """(bucket number, field, fingerprint) of a URL, all cut from one 128-bit blake2b digest.
+
+    The bucket and the 6-byte field address the entry; the 4-byte fingerprint stored in the
+    record is checked on read, so a different URL with the same bucket and field (about one in
+    2**48 per entry of the bucket) is a miss rather than a wrong alias.
+    """
+    digest = url_digest(url)
+    return int.from_bytes(digest[:4], 'big') % buckets, digest[4:10], digest[10:14]
+
+
+def locate(url, buckets=BUCKETS, prefix='lc:'):
+    """(bucket key, field, fingerprint) of a URL in the Redis layout."""
+    bucket, field, fingerprint = address(url, buckets)
+    return f"{prefix}{bucket}", field, fingerprint
+
+
+def encode(short_url, fingerprint, expires_at=0):
+    return RECORD.pack(VERSION, expires_at, fingerprint) + short_url.encode()
+
+
+def expired(record, now):
+    """Whether a record's expiry time has passed; records that never expire (0) never have."""
+    return len(record) >= RECORD.size and 0 < RECORD.unpack_from(record)[1] <= now
+
+
+def decode(record, fingerprint, now=None):
+    """The alias in `record`, or None if it belongs to another URL, has expired or is an unknown version."""
+    if record is None or len(record) < RECORD.size:
+        return None
+    version, expires_at, stored = RECORD.unpack_from(record)
+    if version != VERSION or stored != fingerprint:
+        return None
+    if expires_at and expires_at <= (now or time.time()):
+        return None
+    return record[RECORD.size:].decode()
+
+
+class LinkCache:
+    """original_url -> short_url, stored as binary records in bucketed Redis hashes.
+
+    Each bucket is a small hash that Redis keeps in its compact listpack/ziplist encoding, so
+    a link costs a few dozen bytes instead of a key holding the whole URL. Hash fields have
+    no TTL of their own (before Redis 7.4), so the expiry is part of the record and checked on
+    read; expired entries are removed by an occasional sweep of the bucket being written.
+    The client must return bytes (decode_responses=False).
+    """
+
+    name = 'redis'
+
+    def __init__(self, client, buckets=BUCKETS, ttl=TTL, prefix='lc:'):
+        self.client = client
+        self.buckets = buckets
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def locate(self, url):
+        return locate(url, self.buckets, self.prefix)
+
+    def get(self, url):
+        key, field, fingerprint = self.locate(url)
+        return decode(self.client.hget(key, field), fingerprint)
+
+    def set(self, url, short_url, ttl=None, pipe=None):
+        """Cache a link for `ttl` seconds (default self.ttl, 0 = until replaced), optionally on a pipeline."""
+        key, field, fingerprint = self.locate(url)
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = int(time.time()) + ttl if ttl else 0
+        (pipe or self.client).hset(key, field, encode(short_url, fingerprint, expires_at))
+        if pipe is None and random.randrange(SWEEP_EVERY) == 0:
+            self.sweep(key)
+
+    def set_many(self, items, ttl=None, batch=1000):
+        """Cache (url, short_url) pairs with one pipelined round trip per `batch` (per shard when sharded)."""
+        pipe = self.client.pipeline(transaction=False)
+        for url, short_url in items:
+            self.set(url, short_url, ttl, pipe=pipe)
+            if len(pipe) >= batch:
+                pipe.execute()
+        pipe.execute()
+
+    def delete(self, url, pipe=None):
+        key, field, _ = self.locate(url)
+        (pipe or self.client).hdel(key, field)
+
+    def sweep(self, key):
+        now = time.time()
+        stale = [field for field, record in self.client.hgetall(key).items() if expired(record, now)]
+        if stale:
+            self.client.hdel(key, *stale)
+        return len(stale)
@@ -0,0 +1,136 @@
+import fnmatch
+import os
+import re
+import string
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, quote
+
+from sqlalchemy import text
+
+from .online_migrations import walk_keys
+
+# Click identifiers and campaign tags: they say where a visitor came from, not where they go.
+# Shell-style patterns, matched case-insensitively against the parameter name
+DEFAULT_IGNORE_PARAMS = 'utm_*,fbclid,gclid,dclid,gbraid,wbraid,msclkid,yclid,igshid,mc_cid,mc_eid,_ga,_gl'
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+UNRESERVED = frozenset(string.ascii_letters + string.digits + '-._~')
+# Reserved characters and escapes stay as they are; anything else (spaces, non-ASCII) is escaped
+_SAFE = "%:/?#[]@!$&'()*+,;=~"
+_ESCAPE = re.compile(r'%[0-9A-Fa-f]{2}')
+
+
+def _normalize_escapes(value):
+    """Escape what must be, then %7e -> ~ for unreserved characters and %2f -> %2F for the rest (RFC 3986 6.2.2)."""
+    def fix(match):
+        char = chr(int(match.group(0)[1:], 16))
+        return char if char in UNRESERVED else match.group(0).upper()
+    return _ESCAPE.sub(fix, quote(value, safe=_SAFE))
+
+
+def _remove_dot_segments(path):
+    segments = []
+    for segment in path.split('/'):
+        if segment == '..':
+            if len(segments) > 1:
+                segments.pop()
+        elif segment != '.':
+            segments.append(segment)
+    if path.endswith(('/.', '/..')):
+        segments.append('')
+    return '/'.join(segments)
+
+
+class Canonicalizer:
+    """One spelling for URLs that only differ in ways that don't change where they lead.
+
+    For http(s) URLs: scheme and host are lowercased, the host's trailing dot and the
+    default port are dropped, internationalized hosts become punycode, percent-escapes are
+    normalized, '.' and '..' path segments are resolved and (with `strip_trailing_slash`) a
+    trailing slash is removed. Query parameters matching `ignore_params` are dropped and the
+    rest are sorted by name (repeated names keep their order). The fragment is kept. Other
+    schemes only get a lowercase scheme. URLs that don't parse come back stripped of
+    surrounding whitespace only.
+
+    The canonical form is only used to match links (shortlinks.canonical_url and the link
+    cache keys); redirects still go to the URL as it was given.
+    """
+
+    def __init__(self, ignore_params=DEFAULT_IGNORE_PARAMS, strip_trailing_slash=True, cache_size=10000):
+        patterns = [p.strip() for p in (ignore_params or '').split(',') if p.strip()]
+        self._ignored = re.compile('|'.join(fnmatch.translate(p) for p in patterns), re.IGNORECASE) if patterns else None
+        self.strip_trailing_slash = strip_trailing_slash
+        # Lookups repeat the same few URLs, so each one is parsed once
+        self.canonicalize = lru_cache(maxsize=cache_size)(self._canonicalize)
+
+    def ignored(self, name):
+        return self._ignored is not None and self._ignored.match(name) is not None
+
+    def _canonicalize(self, url):
+        url = url.strip()
+        try:
+            parts = urlsplit(url)
+            port = parts.port
+        except ValueError:
+            return url
+        scheme = parts.scheme.lower()
+        if scheme not in DEFAULT_PORTS:
+            return urlunsplit((scheme,) + tuple(parts[1:])) if scheme else url
+
+        host = (parts.hostname or '').rstrip('.')
+        try:
+            host = host.encode('idna').decode('ascii')
+        except UnicodeError:
+            pass
+        if ':' in host:
+            host = f'[{host}]'
+        userinfo = parts.netloc.rpartition('@')[0]
+        netloc = f'{userinfo}@{host}' if userinfo else host
+        if port is not None and port != DEFAULT_PORTS[scheme]:
+            netloc = f'{netloc}:{port}'
+
+        path = _remove_dot_segments(_normalize_escapes(parts.path)) or '/'
+        if self.strip_trailing_slash and len(path) > 1:
+            path = path.rstrip('/') or '/'
+
+        params = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                  if not self.ignored(name)]
+        params.sort(key=lambda param: param[0])
+        query = urlencode(params, quote_via=quote)
+        return urlunsplit((scheme, netloc, path, query, _normalize_escapes(parts.fragment)))
+
+
+def backfill_canonical_urls(conn, canonicalizer, only_missing=True, batch_size=1000, duty_cycle=0.5, progress=print):
+    """Set shortlinks.canonical_url from original_url in throttled, resumable batches; needs an autocommit connection.
+
+    With only_missing=False every row is recomputed and the ones that changed are written,
+    which is what a new CANONICAL_IGNORE_PARAMS needs. Returns the number of rows updated.
+    """
+    missing = " AND canonical_url IS NULL" if only_missing else ""
+    rows = text(f"SELECT id, original_url, canonical_url FROM shortlinks WHERE id > :low AND id <= :high{missing}")
+    postgres = conn.dialect.name == 'postgresql'
+    if postgres:
+        # One statement per batch; an executemany would be a round trip per row
+        update = text("UPDATE shortlinks SET canonical_url = v.canonical "
+                      "FROM unnest(CAST(:ids AS integer[]), CAST(:canonicals AS text[])) AS v(id, canonical) "
+                      "WHERE shortlinks.id = v.id")
+    else:
+        update = text("UPDATE shortlinks SET canonical_url = :canonical WHERE id = :id")
+
+    def batch(low, high):
+        # Not through the lookup cache: a full walk would only evict the hot URLs from it
+        changed = [(row.id, canonical) for row in conn.execute(rows, {'low': low, 'high': high})
+                   if (canonical := canonicalizer._canonicalize(row.original_url)) != row.canonical_url]
+        if changed and postgres:
+            ids, canonicals = zip(*changed)
+            conn.execute(update, {'ids': list(ids), 'canonicals': list(canonicals)})
+        elif changed:
+            conn.execute(update, [{'id': id, 'canonical': canonical} for id, canonical in changed])
+        return len(changed)
+
+    return walk_keys(conn, 'shortlinks_canonical_url', 'shortlinks', batch, batch_size, duty_cycle, progress=progress)
+
+
+canonicalizer = Canonicalizer(
+    os.environ.get('CANONICAL_IGNORE_PARAMS', DEFAULT_IGNORE_PARAMS),
+    os.environ.get('CANONICAL_STRIP_TRAILING_SLASH', 'True').lower() in ['true', '1', 't'],
+)
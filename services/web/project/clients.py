@@ -0,0 +1,83 @@
+import os
+import threading
+
+from .models import db
+from .sharding import ShardedRedis
+from .tracing import redis_class
+
+_redis = None
+_cache = None
+_lock = threading.Lock()
+
+
+def get_redis():
+    """The process-wide Redis client, created on first use.
+
+    Creating it never connects; connections are opened by the pool when a command runs.
+    """
+    global _redis
+    if _redis is None:
+        with _lock:
+            if _redis is None:
+                _redis = redis_class()(
+                    host=os.environ.get("REDIS_HOST", "redis"),
+                    port=int(os.environ.get("REDIS_PORT", 6379)),
+                    db=0,
+                    decode_responses=True
+                )
+    return _redis
+
+
+def get_cache():
+    """The client for the link cache (see cache_codec.py), created on first use.
+
+    It returns bytes, as the cache records are binary. REDIS_NODES ("host:port,host:port,...")
+    spreads the cache over several Redis nodes with consistent hashing (REDIS_VNODES points
+    per node); otherwise it lives on REDIS_HOST with everything else.
+    """
+    global _cache
+    if _cache is None:
+        nodes = [node.strip() for node in os.environ.get("REDIS_NODES", "").split(",") if node.strip()]
+        with _lock:
+            if _cache is None and nodes:
+                _cache = ShardedRedis.from_nodes(nodes, int(os.environ.get("REDIS_VNODES", 160)), redis_class())
+            elif _cache is None:
+                _cache = redis_class()(
+                    host=os.environ.get("REDIS_HOST", "redis"),
+                    port=int(os.environ.get("REDIS_PORT", 6379)),
+                    db=0
+                )
+    return _cache
+
+
+class LazyRedis:
+    """Stands in for a Redis client in code set up at import time (blueprints, extensions)."""
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+# Counters, the hot links ranking and locks; one key each, so they stay on a single node
+redis_client = LazyRedis(get_redis)
+cache_client = LazyRedis(get_cache)
+
+
+def reset_after_fork(app):
+    """Drop the DB and Redis connections a worker inherited from the process that forked it.
+
+    Sockets opened before the fork are shared with the parent and every sibling; using them
+    from two processes interleaves their protocol streams. The inherited connections are
+    forgotten, not closed, so the parent's are left alone.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    if _redis is not None:
+        _redis.connection_pool.reset()
+    if _cache is not None:
+        shards = _cache.clients.values() if isinstance(_cache, ShardedRedis) else [_cache]
+        for client in shards:
+            client.connection_pool.reset()
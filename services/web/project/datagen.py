@@ -0,0 +1,218 @@
+import csv
+import io
+import random
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import ShortLink, Visit, UserAgent, IpAddress, country_names
+from .canonical import canonicalizer
+from .partitions import is_partitioned, ensure_partitions
+
+LINK_COLUMNS = ('original_url', 'canonical_url', 'short_url', 'expired', 'expiration_date', 'max_clicks', 'current_clicks',
+                'deleted', 'created_by', 'created_at', 'updated_at')
+VISIT_COLUMNS = ('short_url_id', 'ip_address_id', 'user_agent_id', 'country', 'created_at')
+
+# Dialects with INSERT ... ON CONFLICT DO NOTHING, used to load the lookup tables
+_UPSERT = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+# Share of visits per hour of day (UTC): quiet nights, busy afternoons
+DIURNAL = (0.25, 0.2, 0.15, 0.15, 0.2, 0.3, 0.45, 0.6, 0.75, 0.85, 0.9, 0.95,
+           1.0, 1.0, 0.95, 0.95, 0.9, 0.9, 0.85, 0.8, 0.7, 0.55, 0.45, 0.35)
+
+TOP_COUNTRIES = ('US', 'IN', 'GB', 'DE', 'BR', 'FR', 'CA', 'JP', 'ID', 'NG', 'ES', 'IT', 'MX', 'NL', 'PL')
+
+# (template, version range); the version makes each template a family of distinct strings
+USER_AGENT_TEMPLATES = (
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.{b}.0 Safari/537.36", (100, 131)),
+    ("Mozilla/5.0 (iPhone; CPU iPhone OS {v}_{b} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{v}.0 Mobile/15E148 Safari/604.1", (15, 18)),
+    ("Mozilla/5.0 (Linux; Android {v}; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.{b}.0 Mobile Safari/537.36", (10, 15)),
+    ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{v}.{b} Safari/605.1.15", (15, 18)),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:{v}.0) Gecko/20100101 Firefox/{v}.{b}", (110, 133)),
+    ("Mozilla/5.0 (compatible; Googlebot/2.{b}; +http://www.google.com/bot.html) v{v}", (1, 3)),
+    ("curl/{v}.{b}.0", (7, 9)),
+)
+
+
+def zipf_cum_weights(n, s):
+    """Cumulative Zipf(s) weights over ranks 0..n-1, for random.choices(cum_weights=...)."""
+    return array('d', accumulate(1 / (rank + 1) ** s for rank in range(n)))
+
+
+def rank_stride(n):
+    """Same spreading of popular ranks over the ids as the k6 workload (pickStride)."""
+    stride = int(n * 0.618) or 1
+    while _gcd(stride, n) != 1:
+        stride += 1
+    return stride
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def write_chunk(conn, table, columns, rows):
+    """Append rows (tuples in `columns` order): COPY on Postgres, a multi-row INSERT elsewhere."""
+    if conn.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = conn.connection.cursor()
+        cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    else:
+        conn.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+
+
+def link_rows(count, rng, end, days, owner):
+    """t{i} -> https://example.com/{i}, the aliases the k6 scenarios and seed_redis.py expect."""
+    span = days * 86400
+    for i in range(count):
+        created_at = end - timedelta(seconds=rng.random() * span)
+        url = f"https://example.com/{i}"
+        yield (url, canonicalizer.canonicalize(url), f"t{i}", False, end + timedelta(days=rng.randint(1, 365)),
+               100, rng.randint(0, 50), False, owner, created_at, created_at)
+
+
+def generate_links(engine, count, seed=0, days=90, owner=1, chunk_size=10000, end=None, progress=None):
+    rng = random.Random(f"{seed}:links")
+    end = end or datetime.now()
+    table = ShortLink.__table__
+    written = 0
+    for chunk in chunked(link_rows(count, rng, end, days, owner), chunk_size):
+        with engine.begin() as conn:
+            write_chunk(conn, table, LINK_COLUMNS, chunk)
+        written += len(chunk)
+        if progress:
+            progress('links', written, count)
+    return written
+
+
+def user_agent_pool(size, rng):
+    pool = []
+    seen = set()
+    while len(pool) < size:
+        template, (low, high) = rng.choice(USER_AGENT_TEMPLATES)
+        value = template.format(v=rng.randint(low, high), b=rng.randint(0, 9999))
+        if value not in seen:
+            seen.add(value)
+            pool.append(value)
+    return pool
+
+
+def ip_pool(size, rng, ipv6_share=0.1):
+    pool = []
+    seen = set()
+    while len(pool) < size:
+        if rng.random() < ipv6_share:
+            value = "2001:db8:" + ":".join(f"{rng.getrandbits(16):x}" for _ in range(6))
+        else:
+            value = ".".join(str(rng.randint(1, 254)) for _ in range(4))
+        if value not in seen:
+            seen.add(value)
+            pool.append(value)
+    return pool
+
+
+def dimension_ids(engine, table, values, chunk_size=5000):
+    """{value: id} for `values`, inserting the ones the lookup table doesn't have yet."""
+    ids = {}
+    for chunk in chunked(values, chunk_size):
+        with engine.begin() as conn:
+            upsert = _UPSERT.get(conn.dialect.name)
+            if upsert is not None:
+                conn.execute(upsert(table).values([{'value': v} for v in chunk]).on_conflict_do_nothing(index_elements=['value']))
+            rows = conn.execute(select(table.c.value, table.c.id).where(table.c.value.in_(chunk))).all()
+            ids.update(rows)
+            missing = [v for v in chunk if v not in ids]
+            if missing:
+                conn.execute(table.insert(), [{'value': v} for v in missing])
+                ids.update(conn.execute(select(table.c.value, table.c.id).where(table.c.value.in_(missing))).all())
+    return ids
+
+
+def visit_times(count, rng, end, days, chunk_size):
+    """Visit timestamps in increasing order, so ids follow created_at as they do in production.
+
+    The window is cut into one slice per chunk; each slice is filled uniformly, thinned by the
+    hour-of-day profile, and sorted. Only one chunk of timestamps is held at a time.
+    """
+    start = end - timedelta(days=days)
+    span = days * 86400
+    slices = max(1, -(-count // chunk_size))
+    for index in range(slices):
+        size = min(chunk_size, count - index * chunk_size)
+        low = span * index / slices
+        width = span / slices
+        times = []
+        while len(times) < size:
+            at = start + timedelta(seconds=low + rng.random() * width)
+            if rng.random() < DIURNAL[at.hour]:
+                times.append(at)
+        times.sort()
+        yield times
+
+
+def generate_visits(engine, count, links, seed=0, days=90, zipf_s=1.1, user_agents=2000, ips=100000,
+                    chunk_size=10000, end=None, progress=None):
+    """Append `count` visits to the t0..t{links-1} links.
+
+    Links are picked by Zipf(zipf_s) popularity, spread over the aliases like the k6 workload
+    does; user agents and countries are skewed too, IPs are drawn uniformly from a fixed pool.
+    Memory is bounded by the chunk, the pools and one float per link.
+    """
+    rng = random.Random(f"{seed}:visits")
+    end = end or datetime.now()
+    if is_partitioned(engine):
+        ensure_partitions(engine, first_month=(end - timedelta(days=days)).date())
+
+    # Pool values already in the lookup tables keep their ids
+    agent_values = user_agent_pool(user_agents, rng)
+    agent_ids = dimension_ids(engine, UserAgent.__table__, agent_values)
+    agent_pool = [agent_ids[v] for v in agent_values]
+    agent_weights = zipf_cum_weights(len(agent_pool), 1.2)
+    ip_values = ip_pool(ips, rng)
+    ip_ids = dimension_ids(engine, IpAddress.__table__, ip_values)
+    ip_pool_ids = [ip_ids[v] for v in ip_values]
+    # The usual head of web traffic first, then the remaining countries in a seeded order
+    countries = sorted(code for code in country_names() if code not in TOP_COUNTRIES and code != "XX")
+    rng.shuffle(countries)
+    countries = [code for code in TOP_COUNTRIES if code in country_names()] + countries
+    # A few unresolvable visitors, like requests without CF-IPCountry
+    countries.append("XX")
+    country_weights = zipf_cum_weights(len(countries), 1.0)
+
+    link_weights = zipf_cum_weights(links, zipf_s)
+    stride = rank_stride(links)
+    ranks = range(links)
+    shortlinks = ShortLink.__table__
+    written = 0
+    for times in visit_times(count, rng, end, days, chunk_size):
+        aliases = [f"t{(rank * stride) % links}" for rank in rng.choices(ranks, cum_weights=link_weights, k=len(times))]
+        agents = rng.choices(agent_pool, cum_weights=agent_weights, k=len(times))
+        visitor_countries = rng.choices(countries, cum_weights=country_weights, k=len(times))
+        with engine.begin() as conn:
+            link_ids = dict(conn.execute(
+                select(shortlinks.c.short_url, shortlinks.c.id).where(shortlinks.c.short_url.in_(set(aliases)))
+            ).all())
+            rows = [(link_ids[alias], rng.choice(ip_pool_ids), agent, country, at)
+                    for alias, agent, country, at in zip(aliases, agents, visitor_countries, times)
+                    if alias in link_ids]
+            write_chunk(conn, Visit.__table__, VISIT_COLUMNS, rows)
+        written += len(rows)
+        if progress:
+            progress('visits', written, count)
+    return written
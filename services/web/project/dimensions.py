@@ -0,0 +1,84 @@
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import db, UserAgent, IpAddress
+
+# Dialects with INSERT ... ON CONFLICT DO NOTHING RETURNING
+_UPSERT = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+class Dimension:
+    """Maps a value to the id of its row in a lookup table, e.g. a user agent string to user_agents.id.
+
+    Ids are cached per process, so a visit insert normally needs no extra round trip. A miss
+    upserts the value on its own connection and commits right away: a cached id then always
+    points at a committed row, even if the visit that needed it is rolled back. The redirect
+    statement upserts missing values itself and hands their ids back through remember().
+    """
+
+    def __init__(self, table, cache_size):
+        self.table = table
+        self.cache_size = cache_size
+        self.max_length = table.c.value.type.length
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def fits(self, value):
+        """False for values the column can't store (None, or longer than the column)."""
+        return value is not None and (self.max_length is None or len(value) <= self.max_length)
+
+    def cached(self, value):
+        """The value's id if this process knows it, without a query."""
+        with self._lock:
+            row_id = self._ids.get(value)
+            if row_id is not None:
+                self._ids.move_to_end(value)
+            return row_id
+
+    def remember(self, value, row_id):
+        """Cache an id learned elsewhere, e.g. from a statement that upserted the value itself."""
+        with self._lock:
+            self._ids[value] = row_id
+            self._ids.move_to_end(value)
+            if len(self._ids) > self.cache_size:
+                self._ids.popitem(last=False)
+
+    def id_for(self, value):
+        row_id = self.cached(value)
+        if row_id is None:
+            row_id = self._lookup(value)
+            self.remember(value, row_id)
+        return row_id
+
+    def _lookup(self, value):
+        table = self.table
+        with db.engine.begin() as conn:
+            upsert = _UPSERT.get(conn.dialect.name)
+            if upsert is not None:
+                stmt = upsert(table).values(value=value).on_conflict_do_nothing(index_elements=['value'])
+                row_id = conn.execute(stmt.returning(table.c.id)).scalar()
+                if row_id is not None:
+                    return row_id
+            # Already there (possibly inserted by another worker a moment ago)
+            row_id = conn.execute(select(table.c.id).where(table.c.value == value)).scalar()
+            if row_id is None:
+                row_id = conn.execute(table.insert().values(value=value)).inserted_primary_key[0]
+            return row_id
+
+
+def storable(visit):
+    """The visit (ip, user agent, country), or None if its user agent or IP can't be stored (missing or too long for the column)."""
+    if visit is None or not ip_addresses.fits(visit[0]) or not user_agents.fits(visit[1]):
+        return None
+    return visit
+
+
+user_agents = Dimension(UserAgent.__table__, int(os.environ.get('USER_AGENT_CACHE_SIZE', 10000)))
+ip_addresses = Dimension(IpAddress.__table__, int(os.environ.get('IP_ADDRESS_CACHE_SIZE', 100000)))
@@ -0,0 +1,188 @@
+import heapq
+import os
+import threading
+import time
+from operator import itemgetter
+
+from sqlalchemy import select
+
+from .clients import redis_client
+from .cache_backends import link_cache
+from .models import db
+from .queries import shortlinks
+
+TOP_KEY = "hotlinks:top"
+DECAY_LOCK_KEY = "hotlinks:decay"
+
+
+class SpaceSaving:
+    """Approximate top-k counter (Space-Saving, trimmed in batches).
+
+    Holds at most 2 * capacity keys. When full it keeps the `capacity` largest counters and a
+    newly seen key starts from the largest count that was dropped, as in Space-Saving. Trimming
+    in batches keeps every update O(1) amortised instead of searching for the minimum each time.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        # Count a key was given on insertion, so observed() can report what was actually seen
+        self.errors = {}
+        self.floor = 0
+
+    def add(self, key, n=1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += n
+            return
+        if len(counts) >= 2 * self.capacity:
+            self._trim()
+        counts[key] = self.floor + n
+        if self.floor:
+            self.errors[key] = self.floor
+
+    def _trim(self):
+        kept = heapq.nlargest(self.capacity + 1, self.counts.items(), key=itemgetter(1))
+        self.floor = kept.pop()[1]
+        self.counts = dict(kept)
+        self.errors = {key: error for key, error in self.errors.items() if key in self.counts}
+
+    def observed(self):
+        """{key: hits seen since the key entered the summary}, a lower bound of its true count."""
+        errors = self.errors
+        return {key: count - errors.get(key, 0) for key, count in self.counts.items()}
+
+
+class HotLinks:
+    """Tracks the most redirected aliases and pins the hottest ones in the link cache.
+
+    Each worker counts clicks in a SpaceSaving summary; a background thread adds the counts to a
+    shared Redis sorted set every `flush_interval` seconds and, once per `decay_interval` across
+    all workers, multiplies its scores by `decay` so the ranking follows current traffic.
+
+    The link cache entries of the top `pin_count` aliases that can be served blindly (unlimited
+    clicks, no expiration date) are written without expiry. Redirects don't read the pins: the
+    redirect snapshot serves such links from memory (see snapshot.py).
+    """
+
+    def __init__(self, redis_client, capacity=1000, pin_count=100, flush_interval=1.0,
+                 decay_interval=60.0, decay=0.5, pin_interval=10.0, max_tracked=10000, link_cache=None):
+        self.redis_client = redis_client
+        self.link_cache = link_cache
+        self.capacity = capacity
+        self.pin_count = pin_count
+        self.flush_interval = flush_interval
+        self.decay_interval = decay_interval
+        self.decay = decay
+        self.pin_interval = pin_interval
+        self.max_tracked = max_tracked
+        self.enabled = False
+        # alias -> canonical URL of the cache entries this worker pinned
+        self._pinned = {}
+        self.app = None
+        self._summary = SpaceSaving(capacity)
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = True
+
+    def record(self, alias):
+        if not self.enabled:
+            return
+        # Threads don't survive a fork, so start one per worker process
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+        with self._lock:
+            self._summary.add(alias)
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            # Counts inherited from the parent were already flushed by it
+            self._summary = SpaceSaving(self.capacity)
+            self._pinned = {}
+        threading.Thread(target=self._flush_loop, name="hot-links", daemon=True).start()
+
+    def _flush_loop(self):
+        next_pins = 0
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                if time.monotonic() >= next_pins:
+                    next_pins = time.monotonic() + self.pin_interval
+                    with self.app.app_context():
+                        self.refresh_pins()
+            except Exception:
+                # Tracking must never take the app down; counts are retried next round
+                pass
+
+    def flush(self):
+        with self._lock:
+            summary, self._summary = self._summary, SpaceSaving(self.capacity)
+        counts = summary.observed()
+        if not counts:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for alias, count in counts.items():
+                pipe.zincrby(TOP_KEY, count, alias)
+            pipe.execute()
+        except Exception:
+            # Put the counts back so they are not lost
+            with self._lock:
+                for alias, count in counts.items():
+                    self._summary.add(alias, count)
+            raise
+        # Whichever worker takes the lock decays the shared scores for this interval
+        if self.redis_client.set(DECAY_LOCK_KEY, os.getpid(), nx=True, px=int(self.decay_interval * 1000)):
+            pipe = self.redis_client.pipeline()
+            pipe.zunionstore(TOP_KEY, {TOP_KEY: self.decay})
+            pipe.zremrangebyrank(TOP_KEY, 0, -self.max_tracked - 1)
+            pipe.execute()
+
+    def refresh_pins(self):
+        if self.link_cache is None:
+            return
+        aliases = self.redis_client.zrevrange(TOP_KEY, 0, self.pin_count - 1)
+        pinned = {}
+        if aliases:
+            with db.engine.connect() as conn:
+                rows = conn.execute(
+                    select(shortlinks.c.short_url, shortlinks.c.canonical_url)
+                    .where(shortlinks.c.short_url.in_(aliases),
+                           shortlinks.c.canonical_url.is_not(None),
+                           shortlinks.c.max_clicks == -1,
+                           shortlinks.c.expiration_date.is_(None),
+                           shortlinks.c.expired.is_(False),
+                           shortlinks.c.deleted.is_(False))
+                )
+                pinned = {row.short_url: row.canonical_url for row in rows}
+        # Dropped out (deleted, expired, limited, colder) or moved to another URL since the last refresh
+        unpinned = [canonical_url for alias, canonical_url in self._pinned.items() if pinned.get(alias) != canonical_url]
+        self._pinned = pinned
+        # Pinned entries never expire, so a stale one must go; a lookup fills it in again if it still holds
+        for canonical_url in unpinned:
+            self.link_cache.delete(canonical_url)
+        # The cache is keyed by canonical URL, like the by_long lookups that read it
+        self.link_cache.set_many([(canonical_url, alias) for alias, canonical_url in pinned.items()], ttl=0)
+
+
+def top(redis_client, limit=10):
+    """[(alias, score)] of the hottest aliases, hottest first."""
+    return redis_client.zrevrange(TOP_KEY, 0, limit - 1, withscores=True)
+
+
+# Streaming top-K of redirected aliases; the hottest ones stay in the link cache
+hot_links = HotLinks(
+    redis_client,
+    capacity=int(os.environ.get("HOT_LINKS_CAPACITY", 1000)),
+    pin_count=int(os.environ.get("HOT_LINKS_PIN", 100)),
+    decay_interval=float(os.environ.get("HOT_LINKS_DECAY_SECONDS", 60)),
+    decay=float(os.environ.get("HOT_LINKS_DECAY", 0.5)),
+    link_cache=link_cache,
+)
@@ -0,0 +1,48 @@
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """orjson-backed provider producing the same output as Flask's default.
+
+    Keys are sorted and dates are rendered as HTTP dates, exactly like `jsonify` did before,
+    so API clients see no difference. Without orjson installed the app keeps using
+    DefaultJSONProvider (see `json_provider_class`).
+    """
+
+    options = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    @staticmethod
+    def _default(o):
+        if isinstance(o, date):
+            return http_date(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Callers asking for specific json.dumps behaviour get the stdlib
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self._default, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        options = self.options | orjson.OPT_APPEND_NEWLINE
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            options |= orjson.OPT_INDENT_2
+        return self._app.response_class(orjson.dumps(obj, default=self._default, option=options),
+                                        mimetype=self.mimetype)
+
+
+json_provider_class = FastJSONProvider if orjson else DefaultJSONProvider
@@ -0,0 +1,201 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and goes into the JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+_SAFE_ARGS = (str, int, float, bool, type(None))
+
+
+def parse_mapping(value, cast):
+    """'a=1,b.c=2' -> {'a': cast('1'), 'b.c': cast('2')}"""
+    result = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            key, _, val = item.partition('=')
+            result[key.strip()] = cast(val.strip())
+    return result
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'module': record.module,
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        elif record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of the events of high-volume loggers.
+
+    Inside a request the decision is made once per request and logger prefix, so a sampled
+    request keeps all of its events (and an unsampled one drops all of them). Warnings and
+    errors are never sampled out.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        # Longest prefix first so 'project.redirects.slow' beats 'project.redirects'
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+
+    def rate_for(self, name):
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + '.'):
+                return prefix, rate
+        return None, 1.0
+
+    def keep(self, name, level):
+        if level >= logging.WARNING:
+            return True
+        prefix, rate = self.rate_for(name)
+        if rate >= 1.0:
+            return True
+        if not has_request_context():
+            return random.random() < rate
+        decisions = g.setdefault('_log_sampling', {})
+        if prefix not in decisions:
+            decisions[prefix] = random.random() < rate
+        return decisions[prefix]
+
+    def filter(self, record):
+        # Already decided by a SampledLogger before the record was built
+        if getattr(record, '_sampled', False):
+            return True
+        return self.keep(record.name, record.levelno)
+
+
+class SampledLogger(logging.LoggerAdapter):
+    """Logger for hot paths: the sampling decision is made before a LogRecord is built.
+
+    Building a record (caller lookup, thread/process info) costs several microseconds, which
+    is most of the price of an event that is then sampled out by the handler's filter.
+    """
+
+    def __init__(self, logger):
+        super().__init__(logger, {'_sampled': True})
+
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level) and (_sampler is None or _sampler.keep(self.logger.name, level))
+
+    def process(self, msg, kwargs):
+        kwargs['extra'] = dict(kwargs.get('extra') or (), _sampled=True)
+        return msg, kwargs
+
+
+# The active sampling policy, set by configure_logging()
+_sampler = None
+
+
+def sampled_logger(name):
+    return SampledLogger(logging.getLogger(name))
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting and I/O to the listener thread.
+
+    The listener is (re)started lazily in whichever process logs, so it survives gunicorn
+    forking workers. When the queue is full records are dropped and counted rather than
+    blocking the request thread.
+    """
+
+    def __init__(self, log_queue, handlers):
+        super().__init__(log_queue)
+        self.target_handlers = handlers
+        self.dropped = 0
+        self._listener = None
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # Render the message here only if its args could change after we return
+        if record.args and not all(isinstance(arg, _SAFE_ARGS) for arg in
+                                   (record.args.values() if isinstance(record.args, dict) else record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        # Tracebacks reference live frames, so they have to be rendered on this thread
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self._listener_pid != os.getpid():
+            self.start()
+        super().emit(record)
+
+    def start(self):
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener = QueueListener(self.queue, *self.target_handlers, respect_handler_level=True)
+            self._listener.start()
+            self._listener_pid = os.getpid()
+
+    def stop(self):
+        with self._lock:
+            if self._listener is not None and self._listener_pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._listener_pid = None
+
+
+def configure_logging(stream=None):
+    """Root logger -> bounded queue -> JSON lines on a background thread.
+
+    LOG_LEVEL            root level (default INFO)
+    LOG_LEVELS           per-logger levels, e.g. "sqlalchemy=WARNING,project.api=DEBUG"
+    LOG_SAMPLE_RATES     per-logger sampling, e.g. "project.redirects=0.01,project.visits=0.01"
+    LOG_QUEUE_SIZE       records buffered before new ones are dropped (default 10000)
+    """
+    levels = {'sqlalchemy': 'WARNING'}
+    levels.update(parse_mapping(os.environ.get('LOG_LEVELS'), str.upper))
+    sample_rates = {'project.redirects': 0.01, 'project.visits': 0.01}
+    sample_rates.update(parse_mapping(os.environ.get('LOG_SAMPLE_RATES'), float))
+
+    stream_handler = logging.StreamHandler(stream or sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+
+    handler = BackgroundQueueHandler(queue.Queue(int(os.environ.get('LOG_QUEUE_SIZE', 10000))), [stream_handler])
+    global _sampler
+    _sampler = SamplingFilter(sample_rates)
+    handler.addFilter(_sampler)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if isinstance(existing, BackgroundQueueHandler):
+            existing.stop()
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    atexit.register(handler.stop)
+    return handler
@@ -0,0 +1,369 @@
+import os
+import random
+import string
+from datetime import datetime as dt
+
+import sqlalchemy.exc
+from flask import Blueprint, Response, jsonify, redirect, url_for, render_template, request, flash
+from flask_login import login_required, current_user
+
+from .models import ShortLink, db, Visit, UserAgent, IpAddress, country_names
+from .logconfig import sampled_logger
+from .hotlinks import hot_links
+from .cache_backends import forget
+from .snapshot import redirect_snapshot
+from .visit_policy import visit_policy
+from .visit_feed import visit_feed
+from .redirect_policy import link_redirect
+from . import queries, redirect_sql
+
+main = Blueprint('main', __name__)
+
+# High-volume events, sampled per request (LOG_SAMPLE_RATES)
+redirect_logger = sampled_logger('project.redirects')
+visit_logger = sampled_logger('project.visits')
+
+random_letters = string.ascii_letters + string.digits
+# Counting every link on each page of the links table would grow with the table
+LINKS_COUNT_CAP = int(os.environ.get('LINKS_COUNT_CAP', 10000))
+
+
+def random_string(length):
+    return ''.join(random.choice(random_letters) for i in range(length))
+
+
+def create_alias_till_unique(alias):
+    # Check if the alias already exists
+    if ShortLink.query.filter_by(short_url=alias).first():
+        # If it does, create a new alias
+        alias = random_string(15)
+        return create_alias_till_unique(alias)
+    else:
+        return alias
+
+
+def row2dict(row):
+    d = {}
+    for column in row.__table__.columns:
+        d[column.name] = getattr(row, column.name)
+
+    return d
+
+
+def visitor():
+    """(ip_address, user_agent, country) of the current visitor."""
+    # Get the visitor's headers
+    headers = request.headers
+    user_agent = headers.get('User-Agent')
+    # Check if the CF-Connecting-IP header is present
+    if 'CF-Connecting-IP' in headers:
+        ip_address = headers.get('CF-Connecting-IP')
+        country = headers.get('CF-IPCountry')
+    else:
+        ip_address = request.remote_addr
+        country = "XX"
+    if country not in country_names():
+        country = "XX"
+    return ip_address, user_agent, country
+
+
+@main.route("/")
+def index():
+    root_redirect = os.environ.get('ROOT_REDIRECT', None)
+    if root_redirect and not current_user.is_authenticated:
+        return redirect(root_redirect)
+    return render_template("index.html")
+
+
+@main.route('/create', methods=['POST', 'GET'])
+@login_required
+def create():
+    if request.method == 'POST':
+        # Get the form data
+        form_data = request.form
+        url = form_data.get('url')
+        alias = form_data.get('alias', create_alias_till_unique(random_string(15))).replace(' ', '-')
+        max_clicks = form_data.get('max_clicks', -1)
+        expiration_date = form_data.get('expiration_date', None)
+        # Make sure if our expiration date is empty that we set it to None
+        if expiration_date == "":
+            expiration_date = None
+        # If the alias is empty, generate a random one
+        if alias == "":
+            alias = create_alias_till_unique(random_string(15))
+        # Check if the alias already exists
+        if ShortLink.query.filter_by(short_url=alias).first():
+            flash("Alias already exists. Please try again.", "danger")
+            return redirect(url_for('main.create'))
+        # Our expriration date is a milisecond unix timestamp, so we need to convert it to a datetime object
+        if expiration_date:
+            expiration_date = dt.fromtimestamp(int(expiration_date) / 1000)
+        try:
+            short_link = ShortLink(url, alias, max_clicks, expiration_date)
+            db.session.add(short_link)
+            db.session.commit()
+            flash('Short link created successfully!', 'success')
+            return redirect(url_for('main.links'))
+        except sqlalchemy.exc.DataError as e:
+            flash(f'Error: {e}', 'danger')
+            return redirect(url_for('main.create'))
+    else:
+        return render_template('create.html')
+
+
+@main.route('/visits')
+@login_required
+def visits():
+    # Rows are loaded by the table through /visits/data
+    return render_template('visits.html')
+
+
+@main.route('/visits/stream')
+@login_required
+def visits_stream():
+    # New visits as Server-Sent Events; EventSource sends Last-Event-ID when it reconnects
+    if not visit_feed.enabled:
+        # 204 tells EventSource not to reconnect
+        return '', 204
+    if visit_feed.full():
+        return 'Too many open streams, retry shortly', 503, {'Retry-After': str(visit_feed.retry_ms // 1000)}
+    return Response(visit_feed.stream(request.headers.get('Last-Event-ID')), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@main.route('/visits/data')
+@login_required
+def visits_data():
+    query = Visit.query.options(db.joinedload(Visit.ip_address_row), db.joinedload(Visit.user_agent_row))
+
+    # search filter
+    search = request.args.get('search[value]')
+    if search:
+        # Country names live in names.json, so match them here and filter on the codes
+        countries = [code for code, name in country_names().items() if search in name]
+        query = query.filter(db.or_(
+            Visit.ip_address_id.in_(db.select(IpAddress.id).where(IpAddress.value.like(f'%{search}%'))),
+            Visit.country.in_(countries),
+            Visit.user_agent_id.in_(db.select(UserAgent.id).where(UserAgent.value.like(f'%{search}%'))),
+            # We need the shortlink alias to be searchable, Visit has a "shortlink" backref
+            Visit.shortlink.has(ShortLink.short_url.like(f'%{search}%'))
+        ))
+
+    total_filtered = query.count()
+
+    # newest first; ordering by the partition key lets Postgres read only the newest partitions
+    query = query.order_by(Visit.created_at.desc(), Visit.id.desc())
+
+    # pagination
+    start = request.args.get('start', type=int)
+    length = request.args.get('length', type=int)
+    query = query.offset(start).limit(length)
+
+    # resp
+    return jsonify({
+        'data': [row.to_dict() for row in query.all()],
+        'recordsFiltered': total_filtered,
+        'recordsTotal': Visit.query.count(),
+        'draw': request.args.get('draw', type=int)
+    })
+
+
+# The links pages only render the table; rows come from /links/data one page at a time
+@main.route('/links')
+@login_required
+def links():
+    return render_template('links.html', status='active')
+
+
+@main.route('/links/deleted')
+@login_required
+def links_deleted():
+    return render_template('links.html', status='deleted')
+
+
+@main.route('/links/expired')
+@login_required
+def links_expired():
+    return render_template('links.html', status='expired')
+
+
+@main.route('/links/data')
+@login_required
+def links_data():
+    status = request.args.get('status', 'active')
+    if status not in queries.LINK_STATUS:
+        return jsonify({'error': 'Unknown status'}), 400
+
+    # ordering, only on indexed columns
+    order_index = request.args.get('order[0][column]', type=int)
+    order = request.args.get(f'columns[{order_index}][data]', 'id') if order_index is not None else 'id'
+    if order not in queries.LINK_ORDER_COLUMNS:
+        order = 'id'
+    descending = request.args.get('order[0][dir]', 'desc') != 'asc'
+
+    # pagination
+    start = max(request.args.get('start', 0, type=int), 0)
+    length = min(max(request.args.get('length', 10, type=int), 1), 100)
+
+    search = request.args.get('search[value]', '').strip()
+    rows, total, filtered = queries.link_page(status, start, length, order, descending, search, LINKS_COUNT_CAP)
+
+    # resp
+    return jsonify({
+        'data': rows,
+        'recordsTotal': total,
+        'recordsFiltered': filtered,
+        # Counts stop at LINKS_COUNT_CAP + 1; the table shows them as "N+"
+        'countCap': LINKS_COUNT_CAP,
+        'draw': request.args.get('draw', type=int)
+    })
+
+
+@main.route('/links/info/<id>')
+@login_required
+def link_info(id):
+    # Get the short link
+    short_link = ShortLink.query.filter_by(id=id).first()
+    if not short_link:
+        return jsonify({'error': 'Short link not found'})
+    return_dict = row2dict(short_link)
+    try:
+        return_dict['created_by'] = short_link.owner.username
+    except AttributeError:
+        return_dict['created_by'] = "Unknown"
+    # Sampled visits are scaled up by their weight
+    return_dict['visits'] = queries.visit_totals(short_link.id)
+    return jsonify(return_dict)
+
+
+@main.route('/links/edit/<id>', methods=['POST'])
+@login_required
+def link_edit(id):
+    # Get the short link
+    short_link = ShortLink.query.filter_by(id=id).first()
+    if not short_link:
+        return jsonify({'error': 'Short link not found'})
+    # Get the form data
+    form_data = request.form
+    url = form_data.get('url')
+    max_clicks = form_data.get('max_clicks', -1)
+    alias = form_data.get('alias', create_alias_till_unique(random_string(15))).replace(' ', '-')
+    expiration_date = form_data.get('expiration_date', None)
+    if expiration_date == "":
+        expiration_date = None
+    if expiration_date:
+        expiration_date = dt.fromtimestamp(int(expiration_date) / 1000)
+
+    # Update the short link
+    cached = short_link.canonical_url
+    try:
+        short_link.original_url = url
+        short_link.max_clicks = max_clicks
+        short_link.short_url = alias
+        short_link.expiration_date = expiration_date
+        db.session.commit()
+        # The cached alias for the old URL may be gone or limited now
+        forget(cached)
+        return jsonify({'success': 'Short link updated successfully', 'link_data': row2dict(short_link)})
+    except sqlalchemy.exc.DataError as e:
+        return jsonify({'error': f'Error: {e}'})
+
+
+@main.route('/links/delete/<int:link_id>', methods=['POST'])
+@login_required
+def delete_link(link_id):
+    # Get the short link
+    short_link = ShortLink.query.get(link_id)
+    # Delete the short link
+    short_link.expired = True
+    short_link.deleted = True
+    db.session.commit()
+    forget(short_link.canonical_url)
+    # Return to the links page
+    flash('Short link deleted successfully!', 'success')
+    return redirect(url_for('main.links'))
+
+
+@main.route('/links/hard_delete/<int:link_id>', methods=['POST'])
+@login_required
+def hard_delete_link(link_id):
+    # Get the short link
+    short_link = ShortLink.query.get(link_id)
+    # Delete the short link
+    cached = short_link.canonical_url
+    db.session.delete(short_link)
+    db.session.commit()
+    forget(cached)
+    # Return to the links page
+    flash('Short link deleted successfully!', 'success')
+    return redirect(url_for('main.links'))
+
+
+@main.route('/links/restore/<int:link_id>', methods=['POST'])
+@login_required
+def restore_link(link_id):
+    # Get the short link
+    short_link = ShortLink.query.get(link_id)
+    # Delete the short link
+    short_link.expired = False
+    short_link.deleted = False
+    db.session.commit()
+    # Return to the links page
+    flash('Short link restored successfully!', 'success')
+    return redirect(url_for('main.links_deleted'))
+
+
+@main.route("/<short_url>")
+def redirect_to_short_url(short_url):
+    # Check for trailing slash
+    if short_url.endswith('/'):
+        short_url = short_url[:-1]
+    # Unlimited links without an expiration date come from the mapped snapshot when enabled;
+    # the click and visit are written in batches by its sync thread (see snapshot.py)
+    link = redirect_snapshot.lookup(short_url)
+    if link is not None:
+        seen = visitor()
+        weight = None if visit_policy.skips(seen[1]) else visit_policy.weight(link.visit_sample_rate)
+        visited = redirect_snapshot.click(link, seen if weight is not None else None, weight)
+        hot_links.record(short_url)
+        if visited:
+            visit_feed.publish(short_url, *seen)
+            visit_logger.info("visit", extra={'short_url_id': link.id, 'country': seen[2]})
+        redirect_logger.info("redirect", extra={'alias': short_url, 'link_id': link.id})
+        return link_redirect(link.original_url, link.redirect_policy, -1, None)
+    # Expiry check, click and visit in one statement on Postgres (see redirect_sql.py)
+    seen = visitor()
+    # Bots are dropped here; the user agent and IP are only stored if the visit is logged
+    visit = None if visit_policy.skips(seen[1]) else seen
+    result = redirect_sql.follow(short_url, visit)
+    if result.refused == redirect_sql.NOT_FOUND:
+        return redirect(url_for('main.index'))
+    if result.refused == redirect_sql.EXPIRED:
+        flash("This link has expired", "danger")
+        return redirect(url_for('main.index'))
+    if result.refused == redirect_sql.USED_UP:
+        flash("Sorry, this link has been used up.", "danger")
+        return redirect(url_for('main.index'))
+    hot_links.record(short_url)
+    if result.visited:
+        visit_feed.publish(short_url, *seen)
+        visit_logger.info("visit", extra={'short_url_id': result.link_id, 'country': seen[2]})
+    redirect_logger.info("redirect", extra={'alias': short_url, 'link_id': result.link_id})
+    # Status and Cache-Control decide whether browsers/CDNs come back for the next click
+    return link_redirect(result.original_url, result.redirect_policy, result.max_clicks, result.expiration_date)
+
+
+@main.app_errorhandler(404)
+def not_found(e):
+    # We'll do some custom logic here.
+    # Get the path that was requested
+    path = request.path[1:]
+    # Remove any trailing slash
+    if path.endswith('/'):
+        path = path[:-1]
+    # Check if it's a short link
+    short_link = ShortLink.query.filter_by(short_url=path).first()
+    if short_link:
+        # It's a short link, so redirect to the original URL
+        return redirect_to_short_url(path)
+    return redirect(url_for('main.index'))
@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import request, g
+
+METRICS_KEY = "metrics:requests"
+
+
+class RequestMetrics:
+    """Per-endpoint request counters (count, wall time, thread CPU time).
+
+    Counting happens in-process; a background thread pushes the deltas to a Redis hash
+    every `flush_interval` seconds so every gunicorn worker adds into the same totals.
+    """
+
+    def __init__(self, redis_client, flush_interval=1.0):
+        self.redis_client = redis_client
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = defaultdict(lambda: [0, 0, 0])
+        self._flusher_pid = None
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+
+    def _start(self):
+        g._metrics_start = (time.perf_counter_ns(), time.thread_time_ns())
+
+    def _finish(self, exc):
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return
+        wall_ns = time.perf_counter_ns() - start[0]
+        cpu_ns = time.thread_time_ns() - start[1]
+        self.record(request.endpoint or "<unmatched>", wall_ns, cpu_ns)
+
+    def record(self, endpoint, wall_ns, cpu_ns):
+        with self._lock:
+            counters = self._pending[endpoint]
+            counters[0] += 1
+            counters[1] += wall_ns
+            counters[2] += cpu_ns
+        # Threads don't survive a fork, so start one per worker process
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name="request-metrics", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                # Metrics must never take the app down; the deltas are retried next round
+                pass
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: [0, 0, 0])
+        if not pending:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for endpoint, (count, wall_ns, cpu_ns) in pending.items():
+                pipe.hincrby(METRICS_KEY, f"{endpoint}:count", count)
+                pipe.hincrby(METRICS_KEY, f"{endpoint}:wall_ns", wall_ns)
+                pipe.hincrby(METRICS_KEY, f"{endpoint}:cpu_ns", cpu_ns)
+            pipe.execute()
+        except Exception:
+            # Put the deltas back so they are not lost
+            with self._lock:
+                for endpoint, values in pending.items():
+                    counters = self._pending[endpoint]
+                    for i, value in enumerate(values):
+                        counters[i] += value
+            raise
@@ -1,47 +1,78 @@
+from functools import lru_cache
+from pathlib import Path
+
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin, current_user
+from sqlalchemy.orm import validates
 import json
 
-db = SQLAlchemy()
-
+from .canonical import canonicalizer
 
-def load_country_names():
-    with open('project/names.json', 'r') as f:
-        return json.load(f)
+db = SQLAlchemy()
 
 
-country_names = load_country_names()
-country_names["XX"] = "Unknown"
+@lru_cache(maxsize=None)
+def country_names():
+    """{code: name} from names.json, read once per process on first use ("XX" is unknown)."""
+    with open(Path(__file__).with_name('names.json'), 'r') as f:
+        names = json.load(f)
+    names["XX"] = "Unknown"
+    return names
 
 
 class ShortLink(db.Model):
     __tablename__ = 'shortlinks'
+    __table_args__ = (
+        # text_pattern_ops serves both alias lookups and prefix search (LIKE 'abc%') on Postgres
+        db.Index('ix_shortlinks_short_url', 'short_url', postgresql_ops={'short_url': 'text_pattern_ops'}),
+        db.Index('ix_shortlinks_created_at_id', 'created_at', 'id'),
+        # Deleted and expired links are few; these let their pages skip the live ones
+        db.Index('ix_shortlinks_deleted_id', 'id', postgresql_where=db.text('deleted'), sqlite_where=db.text('deleted')),
+        db.Index('ix_shortlinks_expired_id', 'id', postgresql_where=db.text('expired'), sqlite_where=db.text('expired')),
+        # Equality only, and a hash entry has no size limit (long URLs overflow a btree page)
+        db.Index('ix_shortlinks_canonical_url', 'canonical_url', postgresql_using='hash'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     original_url = db.Column(db.Text, nullable=False)
+    # original_url in canonical form (see canonical.py), kept in step by _canonicalize; by_long lookups match on it
+    canonical_url = db.Column(db.Text, nullable=True)
     short_url = db.Column(db.Text, nullable=False)
     expired = db.Column(db.Boolean, nullable=False, default=False)
     expiration_date = db.Column(db.DateTime, nullable=True)
     max_clicks = db.Column(db.Integer, nullable=False, default=-1)
     current_clicks = db.Column(db.Integer, nullable=False, default=0)
     deleted = db.Column(db.Boolean, nullable=False, default=False)
+    # 'tracked' or 'cacheable' (see redirect_policy.py); NULL follows REDIRECT_POLICY
+    redirect_policy = db.Column(db.String(16), nullable=True)
+    # Share of visits logged, 0 to 1 (0 logs none); NULL follows VISIT_SAMPLE_RATE (see visit_policy.py)
+    visit_sample_rate = db.Column(db.Float, nullable=True)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
-    visits = db.relationship('Visit', backref='shortlink', lazy=False)
+    # Loaded on access only; eager loading pulled every visit into each link query
+    visits = db.relationship('Visit', backref='shortlink', lazy='select')
 
     # Timestamps
     created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
     updated_at = db.Column(db.DateTime, nullable=False, default=db.func.now(), onupdate=db.func.now())
 
-    def __init__(self, original_url, short_url, max_clicks=-1, expiration_date=None, created_by=None):
+    def __init__(self, original_url, short_url, max_clicks=-1, expiration_date=None, created_by=None,
+                 redirect_policy=None, visit_sample_rate=None):
         self.original_url = original_url
         self.short_url = short_url
         self.max_clicks = max_clicks
         self.expiration_date = expiration_date
+        self.redirect_policy = redirect_policy
+        self.visit_sample_rate = visit_sample_rate
         if created_by:
             self.created_by = created_by
         else:
             self.created_by = current_user.id
 
+    @validates('original_url')
+    def _canonicalize(self, key, url):
+        self.canonical_url = canonicalizer.canonicalize(url) if url else url
+        return url
+
     def __repr__(self):
         return '<ShortLink %r>' % self.short_url
 
@@ -50,11 +81,14 @@ class ShortLink(db.Model):
             'id': self.id,
             'short_url': self.short_url,
             'original_url': self.original_url,
+            'canonical_url': self.canonical_url,
             'expired': self.expired,
             'expiration_date': self.expiration_date,
             'max_clicks': self.max_clicks,
             'current_clicks': self.current_clicks,
             'deleted': self.deleted,
+            'redirect_policy': self.redirect_policy,
+            'visit_sample_rate': self.visit_sample_rate,
             'created_by': self.created_by,
             'created_at': self.created_at,
             'updated_at': self.updated_at
@@ -67,7 +101,8 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(255), nullable=False, unique=True)
     password = db.Column(db.String(255), nullable=False)
-    links = db.relationship('ShortLink', backref='owner', lazy=False)
+    # Loaded on access only; eager loading pulled every link into each logged-in request
+    links = db.relationship('ShortLink', backref='owner', lazy='select')
 
     # Timestamps
     created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
@@ -81,30 +116,66 @@ class User(UserMixin, db.Model):
         return '<User %r>' % self.username
 
 
+class UserAgent(db.Model):
+    __tablename__ = 'user_agents'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(255), nullable=False, unique=True)
+
+
+class IpAddress(db.Model):
+    __tablename__ = 'ip_addresses'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Long enough for any textual IPv6 address, including IPv4-mapped ones
+    value = db.Column(db.String(45), nullable=False, unique=True)
+
+
 class Visit(db.Model):
     __tablename__ = 'visits'
 
     id = db.Column(db.Integer, primary_key=True)
     short_url_id = db.Column(db.Integer, db.ForeignKey('shortlinks.id'), nullable=False)
-    ip_address = db.Column(db.String(255), nullable=False)
-    user_agent = db.Column(db.String(255), nullable=False)
-    country = db.Column(db.String(255), nullable=False)
-    country_name = db.Column(db.String(255), nullable=False, default="Unknown")
+    # User agents and IPs repeat a lot, so rows only keep ids into the lookup tables (see dimensions.py).
+    # There are no foreign keys on purpose: lookup rows are never deleted and ids only come from
+    # committed rows, while the checks would cost every insert a lookup plus a share lock on a hot row.
+    ip_address_id = db.Column(db.Integer, nullable=False)
+    user_agent_id = db.Column(db.Integer, nullable=False)
+    # Two-letter code; the name comes from names.json when the visit is read
+    country = db.Column(db.String(2), nullable=False)
+    # Visits this row stands for: 1 / the sample rate it was logged at
+    sample_weight = db.Column(db.Float, nullable=False, default=1, server_default='1')
+    ip_address_row = db.relationship('IpAddress', primaryjoin='Visit.ip_address_id == IpAddress.id',
+                                     foreign_keys=[ip_address_id])
+    user_agent_row = db.relationship('UserAgent', primaryjoin='Visit.user_agent_id == UserAgent.id',
+                                     foreign_keys=[user_agent_id])
 
     # Timestamps
     created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
     updated_at = db.Column(db.DateTime, nullable=False, default=db.func.now(), onupdate=db.func.now())
 
-    def __init__(self, short_url_id, ip_address, user_agent, country):
+    def __init__(self, short_url_id, ip_address_id, user_agent_id, country, sample_weight=1):
         self.short_url_id = short_url_id
-        self.ip_address = ip_address
-        self.user_agent = user_agent
+        self.ip_address_id = ip_address_id
+        self.user_agent_id = user_agent_id
         self.country = country
-        self.country_name = country_names[country]
+        self.sample_weight = sample_weight
 
     def __repr__(self):
         return '<Visit %r>' % self.id
 
+    @property
+    def ip_address(self):
+        return self.ip_address_row.value
+
+    @property
+    def user_agent(self):
+        return self.user_agent_row.value
+
+    @property
+    def country_name(self):
+        return country_names().get(self.country, "Unknown")
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -113,6 +184,35 @@ class Visit(db.Model):
             'user_agent': self.user_agent,
             'country': self.country,
             'country_name': self.country_name,
+            'sample_weight': self.sample_weight,
             'created_at': self.created_at,
             'updated_at': self.updated_at
         }
+
+
+class CachedLink(db.Model):
+    """An entry of the Postgres link cache (CACHE_BACKEND=postgres, see cache_backends.py).
+
+    The table is UNLOGGED on Postgres: writes skip the WAL and it is emptied after a crash,
+    which is fine for a cache.
+    """
+    __tablename__ = 'link_cache'
+
+    # blake2b digest of the original URL, so the key stays 16 bytes whatever the URL length
+    key = db.Column(db.LargeBinary(16), primary_key=True)
+    short_url = db.Column(db.Text, nullable=False)
+    # Unix seconds, 0 = never
+    expires_at = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class LinkChange(db.Model):
+    """An alias whose link was inserted, deleted or edited, written by a trigger on shortlinks.
+
+    Workers serving redirects from the snapshot (see snapshot.py) poll it to update their
+    overlay; rows older than the snapshot in use are pruned when the next one is built.
+    """
+    __tablename__ = 'link_changes'
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    short_url = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now(), server_default=db.func.now())
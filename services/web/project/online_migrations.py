@@ -0,0 +1,172 @@
+"""Helpers for schema changes that must not stall traffic on large tables (see migrations/README).
+
+Use them from Alembic revisions with op.get_bind() as `conn`:
+
+    guarded(conn, op.add_column, 'visits', sa.Column('source', sa.Text()))
+    with op.get_context().autocommit_block():
+        create_index_concurrently(op.get_bind(), 'ix_visits_source', 'visits', ['source'])
+        backfill(op.get_bind(), 'visits_source', 'visits', "source = 'web'", "source IS NULL")
+
+On databases other than Postgres they fall back to the plain operations.
+"""
+import time
+from contextlib import contextmanager
+
+import sqlalchemy.exc
+from sqlalchemy import text
+
+# Postgres' SQLSTATE for "could not obtain lock" when lock_timeout expires
+LOCK_NOT_AVAILABLE = '55P03'
+
+_PROGRESS_TABLE = text("""
+CREATE TABLE IF NOT EXISTS online_migration_progress (
+    name VARCHAR(255) PRIMARY KEY,
+    last_key BIGINT NOT NULL
+)
+""")
+
+
+def _postgres(conn):
+    return conn.dialect.name == 'postgresql'
+
+
+def _lock_not_available(error):
+    return getattr(getattr(error, 'orig', None), 'pgcode', None) == LOCK_NOT_AVAILABLE
+
+
+@contextmanager
+def timeouts(conn, lock_timeout='2s', statement_timeout=None):
+    """Set lock_timeout (and statement_timeout) on the connection, restoring the old values on exit."""
+    if not _postgres(conn):
+        yield
+        return
+    settings = {'lock_timeout': lock_timeout, 'statement_timeout': statement_timeout}
+    previous = {}
+    for name, value in settings.items():
+        if value is not None:
+            previous[name] = conn.execute(text(f"SHOW {name}")).scalar()
+            conn.execute(text("SELECT set_config(:name, :value, false)"), {'name': name, 'value': str(value)})
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            conn.execute(text("SELECT set_config(:name, :value, false)"), {'name': name, 'value': value})
+
+
+def guarded(conn, operation, *args, lock_timeout='2s', attempts=10, backoff=1.0, **kwargs):
+    """Run operation(*args, **kwargs), a DDL step, giving up on its lock after `lock_timeout`.
+
+    An ALTER TABLE waiting for its lock queues every later query on the table behind it, so a
+    long-running reader would stall all traffic. With a lock timeout the statement fails fast
+    instead; it is retried after `backoff` seconds (doubling, up to `attempts` times) in a
+    savepoint, so the migration's transaction survives the failed attempts.
+    """
+    if not _postgres(conn):
+        return operation(*args, **kwargs)
+    for attempt in range(1, attempts + 1):
+        try:
+            with timeouts(conn, lock_timeout), conn.begin_nested():
+                return operation(*args, **kwargs)
+        except sqlalchemy.exc.OperationalError as e:
+            if not _lock_not_available(e) or attempt == attempts:
+                raise
+            print(f"Lock not available after {lock_timeout} (attempt {attempt}/{attempts}), retrying")
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+
+def create_index_concurrently(conn, name, table, columns, unique=False, where=None, using=None, lock_timeout='2s'):
+    """CREATE INDEX CONCURRENTLY, which lets writes go on while it builds; needs an autocommit connection.
+
+    A concurrent build that failed leaves an INVALID index behind, which is dropped and rebuilt
+    here, so re-running the migration finishes the job. `using` (e.g. 'hash') only applies on
+    Postgres.
+    """
+    unique_sql = 'UNIQUE ' if unique else ''
+    where_sql = f' WHERE {where}' if where else ''
+    columns_sql = ', '.join(columns)
+    if not _postgres(conn):
+        conn.execute(text(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({columns_sql}){where_sql}"))
+        return
+    using_sql = f' USING {using}' if using else ''
+    invalid = conn.execute(text(
+        "SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"), {'name': name}).scalar()
+    if invalid is False:
+        return
+    with timeouts(conn, lock_timeout):
+        if invalid:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(text(f"CREATE {unique_sql}INDEX CONCURRENTLY {name} ON {table}{using_sql} ({columns_sql}){where_sql}"))
+
+
+def drop_index_concurrently(conn, name, lock_timeout='2s'):
+    """DROP INDEX CONCURRENTLY; needs an autocommit connection."""
+    if not _postgres(conn):
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        return
+    with timeouts(conn, lock_timeout):
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def backfill(conn, name, table, assignments, where, batch_size=1000, duty_cycle=0.5, key='id',
+             lock_timeout='2s', statement_timeout='30s', progress=print):
+    """UPDATE `table` SET `assignments` WHERE `where`, one committed key range at a time (see walk_keys).
+
+    Batches can be repeated after a crash, so `assignments` must be idempotent, and `where`
+    should skip rows already done. Returns the number of rows updated.
+    """
+    update = text(f"UPDATE {table} SET {assignments} WHERE {key} > :low AND {key} <= :high AND ({where})")
+    return walk_keys(conn, name, table, lambda low, high: conn.execute(update, {'low': low, 'high': high}).rowcount,
+                     batch_size, duty_cycle, key, lock_timeout, statement_timeout, progress)
+
+
+def walk_keys(conn, name, table, batch, batch_size=1000, duty_cycle=0.5, key='id',
+              lock_timeout='2s', statement_timeout='30s', progress=print):
+    """Call batch(low, high) for consecutive ranges low < key <= high of `table`, committing each.
+
+    For backfills that compute values in Python; `batch` returns the number of rows it updated.
+    Needs an autocommit connection, so each batch only holds its rows' locks for its own
+    duration. After every batch the walk sleeps so that it is busy `duty_cycle` of the time,
+    leaving the rest to traffic. The last finished key is kept in online_migration_progress
+    under `name`, and a re-run resumes after it. Rows inserted after the walk started are the
+    application's job. Returns the total `batch` reported.
+    """
+    conn.execute(_PROGRESS_TABLE)
+    start = conn.execute(text("SELECT last_key FROM online_migration_progress WHERE name = :name"),
+                         {'name': name}).scalar()
+    low, high = conn.execute(text(f"SELECT min({key}), max({key}) FROM {table}")).first()
+    if high is None:
+        return 0
+    if start is None:
+        start = low - 1
+        conn.execute(text("INSERT INTO online_migration_progress (name, last_key) VALUES (:name, :key)"),
+                     {'name': name, 'key': start})
+    else:
+        progress(f"{name}: resuming after {key} {start}")
+    save = text("UPDATE online_migration_progress SET last_key = :key WHERE name = :name")
+    updated = 0
+    batches = 0
+    started = time.monotonic()
+    with timeouts(conn, lock_timeout, statement_timeout):
+        while start < high:
+            batch_started = time.monotonic()
+            end = min(start + batch_size, high)
+            try:
+                updated += batch(start, end)
+            except sqlalchemy.exc.OperationalError as e:
+                if not _lock_not_available(e):
+                    raise
+                # Rows held by a long transaction; try the same range again shortly
+                time.sleep(1)
+                continue
+            conn.execute(save, {'name': name, 'key': end})
+            start = end
+            batches += 1
+            elapsed = time.monotonic() - batch_started
+            if batches % 100 == 0 or start >= high:
+                done = (start - low + 1) / (high - low + 1)
+                progress(f"{name}: {done:.0%} ({updated} rows, {updated / (time.monotonic() - started):.0f} rows/s)")
+            if duty_cycle < 1:
+                time.sleep(elapsed * (1 / duty_cycle - 1))
+    conn.execute(text("DELETE FROM online_migration_progress WHERE name = :name"), {'name': name})
+    return updated
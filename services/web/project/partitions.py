@@ -0,0 +1,117 @@
+import gzip
+import os
+import re
+import threading
+import time
+from datetime import date
+from pathlib import Path
+
+from sqlalchemy import text
+
+from .models import db
+
+# Partitions are named visits_pYYYY_MM by visits_ensure_partitions() (migration 6ceaa96da347)
+PARTITION_NAME = re.compile(r'^visits_p(\d{4})_(\d{2})$')
+
+
+def is_partitioned(engine):
+    if engine.dialect.name != 'postgresql':
+        return False
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT to_regclass('visits_default') IS NOT NULL")).scalar()
+
+
+def ensure_partitions(engine, months_ahead=3, first_month=None):
+    """Create the monthly partitions from `first_month` (default: this month) up to `months_ahead`
+    months from now. Returns how many were created."""
+    with engine.begin() as conn:
+        return conn.execute(text("SELECT visits_ensure_partitions(:months, :first)"),
+                            {"months": months_ahead, "first": first_month}).scalar()
+
+
+def list_partitions(engine):
+    """[(name, month_start)] of attached monthly partitions, oldest first."""
+    with engine.connect() as conn:
+        names = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'visits'::regclass"
+        )).scalars()
+        partitions = []
+        for name in names:
+            match = PARTITION_NAME.match(name)
+            if match:
+                partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def archive_partition(engine, name, archive_dir):
+    """Detach a partition, export it as gzipped CSV and drop it."""
+    archive_dir = Path(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / f"{name}.csv.gz"
+    with engine.begin() as conn:
+        # Once detached, inserts for that month would go to the default partition; it is in the past anyway
+        conn.execute(text(f'ALTER TABLE visits DETACH PARTITION "{name}"'))
+    raw = engine.raw_connection()
+    try:
+        with gzip.open(path, 'wb') as out, raw.cursor() as cur:
+            cur.copy_expert(f'COPY "{name}" TO STDOUT WITH CSV HEADER', out)
+        raw.commit()
+    finally:
+        raw.close()
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE "{name}"'))
+    return path
+
+
+def apply_retention(engine, keep_months, archive_dir):
+    """Archive and drop every partition that ends more than `keep_months` months ago."""
+    today = date.today()
+    cutoff_index = today.year * 12 + today.month - 1 - keep_months
+    cutoff = date(cutoff_index // 12, cutoff_index % 12 + 1, 1)
+    archived = []
+    for name, month_start in list_partitions(engine):
+        if month_start < cutoff:
+            archived.append(archive_partition(engine, name, archive_dir))
+    return archived
+
+
+class PartitionMaintainer:
+    """Keeps future visit partitions in place from inside the app.
+
+    Each worker process starts one daemon thread on its first request; the SQL function
+    takes an advisory lock, so concurrent workers don't race on the DDL.
+    """
+
+    def __init__(self, months_ahead=3, interval=6 * 3600):
+        self.months_ahead = months_ahead
+        self.interval = interval
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        app.before_request(self._ensure_thread)
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="visit-partitions", daemon=True).start()
+
+    def _run(self):
+        with self.app.app_context():
+            if not is_partitioned(db.engine):
+                return
+            while True:
+                try:
+                    created = ensure_partitions(db.engine, self.months_ahead)
+                    if created:
+                        self.app.logger.info("Created %s visit partition(s)", created)
+                except Exception:
+                    self.app.logger.exception("Visit partition maintenance failed")
+                time.sleep(self.interval)
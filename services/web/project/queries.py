@@ -0,0 +1,132 @@
+from sqlalchemy import select, bindparam, and_, or_, func, literal
+
+from .models import db, ShortLink, Visit
+from .canonical import canonicalizer
+
+# Core table, so reads skip ORM instances, the identity map and the eager `visits` join
+shortlinks = ShortLink.__table__
+
+# Same fields as ShortLink.to_dict()
+LINK_COLUMNS = (
+    shortlinks.c.id,
+    shortlinks.c.short_url,
+    shortlinks.c.original_url,
+    shortlinks.c.canonical_url,
+    shortlinks.c.expired,
+    shortlinks.c.expiration_date,
+    shortlinks.c.max_clicks,
+    shortlinks.c.current_clicks,
+    shortlinks.c.deleted,
+    shortlinks.c.redirect_policy,
+    shortlinks.c.visit_sample_rate,
+    shortlinks.c.created_by,
+    shortlinks.c.created_at,
+    shortlinks.c.updated_at,
+)
+
+# Statements are built once; with bound parameters every call hits SQLAlchemy's compiled cache
+short_url_by_canonical_stmt = (
+    select(shortlinks.c.short_url)
+    .where(shortlinks.c.canonical_url == bindparam('canonical_url'), shortlinks.c.deleted.is_(False))
+    .limit(1)
+)
+# shortlinks.id is a 32-bit integer; a larger number can't be an id, and Postgres refuses to compare one
+MAX_LINK_ID = 2 ** 31 - 1
+link_by_id_stmt = select(*LINK_COLUMNS).where(shortlinks.c.id == bindparam('link_id'))
+_link_list_stmts = {}
+
+
+def short_url_for(original_url):
+    """Short alias of the first live link pointing at `original_url`, spelled any way with the same canonical form, or None."""
+    return db.session.execute(short_url_by_canonical_stmt,
+                              {'canonical_url': canonicalizer.canonicalize(original_url)}).scalar()
+
+
+def link_dict(link_id):
+    row = db.session.execute(link_by_id_stmt, {'link_id': link_id}).mappings().first()
+    return dict(row) if row else None
+
+
+def link_dicts(**flags):
+    """All links matching boolean column flags, e.g. link_dicts(expired=False, deleted=False)."""
+    key = tuple(sorted(flags))
+    stmt = _link_list_stmts.get(key)
+    if stmt is None:
+        stmt = select(*LINK_COLUMNS).where(and_(*(shortlinks.c[name] == bindparam(name) for name in key)))
+        _link_list_stmts[key] = stmt
+    return [dict(row) for row in db.session.execute(stmt, flags).mappings()]
+
+
+# Filters of the /links pages. Plain boolean columns (not IS TRUE) so Postgres can match the
+# partial indexes on deleted/expired links
+LINK_STATUS = {
+    'active': and_(~shortlinks.c.deleted, ~shortlinks.c.expired),
+    'deleted': shortlinks.c.deleted,
+    'expired': shortlinks.c.expired,
+}
+# Columns the links table can be sorted by, each backed by an index
+LINK_ORDER_COLUMNS = {
+    'id': (shortlinks.c.id,),
+    'created_at': (shortlinks.c.created_at, shortlinks.c.id),
+}
+
+
+def capped_count(where, cap):
+    """Number of links matching `where`, but stop counting after cap + 1."""
+    matching = select(literal(1)).select_from(shortlinks).where(where).limit(cap + 1).subquery()
+    return db.session.execute(select(func.count()).select_from(matching)).scalar()
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def link_page(status, start, length, order='id', descending=True, search=None, count_cap=10000):
+    """One page of the links table: (rows, total, filtered).
+
+    Search matches an alias prefix (or the exact id when numeric), so both the filter and the
+    ordering run on indexes and the cost of a page doesn't grow with the number of links.
+    Counts stop at count_cap + 1.
+    """
+    where = LINK_STATUS[status]
+    total = capped_count(where, count_cap)
+    filtered = total
+    if search:
+        matches = [shortlinks.c.short_url.like(escape_like(search) + '%', escape='\\')]
+        # ASCII only: isdigit() is also true for '²' and other digits int() rejects
+        if search.isascii() and search.isdigit() and int(search) <= MAX_LINK_ID:
+            matches.append(shortlinks.c.id == int(search))
+        where = and_(where, or_(*matches))
+        filtered = capped_count(where, count_cap)
+    columns = LINK_ORDER_COLUMNS[order]
+    stmt = (
+        select(*LINK_COLUMNS)
+        .where(where)
+        .order_by(*(column.desc() if descending else column.asc() for column in columns))
+        .offset(start)
+        .limit(length)
+    )
+    rows = [dict(row) for row in db.session.execute(stmt).mappings()]
+    return rows, total, filtered
+
+
+visits = Visit.__table__
+_visit_totals_stmt = (
+    select(visits.c.country, func.count(), func.sum(visits.c.sample_weight))
+    .where(visits.c.short_url_id == bindparam('link_id'))
+    .group_by(visits.c.country)
+)
+
+
+def visit_totals(link_id):
+    """Visits of a link: rows logged, and the estimated total overall and per country.
+
+    A sampled row stands for 1 / the rate it was logged at (its sample_weight), so the
+    estimates are unbiased however the link's rate changed over time.
+    """
+    rows = db.session.execute(_visit_totals_stmt, {'link_id': link_id}).all()
+    return {
+        'logged': sum(count for _, count, _ in rows),
+        'estimated': round(sum(weight for _, _, weight in rows)),
+        'countries': {country: round(weight) for country, _, weight in rows},
+    }
@@ -0,0 +1,38 @@
+import os
+from datetime import datetime as dt
+
+from flask import redirect
+
+# tracked:   every click reaches us (302, no-store), so every visit is logged and counted
+# cacheable: browsers and CDNs may reuse the redirect; clicks served from their cache are not seen
+POLICIES = ('tracked', 'cacheable')
+
+DEFAULT_POLICY = os.environ.get('REDIRECT_POLICY', 'tracked')
+# Upper bound on how long a cached redirect is reused, which is also how long an edit takes to reach clients
+MAX_AGE = int(os.environ.get('REDIRECT_MAX_AGE', 86400))
+# 301 is understood by every cache; 308 also keeps the method for non-GET clients
+PERMANENT_STATUS = int(os.environ.get('REDIRECT_PERMANENT_STATUS', 301))
+
+
+def cache_rules(policy, max_clicks, expiration_date, now=None):
+    """(status code, Cache-Control) for redirecting to a link.
+
+    Only cacheable links with unlimited clicks are ever cached: click-limited links must count
+    every click. Links that never expire get a permanent redirect with MAX_AGE, expiring ones a
+    temporary redirect that is fresh until the expiration date at most.
+    """
+    if (policy or DEFAULT_POLICY) != 'cacheable' or max_clicks != -1:
+        return 302, 'no-store'
+    if expiration_date is None:
+        return PERMANENT_STATUS, f'public, max-age={MAX_AGE}'
+    remaining = int((expiration_date - (now or dt.now())).total_seconds())
+    if remaining <= 0:
+        return 302, 'no-store'
+    return 302, f'public, max-age={min(remaining, MAX_AGE)}'
+
+
+def link_redirect(location, policy, max_clicks, expiration_date):
+    status, cache_control = cache_rules(policy, max_clicks, expiration_date)
+    response = redirect(location, code=status)
+    response.headers['Cache-Control'] = cache_control
+    return response
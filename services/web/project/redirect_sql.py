@@ -0,0 +1,178 @@
+import random
+from collections import namedtuple
+from datetime import datetime as dt
+
+from sqlalchemy import select, update, insert, bindparam, or_, func, text
+
+from .models import db, Visit
+from .dimensions import user_agents, ip_addresses, storable
+from .queries import shortlinks
+from .visit_policy import visit_policy
+
+visits = Visit.__table__
+
+# Why a redirect was refused; None when it was followed
+NOT_FOUND = 'not_found'
+EXPIRED = 'expired'
+USED_UP = 'used_up'
+
+# original_url and redirect_policy are only set when the click was counted; visited is True
+# when the visit was logged (not sampled out)
+RedirectResult = namedtuple('RedirectResult', ['link_id', 'original_url', 'redirect_policy', 'max_clicks',
+                                               'expiration_date', 'refused', 'visited'])
+
+# One statement: the guarded UPDATE counts the click only while the link is live, the visit is
+# inserted for the row it returns if the draw falls within the link's sample rate (see
+# visit_policy.py), and a refused link is marked expired. The guard is evaluated
+# on the locked row, so concurrent clicks can't go past max_clicks. :now is the app's clock, as
+# expiration dates are stored in its local time. A user agent or IP whose id the worker hasn't
+# cached is upserted here, and only when the visit is inserted: 404 scans and sampled-out
+# visits write nothing to the lookup tables. If another transaction inserts the same new value
+# at the same moment, neither the upsert nor the lookup sees it and that one visit is dropped.
+_PG_REDIRECT = text("""
+WITH target AS (
+    SELECT id, expired, expiration_date, max_clicks
+    FROM shortlinks
+    WHERE short_url = :alias
+    LIMIT 1
+), clicked AS (
+    UPDATE shortlinks s
+    SET current_clicks = s.current_clicks + 1, updated_at = now()
+    FROM target
+    WHERE s.id = target.id
+      AND NOT s.expired
+      AND (s.expiration_date IS NULL OR s.expiration_date >= :now)
+      AND (s.max_clicks = -1 OR s.max_clicks > s.current_clicks)
+    RETURNING s.id, s.original_url, s.redirect_policy, s.max_clicks, s.expiration_date,
+              coalesce(s.visit_sample_rate, :sample_rate) AS sample_rate
+), logged AS (
+    SELECT id, sample_rate FROM clicked
+    WHERE CAST(:country AS varchar) IS NOT NULL AND :draw < sample_rate
+), new_ip AS (
+    INSERT INTO ip_addresses (value)
+    SELECT :ip_address FROM logged WHERE CAST(:ip_address_id AS integer) IS NULL
+    ON CONFLICT (value) DO NOTHING
+    RETURNING id
+), new_user_agent AS (
+    INSERT INTO user_agents (value)
+    SELECT :user_agent FROM logged WHERE CAST(:user_agent_id AS integer) IS NULL
+    ON CONFLICT (value) DO NOTHING
+    RETURNING id
+), visitor AS (
+    SELECT logged.id, logged.sample_rate,
+           coalesce(CAST(:ip_address_id AS integer), (SELECT id FROM new_ip),
+                    (SELECT id FROM ip_addresses WHERE value = :ip_address)) AS ip_address_id,
+           coalesce(CAST(:user_agent_id AS integer), (SELECT id FROM new_user_agent),
+                    (SELECT id FROM user_agents WHERE value = :user_agent)) AS user_agent_id
+    FROM logged
+), visit AS (
+    INSERT INTO visits (short_url_id, ip_address_id, user_agent_id, country, sample_weight, created_at, updated_at)
+    SELECT id, ip_address_id, user_agent_id, :country, 1 / least(sample_rate, 1), now(), now()
+    FROM visitor
+    WHERE ip_address_id IS NOT NULL AND user_agent_id IS NOT NULL
+    RETURNING ip_address_id, user_agent_id
+), refused AS (
+    UPDATE shortlinks s
+    SET expired = true, updated_at = now()
+    FROM target
+    WHERE s.id = target.id AND NOT s.expired AND NOT EXISTS (SELECT 1 FROM clicked)
+)
+SELECT target.id, clicked.original_url, clicked.redirect_policy,
+       coalesce(clicked.max_clicks, target.max_clicks),
+       CASE WHEN clicked.id IS NOT NULL THEN clicked.expiration_date ELSE target.expiration_date END,
+       CASE WHEN clicked.id IS NOT NULL THEN NULL
+            WHEN target.expired OR target.expiration_date < :now THEN 'expired'
+            ELSE 'used_up' END,
+       (SELECT ip_address_id FROM visit), (SELECT user_agent_id FROM visit)
+FROM target LEFT JOIN clicked ON clicked.id = target.id
+""")
+
+# The same steps as separate statements in one transaction, for databases without
+# data-modifying CTEs. The guard is in the UPDATE, not in Python, so it is race-free as well.
+_target_stmt = (
+    select(shortlinks.c.id, shortlinks.c.original_url, shortlinks.c.redirect_policy, shortlinks.c.expired,
+           shortlinks.c.expiration_date, shortlinks.c.max_clicks, shortlinks.c.visit_sample_rate)
+    .where(shortlinks.c.short_url == bindparam('alias'))
+    .limit(1)
+)
+_click_stmt = (
+    update(shortlinks)
+    .where(shortlinks.c.id == bindparam('link_id'),
+           shortlinks.c.expired.is_(False),
+           or_(shortlinks.c.expiration_date.is_(None), shortlinks.c.expiration_date >= bindparam('now')),
+           or_(shortlinks.c.max_clicks == -1, shortlinks.c.max_clicks > shortlinks.c.current_clicks))
+    .values(current_clicks=shortlinks.c.current_clicks + 1, updated_at=func.now())
+)
+_expire_stmt = (
+    update(shortlinks)
+    .where(shortlinks.c.id == bindparam('link_id'), shortlinks.c.expired.is_(False))
+    .values(expired=True, updated_at=func.now())
+)
+_visit_stmt = insert(visits).values(created_at=func.now(), updated_at=func.now())
+
+
+def follow(alias, visit=None, now=None):
+    """Count a click on `alias` and log its visit, or find out why the link can't be followed.
+
+    `visit` is (ip_address, user_agent, country), or None to count the click only; it is
+    logged at the link's sample rate (visit_policy.VisitPolicy), and the user agent and IP are
+    only looked up or stored when it is. Returns
+    a RedirectResult; `refused` is NOT_FOUND, EXPIRED or USED_UP when nothing was counted, and
+    an expired or used-up link is marked expired on the way. On Postgres this is one statement
+    sent in autocommit mode, so a redirect costs a single round trip.
+    """
+    now = now or dt.now()
+    if db.engine.dialect.name == 'postgresql':
+        return _follow_pg(alias, visit, now)
+    return _follow_portable(alias, visit, now)
+
+
+def _follow_pg(alias, visit, now):
+    ip_address, user_agent, country = storable(visit) or (None, None, None)
+    params = {'alias': alias, 'now': now, 'ip_address': ip_address, 'user_agent': user_agent,
+              'ip_address_id': ip_addresses.cached(ip_address) if country else None,
+              'user_agent_id': user_agents.cached(user_agent) if country else None,
+              'country': country, 'sample_rate': visit_policy.sample_rate, 'draw': random.random()}
+    with db.engine.connect() as conn:
+        # Autocommit on the driver connection itself: psycopg2 then sends neither BEGIN nor
+        # COMMIT. isolation_level='AUTOCOMMIT' would also work, but resetting it when the
+        # connection goes back to the pool costs another round trip.
+        dbapi_connection = conn.connection.dbapi_connection
+        dbapi_connection.autocommit = True
+        try:
+            row = conn.execute(_PG_REDIRECT, params).first()
+        finally:
+            dbapi_connection.autocommit = False
+    if row is None:
+        return RedirectResult(None, None, None, None, None, NOT_FOUND, False)
+    *result, ip_address_id, user_agent_id = row
+    if ip_address_id is not None:
+        ip_addresses.remember(ip_address, ip_address_id)
+        user_agents.remember(user_agent, user_agent_id)
+    return RedirectResult(*result, ip_address_id is not None)
+
+
+def _follow_portable(alias, visit, now):
+    session = db.session
+    target = session.execute(_target_stmt, {'alias': alias}).first()
+    if target is None:
+        session.commit()
+        return RedirectResult(None, None, None, None, None, NOT_FOUND, False)
+    visit = storable(visit)
+    weight = visit_policy.weight(target.visit_sample_rate) if visit is not None else None
+    if weight is not None:
+        # Only for visits that are logged; looked up before the UPDATE, as a miss commits on its own connection
+        ip_address, user_agent, country = visit
+        visitor = {'ip_address_id': ip_addresses.id_for(ip_address), 'user_agent_id': user_agents.id_for(user_agent),
+                   'country': country, 'sample_weight': weight}
+    if session.execute(_click_stmt, {'link_id': target.id, 'now': now}).rowcount == 1:
+        if weight is not None:
+            session.execute(_visit_stmt, {'short_url_id': target.id, **visitor})
+        session.commit()
+        return RedirectResult(target.id, target.original_url, target.redirect_policy, target.max_clicks,
+                              target.expiration_date, None, weight is not None)
+    session.execute(_expire_stmt, {'link_id': target.id})
+    session.commit()
+    expired = target.expired or (target.expiration_date is not None and target.expiration_date < now)
+    return RedirectResult(target.id, None, None, target.max_clicks, target.expiration_date,
+                          EXPIRED if expired else USED_UP, False)
@@ -0,0 +1,176 @@
+import hashlib
+import threading
+from bisect import bisect
+from collections import defaultdict
+
+import redis
+
+
+def key_hash(key):
+    """64-bit hash of a key or ring point; stable across processes, unlike hash()."""
+    if isinstance(key, str):
+        key = key.encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big')
+
+
+def hash_tag(key):
+    """Only the part inside {...} is hashed when present, as in Redis Cluster, so related keys can share a node."""
+    start = key.find('{')
+    if start != -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+class HashRing:
+    """Consistent hashing with virtual nodes.
+
+    Every node owns `vnodes` points on a 64-bit ring and a key belongs to the first point at or
+    after its hash. Adding or removing a node only moves the keys between its points and their
+    neighbours, about 1/N of the keyspace, and more virtual nodes even out the share of each node.
+    """
+
+    def __init__(self, nodes=(), vnodes=160):
+        self.vnodes = vnodes
+        # (sorted points, owner of each point), swapped as a whole so readers never see half a change
+        self._ring = ((), ())
+        self._lock = threading.Lock()
+        for node in nodes:
+            self.add_node(node)
+
+    @property
+    def nodes(self):
+        return sorted(set(self._ring[1]))
+
+    def _rebuild(self, points):
+        ordered = sorted(points)
+        self._ring = (tuple(ordered), tuple(points[p] for p in ordered))
+
+    def add_node(self, node):
+        with self._lock:
+            points = dict(zip(*self._ring))
+            for i in range(self.vnodes):
+                points[key_hash(f"{node}#{i}")] = node
+            self._rebuild(points)
+
+    def remove_node(self, node):
+        with self._lock:
+            self._rebuild({point: owner for point, owner in zip(*self._ring) if owner != node})
+
+    def node_for(self, key):
+        points, owners = self._ring
+        if not points:
+            raise LookupError("The hash ring has no nodes")
+        return owners[bisect(points, key_hash(hash_tag(key))) % len(points)]
+
+
+class ShardedRedis:
+    """Redis client that spreads keys over several nodes with a HashRing.
+
+    Single-key commands are routed on their first argument (the key), so it is used like a
+    redis.Redis for everything the cache does. Multi-key reads and deletes are split per node;
+    commands without a key go through `for_each`.
+    """
+
+    def __init__(self, clients, vnodes=160):
+        self.clients = dict(clients)
+        self.ring = HashRing(self.clients, vnodes)
+
+    @classmethod
+    def from_nodes(cls, nodes, vnodes=160, client_class=redis.Redis, **kwargs):
+        """`nodes` is a list of "host:port"; each one is also its name on the ring."""
+        clients = {}
+        for node in nodes:
+            host, _, port = node.partition(':')
+            clients[node] = client_class(host=host, port=int(port or 6379), **kwargs)
+        return cls(clients, vnodes)
+
+    def client_for(self, key):
+        return self.clients[self.ring.node_for(key)]
+
+    def add_node(self, name, client):
+        # Keys that move to the new node are cache misses until they are set again there
+        self.clients[name] = client
+        self.ring.add_node(name)
+
+    def remove_node(self, name):
+        self.ring.remove_node(name)
+        return self.clients.pop(name)
+
+    def group(self, keys):
+        """{node: [(position, key)]} for spreading a batch of keys over the shards."""
+        groups = defaultdict(list)
+        for position, key in enumerate(keys):
+            groups[self.ring.node_for(key)].append((position, key))
+        return groups
+
+    def mget(self, keys, *args):
+        keys = list(keys) + list(args)
+        values = [None] * len(keys)
+        for node, items in self.group(keys).items():
+            for (position, _), value in zip(items, self.clients[node].mget([key for _, key in items])):
+                values[position] = value
+        return values
+
+    def delete(self, *keys):
+        return sum(self.clients[node].delete(*[key for _, key in items]) for node, items in self.group(keys).items())
+
+    def exists(self, *keys):
+        return sum(self.clients[node].exists(*[key for _, key in items]) for node, items in self.group(keys).items())
+
+    def for_each(self, command, *args, **kwargs):
+        """Run a keyless command (ping, info, flushdb...) on every node: {node: result}."""
+        return {node: getattr(client, command)(*args, **kwargs) for node, client in self.clients.items()}
+
+    def pipeline(self, transaction=False):
+        return ShardedPipeline(self)
+
+    def __getattr__(self, command):
+        def routed(key, *args, **kwargs):
+            return getattr(self.client_for(key), command)(key, *args, **kwargs)
+        return routed
+
+
+class ShardedPipeline:
+    """Buffers commands per node and sends one pipeline per shard on execute().
+
+    Results come back in the order the commands were queued. There is no transaction across
+    shards; each shard's batch runs without MULTI/EXEC, like pipeline(transaction=False).
+    """
+
+    def __init__(self, sharded):
+        self.sharded = sharded
+        self._queued = defaultdict(list)
+        self._count = 0
+
+    def __getattr__(self, command):
+        def queue(key, *args, **kwargs):
+            self._queued[self.sharded.ring.node_for(key)].append((self._count, command, key, args, kwargs))
+            self._count += 1
+            return self
+        return queue
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+    def reset(self):
+        self._queued = defaultdict(list)
+        self._count = 0
+
+    def execute(self, raise_on_error=True):
+        results = [None] * self._count
+        queued, self._queued, self._count = self._queued, defaultdict(list), 0
+        for node, commands in queued.items():
+            pipe = self.sharded.clients[node].pipeline(transaction=False)
+            for _, command, key, args, kwargs in commands:
+                getattr(pipe, command)(key, *args, **kwargs)
+            for (position, *_), result in zip(commands, pipe.execute(raise_on_error=raise_on_error)):
+                results[position] = result
+        return results
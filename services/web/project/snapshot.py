@@ -0,0 +1,390 @@
+"""Read-only, memory-mapped snapshot of the alias -> URL table, so a redirect needs no network I/O.
+
+`manage.py build_snapshot` compiles the links that can be served without touching the
+database (unlimited clicks, no expiration date, not expired or deleted) into one file:
+
+    header   magic, version, byte-order check, link count, build time, change watermark
+    hashes   count x u64, sorted 64-bit hashes of the aliases (sharding.key_hash)
+    offsets  count x u32, where each hash's record starts in the records section
+    records  link id (u32), policy code (u8), visit sample rate (f32, NaN for none), alias length
+             (u16), URL length (u32), alias, URL
+
+A lookup is a binary search over the hashes and one record read, all in pages the kernel
+shares between every worker mapping the file. The file is replaced atomically (os.replace)
+and workers notice the new inode on their next sync.
+
+Changes after the build reach the workers through the link_changes table, which a trigger on
+shortlinks fills with the aliases of inserted, deleted and edited links. Every worker polls it
+past the snapshot's watermark and keeps the current state of those aliases in a small overlay;
+an alias that can no longer be served from memory is shadowed there and goes to the database
+again (redirect_sql.follow). Clicks and visits on snapshot hits are buffered and written in
+batches by the same background thread.
+"""
+import math
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict, namedtuple
+from datetime import datetime as dt
+
+import sqlalchemy.exc
+from sqlalchemy import select, update, insert, delete, bindparam, func
+
+from .dimensions import user_agents, ip_addresses, storable
+from .models import db, Visit, LinkChange
+from .queries import shortlinks
+from .sharding import key_hash
+
+MAGIC = b'RSNP'
+VERSION = 2
+# Arrays are written in the builder's byte order; a reader on another one refuses the file
+BYTE_ORDER = 0x01020304
+HEADER = struct.Struct('=4sHHIIQQ')
+RECORD = struct.Struct('=IBfHI')
+
+POLICY_CODES = {None: 0, 'tracked': 1, 'cacheable': 2}
+POLICY_NAMES = {code: policy for policy, code in POLICY_CODES.items()}
+
+# What the redirect needs to serve a link without reading its row; max_clicks is always -1 and expiration_date None
+SnapshotLink = namedtuple('SnapshotLink', ['id', 'short_url', 'original_url', 'redirect_policy', 'visit_sample_rate'])
+
+visits = Visit.__table__
+link_changes = LinkChange.__table__
+
+# Aliases held by more than one row are left to the database, which picks one of them
+_duplicate_aliases = (
+    select(shortlinks.c.short_url)
+    .group_by(shortlinks.c.short_url)
+    .having(func.count() > 1)
+)
+_servable = (
+    shortlinks.c.max_clicks == -1,
+    shortlinks.c.expiration_date.is_(None),
+    shortlinks.c.expired.is_(False),
+    shortlinks.c.deleted.is_(False),
+)
+_snapshot_links_stmt = (
+    select(shortlinks.c.id, shortlinks.c.short_url, shortlinks.c.original_url, shortlinks.c.redirect_policy,
+           shortlinks.c.visit_sample_rate)
+    .where(*_servable, shortlinks.c.short_url.not_in(_duplicate_aliases.scalar_subquery()))
+    .execution_options(yield_per=10000)
+)
+_watermark_stmt = select(func.coalesce(func.max(link_changes.c.id), 0))
+_changes_stmt = (
+    select(link_changes.c.id, link_changes.c.short_url)
+    .where(link_changes.c.id > bindparam('after'))
+    .order_by(link_changes.c.id)
+    .limit(bindparam('limit'))
+)
+_changed_links_stmt = (
+    select(shortlinks.c.id, shortlinks.c.short_url, shortlinks.c.original_url, shortlinks.c.redirect_policy,
+           shortlinks.c.visit_sample_rate, shortlinks.c.max_clicks, shortlinks.c.expiration_date,
+           shortlinks.c.expired, shortlinks.c.deleted)
+    .where(shortlinks.c.short_url.in_(bindparam('aliases', expanding=True)))
+)
+_existing_links_stmt = select(shortlinks.c.id).where(shortlinks.c.id.in_(bindparam('ids', expanding=True)))
+_add_clicks_stmt = (
+    update(shortlinks)
+    .where(shortlinks.c.id.in_(bindparam('ids', expanding=True)))
+    .values(current_clicks=shortlinks.c.current_clicks + bindparam('clicks'), updated_at=func.now())
+)
+
+
+def build(engine, path):
+    """Write the snapshot of the servable links to `path`; returns (links, watermark).
+
+    The links and the change watermark are read in one REPEATABLE READ transaction, so every
+    change after the watermark is one the snapshot hasn't seen. The file is written next to
+    `path` and moved over it, and the changes older than the snapshot it replaces are pruned:
+    by then every worker has had a whole rebuild interval to move past them.
+    """
+    previous = _read_watermark(path)
+    hashes = array('Q')
+    offsets = array('I')
+    with tempfile.TemporaryFile() as records, engine.connect() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execution_options(isolation_level='REPEATABLE READ')
+        with conn.begin():
+            watermark = conn.execute(_watermark_stmt).scalar()
+            size = 0
+            for link_id, alias, url, policy, sample_rate in conn.execute(_snapshot_links_stmt):
+                if policy not in POLICY_CODES:
+                    continue
+                alias, url = alias.encode(), url.encode()
+                sample_rate = math.nan if sample_rate is None else sample_rate
+                record = RECORD.pack(link_id, POLICY_CODES[policy], sample_rate, len(alias), len(url)) + alias + url
+                if size + len(record) > 0xFFFFFFFF:
+                    raise ValueError("Snapshot records would exceed 4 GiB")
+                hashes.append(key_hash(alias))
+                offsets.append(size)
+                records.write(record)
+                size += len(record)
+        order = sorted(range(len(hashes)), key=hashes.__getitem__)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(HEADER.pack(MAGIC, VERSION, 0, BYTE_ORDER, len(hashes), int(time.time()), watermark))
+                out.write(array('Q', (hashes[i] for i in order)).tobytes())
+                out.write(array('I', (offsets[i] for i in order)).tobytes())
+                records.seek(0)
+                shutil.copyfileobj(records, out)
+                out.flush()
+                os.fsync(out.fileno())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    if previous:
+        with engine.begin() as conn:
+            conn.execute(delete(link_changes).where(link_changes.c.id <= min(previous, watermark)))
+    return len(hashes), watermark
+
+
+def _read_watermark(path):
+    try:
+        return Snapshot(path).watermark
+    except (OSError, ValueError):
+        return None
+
+
+class Snapshot:
+    """One mapped snapshot file. The mapping stays valid after the file is replaced or removed."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, order, count, built_at, watermark = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} redirect snapshot")
+        if order != BYTE_ORDER:
+            raise ValueError(f"{path} was built on a machine with another byte order ({sys.byteorder} here)")
+        self.count = count
+        self.built_at = built_at
+        self.watermark = watermark
+        view = memoryview(self._map)
+        hashes_end = HEADER.size + count * 8
+        self._hashes = view[HEADER.size:hashes_end].cast('Q')
+        self._offsets = view[hashes_end:hashes_end + count * 4].cast('I')
+        self._records = hashes_end + count * 4
+
+    def get(self, alias):
+        encoded = alias.encode()
+        key = key_hash(encoded)
+        hashes = self._hashes
+        i = bisect_left(hashes, key)
+        while i < self.count and hashes[i] == key:
+            start = self._records + self._offsets[i]
+            link_id, policy, sample_rate, alias_length, url_length = RECORD.unpack_from(self._map, start)
+            start += RECORD.size
+            if self._map[start:start + alias_length] == encoded:
+                start += alias_length
+                return SnapshotLink(link_id, alias, self._map[start:start + url_length].decode(), POLICY_NAMES[policy],
+                                    None if math.isnan(sample_rate) else round(sample_rate, 6))
+            i += 1
+        return None
+
+
+class RedirectSnapshot:
+    """Per-worker view of the snapshot plus the overlay of changes made since it was built.
+
+    lookup() returns a SnapshotLink, or None when the redirect has to go to the database. A
+    background thread per worker process swaps in a rebuilt file, applies new changes to the
+    overlay and writes the buffered clicks and visits, every `sync_interval` seconds.
+    """
+
+    # Change ids are handed out before commit, so a missing id may still show up; after this
+    # many seconds it is taken for a rolled-back change and skipped
+    GAP_SECONDS = 10
+
+    def __init__(self, path, sync_interval=1.0, change_batch=1000, max_buffered=100000):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.change_batch = change_batch
+        self.max_buffered = max_buffered
+        self.app = None
+        self.enabled = False
+        # (snapshot, overlay) swapped as one, so a lookup never pairs a file with another file's overlay.
+        # overlay: alias -> SnapshotLink, or None for an alias that has to go to the database
+        self._state = (None, {})
+        self._watermark = 0
+        self._gaps = {}
+        self._clicks = Counter()
+        self._visits = []
+        self._lock = threading.Lock()
+        self._sync_pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = bool(self.path)
+
+    def lookup(self, alias):
+        if not self.enabled:
+            return None
+        # Threads don't survive a fork, so start one per worker process
+        if self._sync_pid != os.getpid():
+            self._start_sync()
+        snapshot, overlay = self._state
+        if alias in overlay:
+            return overlay[alias]
+        return snapshot.get(alias) if snapshot is not None else None
+
+    def click(self, link, visitor, sample_weight=1.0):
+        """Count a click on a snapshot link; `visitor` is (ip, user agent, country), or None to log no visit.
+
+        Returns whether the visit was buffered: not if its user agent or IP can't be stored, as
+        on the database path, nor when the buffer is full.
+        """
+        visitor = storable(visitor)
+        with self._lock:
+            self._clicks[link.id] += 1
+            if visitor is None or len(self._visits) >= self.max_buffered:
+                return False
+            self._visits.append((link.id, *visitor, sample_weight, dt.now()))
+            return True
+
+    def _start_sync(self):
+        with self._lock:
+            if self._sync_pid == os.getpid():
+                return
+            self._sync_pid = os.getpid()
+            # Clicks inherited from the parent are written by the parent
+            self._clicks = Counter()
+            self._visits = []
+        # Mapped right away so the worker's first redirects already hit it
+        self._reload()
+        threading.Thread(target=self._sync_loop, name="redirect-snapshot", daemon=True).start()
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+            except Exception:
+                # Lookups keep using what they have; clicks and changes are retried next round
+                self.app.logger.exception("Redirect snapshot sync failed")
+
+    def sync(self):
+        self._reload()
+        with self.app.app_context():
+            self.flush()
+            if self._state[0] is not None:
+                while self.apply_changes():
+                    pass
+
+    def _reload(self):
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            # Not built yet, or being replaced: keep serving the mapped one
+            return
+        snapshot = self._state[0]
+        if snapshot is not None and snapshot.inode == inode:
+            return
+        try:
+            snapshot = Snapshot(self.path)
+        except (OSError, ValueError):
+            self.app.logger.exception("Can't map redirect snapshot %s", self.path)
+            return
+        self._state = (snapshot, {})
+        self._watermark = snapshot.watermark
+        self._gaps = {}
+
+    def apply_changes(self):
+        """Bring the overlay up to date with link_changes; returns True if more may be read right away.
+
+        That is a full batch that moved the watermark. A gap holds the watermark in place for up
+        to GAP_SECONDS, and reading the same batch again before then would find nothing new.
+        """
+        snapshot, overlay = self._state
+        watermark = self._watermark
+        with db.engine.connect() as conn:
+            changes = conn.execute(_changes_stmt, {'after': watermark, 'limit': self.change_batch}).all()
+            if not changes:
+                return False
+            aliases = {alias for _, alias in changes}
+            rows = defaultdict(list)
+            for row in conn.execute(_changed_links_stmt, {'aliases': list(aliases)}):
+                rows[row.short_url].append(row)
+        updated = dict(overlay)
+        for alias in aliases:
+            found = rows.get(alias, ())
+            link = found[0] if len(found) == 1 else None
+            if link is not None and link.max_clicks == -1 and link.expiration_date is None \
+                    and not link.expired and not link.deleted and link.redirect_policy in POLICY_CODES:
+                updated[alias] = SnapshotLink(link.id, alias, link.original_url, link.redirect_policy,
+                                              link.visit_sample_rate)
+            else:
+                updated[alias] = None
+        self._state = (snapshot, updated)
+        self._advance(change_id for change_id, _ in changes)
+        return len(changes) == self.change_batch and self._watermark > watermark
+
+    def _advance(self, change_ids):
+        """Move the watermark up to the last change id with no unresolved gap before it."""
+        now = time.monotonic()
+        expected = self._watermark + 1
+        for change_id in change_ids:
+            if change_id != expected:
+                if now - self._gaps.setdefault(expected, now) < self.GAP_SECONDS:
+                    break
+            expected = change_id + 1
+        self._watermark = expected - 1
+        self._gaps = {start: seen for start, seen in self._gaps.items() if start > self._watermark}
+
+    def flush(self):
+        with self._lock:
+            clicks, self._clicks = self._clicks, Counter()
+            buffered, self._visits = self._visits, []
+        if not clicks:
+            return
+        try:
+            # Ids first: a miss commits on its own connection, which must not wait for the
+            # click UPDATEs' row locks below (as in redirect_sql._follow_portable)
+            rows = []
+            dropped = 0
+            for link_id, ip_address, user_agent, country, sample_weight, created_at in buffered:
+                try:
+                    rows.append({'short_url_id': link_id, 'ip_address_id': ip_addresses.id_for(ip_address),
+                                 'user_agent_id': user_agents.id_for(user_agent), 'country': country,
+                                 'sample_weight': sample_weight, 'created_at': created_at,
+                                 'updated_at': created_at})
+                except (sqlalchemy.exc.DataError, sqlalchemy.exc.IntegrityError):
+                    # This visitor can never be stored; the others still are
+                    dropped += 1
+            if dropped:
+                self.app.logger.warning("Redirect snapshot dropped %d visit(s) it could not store", dropped)
+            with db.engine.begin() as conn:
+                # Links deleted since their click have nowhere to log it
+                existing = set(conn.execute(_existing_links_stmt, {'ids': list(clicks)}).scalars())
+                # One UPDATE per distinct click count rather than one per link
+                by_count = defaultdict(list)
+                for link_id, count in clicks.items():
+                    by_count[count].append(link_id)
+                for count, ids in by_count.items():
+                    conn.execute(_add_clicks_stmt, {'ids': ids, 'clicks': count})
+                rows = [row for row in rows if row['short_url_id'] in existing]
+                if rows:
+                    conn.execute(insert(visits), rows)
+        except Exception:
+            # Put them back so they are not lost
+            with self._lock:
+                self._clicks.update(clicks)
+                self._visits[:0] = buffered[:max(0, self.max_buffered - len(self._visits))]
+            raise
+
+
+redirect_snapshot = RedirectSnapshot(
+    os.environ.get('REDIRECT_SNAPSHOT'),
+    float(os.environ.get('SNAPSHOT_SYNC_SECONDS', 1)),
+)
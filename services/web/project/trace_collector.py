@@ -0,0 +1,94 @@
+"""A stand-in trace collector, and a report of where the kept traces spent their time.
+
+The collector accepts what tracing.HttpExporter sends (POST {"spans": [...]}) and appends the
+spans to a JSON lines file, in the same format as the file exporter. The report reads either file.
+"""
+import json
+import statistics
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Span name prefix -> category; a span's own time (minus its children) goes to its category,
+# and whatever no child span covers is the application's
+CATEGORIES = (('pool', 'db.pool.'), ('db', 'db '), ('redis', 'redis '), ('json', 'json.'), ('render', 'render '))
+COLUMNS = ('pool', 'db', 'redis', 'json', 'render', 'app')
+
+
+def serve(port, out):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                spans = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))['spans']
+            except (ValueError, KeyError, TypeError):
+                self.send_error(400, 'Expected {"spans": [...]}')
+                return
+            with lock, open(out, 'a') as f:
+                f.writelines(json.dumps(span) + '\n' for span in spans)
+            self.send_response(202)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    print(f"Collecting spans on :{port} into {out}")
+    server.serve_forever()
+
+
+def read_traces(path):
+    traces = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                span = json.loads(line)
+                traces[span['trace_id']].append(span)
+    return traces
+
+
+def category(name):
+    for label, prefix in CATEGORIES:
+        if name.startswith(prefix):
+            return label
+    return 'app'
+
+
+def breakdown(spans):
+    """(root span, {category: ms}) for one trace; the categories add up to the root's duration."""
+    ids = {span['span_id'] for span in spans}
+    children = defaultdict(float)
+    for span in spans:
+        children[span['parent_id']] += span['duration_ms']
+    root = next(span for span in spans if span['parent_id'] not in ids)
+    totals = dict.fromkeys(COLUMNS, 0.0)
+    for span in spans:
+        totals[category(span['name'])] += max(0.0, span['duration_ms'] - children[span['span_id']])
+    return root, totals
+
+
+def report(path, top=10, out=print):
+    rows = [breakdown(spans) for spans in read_traces(path).values()]
+    if not rows:
+        out(f"No spans in {path}")
+        return
+    by_reason = defaultdict(list)
+    for root, totals in rows:
+        by_reason[root['attributes'].get('trace.kept', '?')].append((root, totals))
+
+    header = f"{'':<34}{'traces':>8}{'p50 ms':>9}{'p99 ms':>9}" + ''.join(f"{c + ' ms':>10}" for c in COLUMNS)
+    out("Mean time per category, by why the trace was kept ('sampled' is the unbiased baseline):")
+    out(header)
+    for reason, group in sorted(by_reason.items()):
+        durations = [root['duration_ms'] for root, _ in group]
+        quantiles = statistics.quantiles(durations, n=100) if len(durations) > 1 else durations * 99
+        means = ''.join(f"{statistics.fmean(totals[c] for _, totals in group):>10.2f}" for c in COLUMNS)
+        out(f"{reason:<34}{len(group):>8}{quantiles[49]:>9.1f}{quantiles[98]:>9.1f}{means}")
+
+    out(f"\nSlowest {top}:")
+    out(f"{'trace_id':<34}{'name':<26}{'ms':>8}" + ''.join(f"{c:>10}" for c in COLUMNS))
+    for root, totals in sorted(rows, key=lambda row: -row[0]['duration_ms'])[:top]:
+        columns = ''.join(f"{totals[c]:>10.2f}" for c in COLUMNS)
+        out(f"{root['trace_id']:<34}{root['name'][:25]:<26}{root['duration_ms']:>8.1f}{columns}")
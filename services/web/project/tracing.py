@@ -0,0 +1,414 @@
+"""Request tracing: where a slow request spent its time.
+
+With TRACING=true every request gets a trace. It holds a root span for the request and child
+spans for each SQL statement, connection pool checkout, Redis command or pipeline, JSON
+serialization and template render. An incoming W3C `traceparent` header continues the
+caller's trace. The current span lives in a context variable, so spans nest per request thread.
+
+Sampling happens at the tail: the spans of a request are buffered until it ends. Then the trace
+is kept if it was slow (TRACE_SLOW_MS), failed (5xx or an exception), was sampled by the caller,
+or won the TRACE_SAMPLE_RATE draw; otherwise it is discarded. Kept traces go through a bounded
+queue to a background thread, which appends them to TRACE_EXPORT. That is a JSON lines file,
+one span per line, or an http:// URL such as the stand-in collector (manage.py trace_collector).
+`manage.py trace_report` breaks the kept traces down by where their time went.
+"""
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import redis
+import redis.client
+from flask import request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from werkzeug.wsgi import ClosingIterator
+
+from .models import db
+
+# version-trace_id-parent_id-flags, https://www.w3.org/TR/trace-context/
+TRACEPARENT = re.compile(r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+SAMPLED_FLAG = 0x01
+STATEMENT_CHARS = 500
+
+_current = ContextVar('trace_span', default=None)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def parse_traceparent(header):
+    """(trace_id, parent span id, sampled) from a traceparent header, or None if it is missing or invalid."""
+    match = TRACEPARENT.match((header or '').strip().lower())
+    if not match:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if version == 'ff' or trace_id == '0' * 32 or parent_id == '0' * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & SAMPLED_FLAG)
+
+
+class Trace:
+    """The spans of one request, buffered until it ends and the tracer decides whether to keep them."""
+
+    __slots__ = ('trace_id', 'remote_parent_id', 'parent_sampled', 'spans', 'dropped')
+
+    def __init__(self, trace_id, remote_parent_id=None, parent_sampled=False):
+        self.trace_id = trace_id
+        self.remote_parent_id = remote_parent_id
+        self.parent_sampled = parent_sampled
+        self.spans = []
+        self.dropped = 0
+
+
+class Span:
+    __slots__ = ('trace', 'parent', 'name', 'span_id', 'attributes', 'error', 'start_ns', 'duration_ns', '_started')
+
+    def __init__(self, trace, parent, name, attributes):
+        self.trace = trace
+        self.parent = parent
+        self.name = name
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.attributes = attributes
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.duration_ns = None
+        self._started = time.perf_counter_ns()
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent.span_id if self.parent else self.trace.remote_parent_id,
+            'name': self.name,
+            'start': self.start_ns / 1e9,
+            'duration_ms': round(self.duration_ns / 1e6, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class FileExporter:
+    """Appends spans as JSON lines. Each batch is one write to an O_APPEND file, so workers can share it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def export(self, spans):
+        if self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        os.write(self._fd, ''.join(json.dumps(span, default=str) + '\n' for span in spans).encode())
+
+
+class HttpExporter:
+    """POSTs {"spans": [...]} to a collector."""
+
+    def __init__(self, url, timeout=2):
+        self.url = url
+        self.timeout = timeout
+
+    def export(self, spans):
+        body = json.dumps({'spans': spans}, default=str).encode()
+        req = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(req, timeout=self.timeout).close()
+
+
+def exporter_for(target):
+    if target.startswith(('http://', 'https://')):
+        return HttpExporter(target)
+    return FileExporter(target)
+
+
+class Tracer:
+    """Creates spans inside traced requests and exports the traces worth keeping.
+
+    Outside a request (background threads, CLI commands) there is no current trace, and
+    `span()` does nothing. A trace keeps at most `max_spans` spans; the rest are counted on
+    the root span. When the export queue is full, whole traces are dropped and counted
+    rather than blocking the request.
+    """
+
+    def __init__(self, enabled=False, export='traces/spans.jsonl', sample_rate=0.01, slow_ms=100.0,
+                 max_spans=500, queue_size=1000, batch_size=100):
+        self.enabled = enabled
+        self.export_target = export
+        self.sample_rate = sample_rate
+        self.slow_ns = int(slow_ms * 1e6)
+        self.max_spans = max_spans
+        self.batch_size = batch_size
+        self.kept = 0
+        self.discarded = 0
+        self.dropped = 0
+        self.export_errors = 0
+        self._exporter = None
+        self._queue = queue.Queue(queue_size)
+        self._exporter_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Trace every request of the app, its engines' statements and its JSON and template rendering.
+
+        Call after the blueprints are registered and app.json is set. Pool checkouts and Redis
+        commands are traced by the classes the pool and the clients are built with
+        (TracedQueuePool, redis_class()).
+        """
+        app.wsgi_app = TracingMiddleware(self, app.wsgi_app)
+        app.before_request(self._name_request)
+        app.json = TracedJSONProvider(self, app.json)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+        with app.app_context():
+            for engine in db.engines.values():
+                self.instrument_engine(engine)
+
+    def instrument_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    # Spans
+
+    def start(self, name, **attributes):
+        """Open a child of the current span and make it current; None outside a trace."""
+        parent = _current.get()
+        if parent is None:
+            return None
+        trace = parent.trace
+        if len(trace.spans) >= self.max_spans:
+            trace.dropped += 1
+            return None
+        span = Span(trace, parent, name, attributes)
+        trace.spans.append(span)
+        _current.set(span)
+        return span
+
+    def finish(self, span, error=None):
+        if span is None:
+            return
+        span.duration_ns = time.perf_counter_ns() - span._started
+        if error is not None:
+            span.error = f'{type(error).__name__}: {error}'
+        _current.set(span.parent)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = self.start(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.finish(span, e)
+            raise
+        self.finish(span)
+
+    def start_trace(self, name, traceparent=None, **attributes):
+        """Open the root span of a request, continuing the caller's trace if `traceparent` is valid."""
+        parent = parse_traceparent(traceparent)
+        if parent:
+            trace = Trace(*parent)
+        else:
+            trace = Trace(f'{random.getrandbits(128):032x}')
+        root = Span(trace, None, name, attributes)
+        trace.spans.append(root)
+        _current.set(root)
+        return root
+
+    def end_trace(self, root, error=None):
+        """Close the request's trace and queue it for export if it is kept."""
+        if root.duration_ns is not None:
+            return
+        self.finish(root, error)
+        trace = root.trace
+        status = root.attributes.get('http.status_code', 0)
+        if root.error is not None or status >= 500:
+            reason = 'error'
+        elif root.duration_ns >= self.slow_ns:
+            reason = 'slow'
+        elif trace.parent_sampled:
+            reason = 'parent'
+        elif random.random() < self.sample_rate:
+            reason = 'sampled'
+        else:
+            self.discarded += 1
+            return
+        root.attributes['trace.kept'] = reason
+        root.attributes['pid'] = os.getpid()
+        if trace.dropped:
+            root.attributes['trace.dropped_spans'] = trace.dropped
+        # A span left open (a template that raised, say) ends with its request
+        for span in trace.spans:
+            if span.duration_ns is None:
+                span.duration_ns = time.perf_counter_ns() - span._started
+                span.error = span.error or 'unfinished'
+        self.kept += 1
+        if self._exporter_pid != os.getpid():
+            self._start_exporter()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    # Export
+
+    def _start_exporter(self):
+        # Threads don't survive a fork, so start one per worker process
+        with self._lock:
+            if self._exporter_pid == os.getpid():
+                return
+            self._exporter_pid = os.getpid()
+            self._exporter = exporter_for(self.export_target)
+        threading.Thread(target=self._export_loop, name='trace-export', daemon=True).start()
+
+    def _export_loop(self):
+        while True:
+            traces = [self._queue.get()]
+            while len(traces) < self.batch_size:
+                try:
+                    traces.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._exporter.export([span.to_dict() for trace in traces for span in trace.spans])
+            except Exception:
+                # Tracing must never take the app down; the batch is lost
+                self.export_errors += 1
+
+    # Flask
+
+    def _name_request(self):
+        root = _current.get()
+        if root is not None and request.url_rule is not None:
+            root.name = f'{request.method} {request.url_rule.rule}'
+            root.attributes['http.route'] = request.url_rule.rule
+            root.attributes['endpoint'] = request.endpoint
+
+    def _render_started(self, sender, template, context, **extra):
+        self.start(f'render {template.name}')
+
+    def _render_finished(self, sender, template, context, **extra):
+        span = _current.get()
+        if span is not None and span.name == f'render {template.name}':
+            self.finish(span)
+
+    # SQLAlchemy
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is None or _current.get() is None:
+            return
+        statement = _WHITESPACE.sub(' ', statement).strip()
+        context._trace_span = self.start(f"db {statement.split(' ', 1)[0].upper()}",
+                                         **{'db.statement': statement[:STATEMENT_CHARS]})
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, '_trace_span', None)
+        if span is not None:
+            span.attributes['db.rows'] = cursor.rowcount
+            context._trace_span = None
+            self.finish(span)
+
+    def _handle_error(self, exception_context):
+        span = getattr(exception_context.execution_context, '_trace_span', None)
+        if span is not None:
+            exception_context.execution_context._trace_span = None
+            self.finish(span, exception_context.original_exception)
+
+
+class TracingMiddleware:
+    """Opens the root span around the whole WSGI call, including streaming the response body."""
+
+    def __init__(self, tracer, wsgi_app):
+        self.tracer = tracer
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        root = self.tracer.start_trace(method, environ.get('HTTP_TRACEPARENT'),
+                                       **{'http.method': method, 'http.target': environ.get('PATH_INFO', '')})
+
+        def traced_start_response(status, headers, exc_info=None):
+            root.attributes['http.status_code'] = int(status.split(' ', 1)[0])
+            return start_response(status, headers, exc_info)
+
+        try:
+            app_iter = self.wsgi_app(environ, traced_start_response)
+        except BaseException as e:
+            self.tracer.end_trace(root, e)
+            raise
+        return ClosingIterator(app_iter, lambda: self.tracer.end_trace(root))
+
+
+class TracedJSONProvider:
+    """Wraps the app's JSON provider so serialization shows up as spans."""
+
+    def __init__(self, tracer, provider):
+        self._tracer = tracer
+        self._provider = provider
+
+    def dumps(self, obj, **kwargs):
+        with self._tracer.span('json.dumps'):
+            return self._provider.dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        with self._tracer.span('json.response'):
+            return self._provider.response(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._provider, name)
+
+
+class TracedQueuePool(QueuePool):
+    """QueuePool whose checkouts are spans: the wait for a free connection, or the time to open one.
+
+    Set as the engine's poolclass (create_app does when tracing is on); dispose() and
+    recreate() keep the class.
+    """
+
+    def _do_get(self):
+        span = tracer.start('db.pool.checkout', **{'db.pool.size': self.size(),
+                                                   'db.pool.checked_out': self.checkedout()})
+        try:
+            connection = super()._do_get()
+        except BaseException as e:
+            tracer.finish(span, e)
+            raise
+        tracer.finish(span)
+        return connection
+
+
+class TracedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        with tracer.span('redis pipeline', **{'redis.commands': len(self.command_stack)}):
+            return super().execute(raise_on_error)
+
+
+class TracedRedis(redis.Redis):
+    """redis.Redis with a span per command, and per pipeline execute."""
+
+    def execute_command(self, *args, **options):
+        with tracer.span(f'redis {args[0]}'):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TracedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def redis_class():
+    """The class clients.py builds Redis clients with."""
+    return TracedRedis if tracer.enabled else redis.Redis
+
+
+tracer = Tracer(
+    os.environ.get('TRACING', 'False').lower() in ['true', '1', 't'],
+    os.environ.get('TRACE_EXPORT', 'traces/spans.jsonl'),
+    float(os.environ.get('TRACE_SAMPLE_RATE', 0.01)),
+    float(os.environ.get('TRACE_SLOW_MS', 100)),
+    int(os.environ.get('TRACE_MAX_SPANS', 500)),
+    int(os.environ.get('TRACE_QUEUE_SIZE', 1000)),
+)
@@ -0,0 +1,232 @@
+"""Live visit feed: logged visits go to a Redis Stream and out to dashboards over Server-Sent Events.
+
+Redirects only append to an in-process buffer; a background thread per worker writes it to
+the stream with XADD in one pipeline every `flush_interval` seconds, capped at about `maxlen`
+entries. On the reading side, one thread per worker blocks on XREAD and hands each entry to
+every /visits/stream connection in that worker, so the number of dashboards open changes
+nothing for Redis or the database. A connection that comes back with Last-Event-ID (browsers
+send it when an EventSource reconnects) is first sent what it missed, read with XRANGE.
+"""
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime as dt
+
+from .clients import redis_client
+from .models import country_names
+
+log = logging.getLogger('project.visit_feed')
+
+STREAM_KEY = 'visits:feed'
+STREAM_ID = re.compile(r'^\d+-\d+$')
+_CLOSED = object()
+
+
+def _order(entry_id):
+    milliseconds, sequence = entry_id.split('-')
+    return int(milliseconds), int(sequence)
+
+
+def visit_event(fields):
+    """The stream entry as the visits table shows a row (see Visit.to_dict)."""
+    return {
+        'shortlink': {'short_url': fields.get('short_url')},
+        'ip_address': fields.get('ip_address'),
+        'user_agent': fields.get('user_agent'),
+        'country': fields.get('country'),
+        'country_name': country_names().get(fields.get('country'), 'Unknown'),
+        'created_at': fields.get('created_at'),
+    }
+
+
+def _message(entry_id, fields):
+    return f"id: {entry_id}\ndata: {json.dumps(visit_event(fields))}\n\n"
+
+
+class VisitFeed:
+    """Publishes visits to a capped Redis Stream and fans them out to SSE subscribers.
+
+    `backlog` entries are sent to a new connection that has no Last-Event-ID, and a
+    connection is closed after `max_seconds` so it doesn't hold a worker thread forever; the
+    browser reconnects `retry_ms` later and resumes where it left off. A subscriber that
+    falls `max_lag` reads behind is closed the same way. Every open stream holds a worker
+    thread, so a worker takes at most `max_streams` of them.
+    """
+
+    def __init__(self, redis_client, stream_key=STREAM_KEY, maxlen=10000, flush_interval=0.1, max_pending=10000,
+                 backlog=50, heartbeat=15, max_seconds=300, retry_ms=2000, max_lag=1000, block_ms=5000, max_streams=1):
+        self.redis_client = redis_client
+        self.stream_key = stream_key
+        self.maxlen = maxlen
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.backlog = backlog
+        self.heartbeat = heartbeat
+        self.max_seconds = max_seconds
+        self.retry_ms = retry_ms
+        self.max_lag = max_lag
+        self.block_ms = block_ms
+        self.max_streams = max_streams
+        self.enabled = False
+        self.dropped = 0
+        self._pending = []
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._publisher_pid = None
+        self._reader_pid = None
+
+    def init_app(self, app):
+        self.enabled = True
+
+    # Publishing
+
+    def publish(self, short_url, ip_address, user_agent, country):
+        if not self.enabled:
+            return
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                # Redis is down or slow: the feed loses visits, redirects don't wait
+                self.dropped += 1
+                return
+            self._pending.append({'short_url': short_url, 'ip_address': ip_address or '',
+                                  'user_agent': user_agent or '', 'country': country or 'XX',
+                                  'created_at': dt.now().isoformat()})
+        # Threads don't survive a fork, so start one per worker process
+        if self._publisher_pid != os.getpid():
+            self._start_publisher()
+
+    def _start_publisher(self):
+        with self._lock:
+            if self._publisher_pid == os.getpid():
+                return
+            if self._publisher_pid is not None:
+                # Visits inherited from the parent are published by the parent
+                self._pending = []
+            self._publisher_pid = os.getpid()
+        threading.Thread(target=self._publish_loop, name="visit-feed-publisher", daemon=True).start()
+
+    def _publish_loop(self):
+        failing = False
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                failing = False
+            except Exception:
+                # The batch is lost for the feed (the visits table has it); logged once per outage
+                if not failing:
+                    log.warning("Visit feed publish failed", exc_info=True)
+                failing = True
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        for fields in pending:
+            # Approximate trimming lets Redis drop whole nodes instead of single entries
+            pipe.xadd(self.stream_key, fields, maxlen=self.maxlen, approximate=True)
+        pipe.execute()
+
+    # Subscribing
+
+    def full(self):
+        return len(self._subscribers) >= self.max_streams
+
+    def events(self, last_id=None):
+        """Yield the SSE text of the entries after `last_id`, as they come, or None when there is nothing to send for `heartbeat` seconds."""
+        subscriber = queue.Queue()
+        with self._lock:
+            self._subscribers.add(subscriber)
+            start_reader = self._reader_pid != os.getpid()
+            if start_reader:
+                self._reader_pid = os.getpid()
+        try:
+            if start_reader:
+                self._start_reader()
+            # Subscribed first, so nothing added while the missed entries are read falls in between
+            if last_id is not None and STREAM_ID.match(last_id):
+                # After a long absence only the newest `max_lag`, so they join up with what comes next
+                missed = self.redis_client.xrevrange(self.stream_key, min=f'({last_id}', count=self.max_lag)[::-1]
+            else:
+                missed = self.redis_client.xrevrange(self.stream_key, count=self.backlog)[::-1]
+            sent = _order(missed[-1][0]) if missed else (0, 0)
+            if missed:
+                yield ''.join(_message(entry_id, fields) for entry_id, fields in missed)
+            closes = time.monotonic() + self.max_seconds
+            while (remaining := closes - time.monotonic()) > 0:
+                try:
+                    batch = subscriber.get(timeout=min(self.heartbeat, remaining))
+                except queue.Empty:
+                    yield None
+                    continue
+                if batch is _CLOSED:
+                    return
+                new = [message for order, message in batch if order > sent]
+                if new:
+                    sent = batch[-1][0]
+                    yield ''.join(new)
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    def _start_reader(self):
+        # Read from the newest entry now, before the subscriber reads what it missed, so that
+        # nothing added in between is lost ('$' would only start from the first XREAD)
+        try:
+            newest = self.redis_client.xrevrange(self.stream_key, count=1)
+        except Exception:
+            with self._lock:
+                self._reader_pid = None
+            raise
+        threading.Thread(target=self._read_loop, args=(newest[0][0] if newest else '0-0',),
+                         name="visit-feed-reader", daemon=True).start()
+
+    def _read_loop(self, last_id):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    # Started again by the next subscriber
+                    self._reader_pid = None
+                    return
+            try:
+                entries = self.redis_client.xread({self.stream_key: last_id}, block=self.block_ms, count=500)
+            except Exception:
+                log.warning("Visit feed read failed", exc_info=True)
+                time.sleep(1)
+                continue
+            for _, stream_entries in entries:
+                last_id = stream_entries[-1][0]
+                # Encoded once for every subscriber, and sent to each in one write
+                batch = [(_order(entry_id), _message(entry_id, fields)) for entry_id, fields in stream_entries]
+                with self._lock:
+                    subscribers = list(self._subscribers)
+                for subscriber in subscribers:
+                    if subscriber.qsize() >= self.max_lag:
+                        # Too slow to keep up: it reconnects and catches up with XRANGE
+                        subscriber.put(_CLOSED)
+                        with self._lock:
+                            self._subscribers.discard(subscriber)
+                    else:
+                        subscriber.put(batch)
+
+    def stream(self, last_id=None):
+        """The text/event-stream body for one connection."""
+        yield f"retry: {self.retry_ms}\n\n"
+        for events in self.events(last_id):
+            # A comment line when idle, so proxies don't close the connection
+            yield events if events is not None else ": keep-alive\n\n"
+
+
+visit_feed = VisitFeed(
+    redis_client,
+    maxlen=int(os.environ.get('VISIT_FEED_MAXLEN', 10000)),
+    max_seconds=int(os.environ.get('VISIT_FEED_MAX_SECONDS', 300)),
+    # By default a worker keeps one thread for everything else
+    max_streams=int(os.environ.get('VISIT_FEED_MAX_STREAMS', max(1, int(os.environ.get('GUNICORN_THREADS', 2)) - 1))),
+)
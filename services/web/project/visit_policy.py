@@ -0,0 +1,67 @@
+import os
+import random
+import re
+from functools import lru_cache
+
+# Crawlers, link unfurlers, uptime checks and HTTP libraries; matched anywhere in the user agent.
+# k6 is left out on purpose: load tests are meant to log their visits
+DEFAULT_BOT_PATTERN = (
+    r'bot|crawl|spider|slurp|archiver|facebookexternalhit|embedly|headless|lighthouse'
+    r'|monitor|uptime|pingdom|statuscake|health.?check|curl|wget|httpie|python-requests|python-urllib'
+    r'|aiohttp|go-http-client|okhttp|java/|libwww'
+)
+
+
+class VisitPolicy:
+    """Decides whether a redirect logs a visit, and what the logged row stands for.
+
+    Bots (user agents matching `bot_pattern`, or no user agent at all) are not logged unless
+    `log_bots`. Other visits are logged at the link's visit_sample_rate, or `sample_rate` when
+    the link has none: a rate of 0.01 keeps one visit in a hundred, and each kept row gets a
+    sample_weight of 100 so counts summed over the weights (queries.visit_totals) estimate
+    the real number. A rate of 0 opts the link out. Clicks are counted either way.
+    """
+
+    def __init__(self, sample_rate=1.0, bot_pattern=DEFAULT_BOT_PATTERN, log_bots=False, cache_size=10000):
+        self.sample_rate = sample_rate
+        self.log_bots = log_bots
+        self._bots = re.compile(bot_pattern, re.IGNORECASE) if bot_pattern else None
+        # Few distinct user agents make up most traffic, so the regex runs once per agent
+        self.is_bot = lru_cache(maxsize=cache_size)(self._match)
+
+    def _match(self, user_agent):
+        if not user_agent:
+            return True
+        return self._bots is not None and self._bots.search(user_agent) is not None
+
+    def skips(self, user_agent):
+        """True if visits from this user agent are never logged."""
+        return not self.log_bots and self.is_bot(user_agent)
+
+    def rate(self, link_rate):
+        return self.sample_rate if link_rate is None else link_rate
+
+    def weight(self, link_rate, draw=None):
+        """sample_weight of the visit if it is sampled, None if it isn't logged."""
+        rate = self.rate(link_rate)
+        if rate >= 1:
+            return 1.0
+        if rate <= 0 or (random.random() if draw is None else draw) >= rate:
+            return None
+        return 1 / rate
+
+
+def check_rate(rate):
+    """A per-link visit_sample_rate from user input: None, or a number from 0 to 1."""
+    if rate is None:
+        return None
+    if isinstance(rate, bool) or not isinstance(rate, (int, float)) or not 0 <= rate <= 1:
+        raise ValueError('visit_sample_rate must be a number from 0 to 1, or null')
+    return float(rate)
+
+
+visit_policy = VisitPolicy(
+    float(os.environ.get('VISIT_SAMPLE_RATE', 1)),
+    os.environ.get('VISIT_BOT_PATTERN', DEFAULT_BOT_PATTERN),
+    os.environ.get('VISIT_LOG_BOTS', 'False').lower() in ['true', '1', 't'],
+)
@@ -1,26 +1,30 @@
 import os
-import redis
-from project import app, db
-from project.models import ShortLink
-
-redis_client = redis.Redis(
-    host=os.environ.get("REDIS_HOST", "redis"),
-    port=int(os.environ.get("REDIS_PORT", 6379)),
-    db=0,
-    decode_responses=True
-)
+from project.cache_backends import link_cache
+from project.canonical import canonicalizer
 
 NUM_FIXED_URLS = int(os.environ.get('NUM_FIXED_URLS', 10000))
 
+
 def seed_redis_shortlinks():
-    print(f"Seeding {NUM_FIXED_URLS} shortlinks into Redis...")
+    if link_cache.name in ('lru', 'none'):
+        # An in-process cache lives in each web worker; it fills up from the first requests instead
+        print(f"CACHE_BACKEND={link_cache.name} can't be seeded from another process, skipping.")
+        return
+    print(f"Seeding {NUM_FIXED_URLS} shortlinks into the {link_cache.name} cache...")
+    # Batched: one round trip per 1000 links (per shard when REDIS_NODES is set)
+    # Keyed by canonical URL, like the by_long lookups
+    links = ((canonicalizer.canonicalize(f"https://example.com/{i}"), f"t{i}") for i in range(NUM_FIXED_URLS))
+    # Seeded entries don't expire
+    if link_cache.name == 'postgres':
+        # The table is reached through the app's database session
+        from project.wsgi import app
+        with app.app_context():
+            link_cache.set_many(links, ttl=0)
+    else:
+        link_cache.set_many(links, ttl=0)
 
-    for i in range(NUM_FIXED_URLS):
-        original_url = f"https://example.com/{i}"
-        short_url = f"t{i}"
-        redis_client.set(f"longurl:{original_url}", short_url)
+    print("✅ Cache seeding complete!")
 
-    print("✅ Redis seeding complete!")
 
 if __name__ == "__main__":
     seed_redis_shortlinks()